@@ -8,17 +8,21 @@ import argparse, json, os, sys, time
 from pathlib import Path
 from typing import List, Dict, Any
 from openai import OpenAI
+from omikuji_llm_cache import add_cache_args, open_cache, cached_chat
+from omikuji_batching import plan_batches, call_split
 
 ap = argparse.ArgumentParser()
 ap.add_argument("--input", required=True, help="input JSON file (e.g., dist/omikuji.final.json)")
 ap.add_argument("--output", default=None, help="output JSON file (default: overwrite input safely)")
 ap.add_argument("--model", default="gpt-4o-mini", help="OpenAI model (e.g., gpt-4o-mini, gpt-4.1)")
-ap.add_argument("--batch", type=int, default=20, help="poems per request (recommend 10-20)")
+ap.add_argument("--batch", type=int, default=20, help="max poems per request (recommend 10-20)")
+ap.add_argument("--token-budget", type=int, default=6000, help="estimated prompt+response tokens per request")
 ap.add_argument("--temperature", type=float, default=0.2)
 ap.add_argument("--seed", type=int, default=42)
 ap.add_argument("--dry-run", action="store_true")
 ap.add_argument("--force", action="store_true", help="retranslate & overwrite even if translations exist")
 ap.add_argument("--ids", type=str, default="", help="comma-separated poem IDs to process (e.g., 1,2,3). If empty, process all.")
+add_cache_args(ap)
 args = ap.parse_args()
 
 src_path = Path(args.input)
@@ -70,6 +74,7 @@ if not targets:
     print("[OK] nothing to do."); sys.exit(0)
 
 client = OpenAI()
+cache = open_cache(args)
 
 # ---- Structured Output schema ----
 schema = {
@@ -125,27 +130,21 @@ def call_api(batch_items):
     # 1) プロンプト
     prompt = build_prompt(batch_items)
 
-    # 2) 呼び出し（Chat Completions + JSONモード）
-    resp = client.chat.completions.create(
-        model=args.model,
-        messages=[
-            {"role": "system", "content":
-             "You translate Classical Chinese five-character quatrains faithfully. "
-             "Read each 4-line poem as a whole, then output per-line JA/EN with no added subjects or commentary. "
-             "Return ONLY JSON. No extra keys, no notes, no prose."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=args.temperature,
-        response_format={"type": "json_object"}
-    )
+    # 2) 呼び出し（Chat Completions + JSONモード、同一プロンプトはキャッシュから再生）
+    messages = [
+        {"role": "system", "content":
+         "You translate Classical Chinese five-character quatrains faithfully. "
+         "Read each 4-line poem as a whole, then output per-line JA/EN with no added subjects or commentary. "
+         "Return ONLY JSON. No extra keys, no notes, no prose."},
+        {"role": "user", "content": prompt}
+    ]
 
-    raw = resp.choices[0].message.content
+    # 3) パース → 正規化（通った応答だけキャッシュされる）
+    return cached_chat(client, cache, args.model, messages, args.temperature,
+                       parse=lambda obj: normalize_results(obj, batch_items))
 
-    # 3) まず素直にパース
-    try:
-        obj = json.loads(raw)
-    except Exception as e:
-        raise RuntimeError(f"JSON parse failed: {e}\n--- RAW ---\n{raw}")
+def normalize_results(obj, batch_items):
+    raw = json.dumps(obj, ensure_ascii=False)
 
     # 4) 受信フォーマットを頑丈化して正規形に補正
     # 期待正規形: {"results":[{"id":int,"lines":[{"orig":str,"ja":str,"en":str}×4]}]}
@@ -228,9 +227,13 @@ B = max(1, args.batch)
 changed_poems = 0
 log: List[str] = []
 
-for i in range(0, len(targets), B):
-    chunk = targets[i:i+B]
-    result_map = call_api(chunk)
+# 推定トークンで chunk を組み、失敗したら半分ずつ割って再送
+for chunk in plan_batches(targets, args.token_budget, B):
+    result_map, fails, calls = call_split(lambda part, depth: call_api(part), chunk)
+    if calls > 1:
+        log.append(f"[SPLIT] ids={[it['id'] for it in chunk]} calls={calls} failed={len(fails)}")
+    for it, err in fails:
+        log.append(f"[ERR] id={it['id']} API failed: {err}")
     for item in chunk:
         rid = item["id"]
         if rid not in result_map:
@@ -243,6 +246,8 @@ for i in range(0, len(targets), B):
     time.sleep(0.1)
 
 print(f"[INFO] poems updated: {changed_poems}")
+cache.close()
+print(cache.summary())
 
 final_json = json.dumps(data, ensure_ascii=False, indent=2)
 if args.dry_run:
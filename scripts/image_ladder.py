@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+image_ladder.py
+- 1枚の元画像から複数幅 × 複数形式（WebP/AVIF/JPEG）のレスポンシブ画像を作る（optimize-images.py / optimize-kannon100-v3.py 共通）
+- 元画像の decode は1回だけ（JPEG は最大幅を割らない範囲で縮小デコード）。幅は大きい順に、直前の段から LANCZOS で縮める
+- エンコードはスレッドで並列（Pillow のエンコーダは GIL を外して走る）
+- 出力名: 先頭の幅は <base>.<ext>、以降は <base>-<幅>.<ext>（従来の galaxy.webp / galaxy-800.webp / galaxy-500.webp と同じ）。
+  JPEG は元画像（<base>.jpg）と重ならないよう全段 <base>-<幅>.jpg
+- 台帳（image_manifest.EncodeManifest）を渡すと、全出力が最新なら decode もしない。古い出力だけエンコードし直す
+- 品質は形式ごとの固定値か、image_quality.QualitySearch（目標バイト数／SSIM 下限から画像ごとに探索）。
+  探索は縮小済みの段をメモリ上でエンコードし直すだけで、元画像の decode は1回のまま
+- srcset.json: Next.js 側がそのまま import できる {キー: {width, height, src, sources: {MIMEタイプ: srcset}}}
+"""
+import io, json, os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from PIL import Image, features
+
+from image_loader import open_reduced
+from image_quality import QualitySearch
+
+# 形式名 -> (Pillow の形式, MIME, 拡張子, 追加の保存オプション)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp", {"method": 6}),
+    "avif": ("AVIF", "image/avif", "avif", {"speed": 6}),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", {"optimize": True, "progressive": True}),
+}
+DEFAULT_QUALITY = {"webp": 85, "avif": 60, "jpeg": 82}
+
+def parse_formats(spec: str) -> List[str]:
+    """"webp,avif" -> ["webp", "avif"]。この Pillow で書けない形式は警告して外す"""
+    out = []
+    for name in (s.strip().lower() for s in spec.split(",") if s.strip()):
+        if name not in FORMATS:
+            raise ValueError(f"unknown image format: {name} (choose from {', '.join(FORMATS)})")
+        if name == "avif" and not features.check("avif"):
+            print("Warning: this Pillow has no AVIF encoder; skipping avif")
+            continue
+        out.append(name)
+    return out
+
+def parse_widths(spec: str) -> List[int]:
+    return [int(s) for s in spec.split(",") if s.strip()]
+
+def output_path(out_dir: Path, basename: str, widths: Sequence[int], width: int, fmt: str) -> Path:
+    suffix = "" if width == widths[0] and fmt != "jpeg" else f"-{width}"
+    return Path(out_dir) / f"{basename}{suffix}.{FORMATS[fmt][2]}"
+
+def rung_budgets(search: Optional[QualitySearch], widths: Sequence[int], formats: Sequence[str]) -> Dict[int, Optional[int]]:
+    """元画像1枚の予算を各出力へ面積（幅の2乗）比で割り振る（形式ごとに同額）。予算なしなら None"""
+    if search is None or search.budget is None:
+        return {w: None for w in widths}
+    total = sum(w * w for w in widths) * len(formats)
+    return {w: max(1, search.budget * w * w // total) for w in widths}
+
+def rung_settings(widths: Sequence[int], width: int, fmt: str, quality: Dict[str, int],
+                  search: Optional[QualitySearch] = None, budget: Optional[int] = None) -> Dict[str, Any]:
+    """台帳のキーに入れる設定（段の並びも含める: 小さい段は直前の段から縮めるので並びが変わると画素が変わる）"""
+    return {"max_width": width, "quality": search.settings(budget) if search else quality[fmt],
+            "format": fmt, "options": FORMATS[fmt][3],
+            "alpha": "flatten-white", "decode": "draft", "cascade": sorted(widths, reverse=True)}
+
+def _flatten(img: Image.Image) -> Image.Image:
+    if img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        return background
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def _encode_bytes(img: Image.Image, fmt: str, quality: int) -> bytes:
+    kind, _, _, opts = FORMATS[fmt]
+    buf = io.BytesIO()
+    img.save(buf, kind, quality=quality, **opts)
+    return buf.getvalue()
+
+def _encode(task) -> Dict[str, Any]:
+    """{"quality": 使った品質, "search": 探索の記録 or None}"""
+    img, path, fmt, quality, search, budget = task
+    if search is None:
+        kind, _, _, opts = FORMATS[fmt]
+        img.save(path, kind, quality=quality, **opts)
+        return {"quality": quality, "search": None}
+    q, data, info = search.pick(img, lambda im, q: _encode_bytes(im, fmt, q), budget)
+    Path(path).write_bytes(data)
+    return {"quality": q, "search": dict(info, budget=budget)}
+
+def ladder_plan(out_dir: Path, basename: str, widths: Sequence[int], formats: Sequence[str],
+                quality: Dict[str, int], search: Optional[QualitySearch] = None) -> List[Tuple[int, str, Path, Dict[str, Any]]]:
+    """[(幅, 形式, 出力パス, 台帳用の設定)]（widths × formats の順）"""
+    budgets = rung_budgets(search, widths, formats)
+    return [(w, fmt, output_path(out_dir, basename, widths, w, fmt),
+             rung_settings(widths, w, fmt, quality, search, budgets[w]))
+            for w in widths for fmt in formats]
+
+def fresh_outputs(manifest, src: Path, plan, force: bool = False) -> Set[Tuple[int, str]]:
+    """台帳上で最新の (幅, 形式)。force なら空"""
+    if force or manifest is None:
+        return set()
+    return {(w, fmt) for w, fmt, path, settings in plan if manifest.is_fresh(src, path, settings)}
+
+def build_ladder(src: Path, out_dir: Path, basename: str, widths: Sequence[int], formats: Sequence[str],
+                 quality: Optional[Dict[str, int]] = None, skip: Set[Tuple[int, str]] = frozenset(),
+                 workers: Optional[int] = None, search: Optional[QualitySearch] = None) -> List[Dict[str, Any]]:
+    """src の全段・全形式を作る（skip の (幅, 形式) は既存ファイルの寸法を読むだけ。全部 skip なら decode もしない）。
+    search を渡すと出力ごとに品質を探索（quality は使わない）。
+    戻り値: [{"rung","width","height","format","path","bytes","encoded","quality","search"}]（widths × formats の順。
+    rung は段の幅、width/height は実際の寸法＝元画像が段より小さければ元のまま。
+    quality/search はエンコードした出力だけ（skip した出力は None）"""
+    q = dict(DEFAULT_QUALITY, **(quality or {}))
+    plan = ladder_plan(out_dir, basename, widths, formats, q, search)
+    budgets = rung_budgets(search, widths, formats)
+    for _, _, path, _ in plan:
+        if Path(path).resolve() == Path(src).resolve():
+            raise RuntimeError(f"ladder output would overwrite its source: {path}")
+
+    sized: Dict[int, Image.Image] = {}
+    if any((w, fmt) not in skip for w, fmt, _, _ in plan):
+        img, (w0, h0) = open_reduced(src, fit=(max(widths), None), mode=None)
+        cur = _flatten(img)
+        for w in sorted(set(widths), reverse=True):
+            if w0 > w:
+                target = (w, int(h0 * w / w0))
+                if cur.size != target:
+                    cur = cur.resize(target, Image.Resampling.LANCZOS)
+            sized[w] = cur
+
+    todo = [(w, fmt) for w, fmt, _, _ in plan if (w, fmt) not in skip]
+    tasks = [(sized[w], path, fmt, q[fmt], search, budgets[w]) for w, fmt, path, _ in plan if (w, fmt) not in skip]
+    done: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    if tasks:
+        n = workers or min(len(tasks), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=n) as ex:
+            done = dict(zip(todo, ex.map(_encode, tasks)))
+
+    out = []
+    for w, fmt, path, _ in plan:
+        if w in sized:
+            size = sized[w].size
+        else:
+            with Image.open(path) as im:   # ヘッダだけ読む
+                size = im.size
+        res = done.get((w, fmt), {})
+        out.append({"rung": w, "width": size[0], "height": size[1], "format": fmt, "path": path,
+                    "bytes": path.stat().st_size, "encoded": (w, fmt) not in skip,
+                    "quality": res.get("quality"), "search": res.get("search")})
+    return out
+
+def record_ladder(manifest, src: Path, widths: Sequence[int], items: List[Dict[str, Any]],
+                  quality: Optional[Dict[str, int]] = None, search: Optional[QualitySearch] = None):
+    """build_ladder でエンコードした出力を台帳へ"""
+    q = dict(DEFAULT_QUALITY, **(quality or {}))
+    formats = list(dict.fromkeys(item["format"] for item in items))
+    budgets = rung_budgets(search, widths, formats)
+    for item in items:
+        if item["encoded"]:
+            manifest.record(src, item["path"], rung_settings(widths, item["rung"], item["format"], q,
+                                                             search, budgets[item["rung"]]))
+
+def run_ladder(src: Path, out_dir: Path, basename: str, widths: Sequence[int], formats: Sequence[str],
+               quality: Optional[Dict[str, int]] = None, manifest=None, force: bool = False,
+               workers: Optional[int] = None, search: Optional[QualitySearch] = None) -> List[Dict[str, Any]]:
+    """台帳で最新の出力は飛ばして build_ladder し、作り直した分を台帳へ記録"""
+    q = dict(DEFAULT_QUALITY, **(quality or {}))
+    skip = fresh_outputs(manifest, src, ladder_plan(out_dir, basename, widths, formats, q, search), force)
+    items = build_ladder(src, out_dir, basename, widths, formats, q, skip=skip, workers=workers, search=search)
+    if manifest is not None:
+        record_ladder(manifest, src, widths, items, q, search)
+    return items
+
+def srcset_entry(items: List[Dict[str, Any]], url_of) -> Dict[str, Any]:
+    """build_ladder の結果 → {width, height, src, sources: {MIME: "url 500w, url 800w, ..."}}。
+    元画像が段より小さくて同じ幅になった段は1つにまとめる"""
+    sources: Dict[str, str] = {}
+    for fmt in dict.fromkeys(i["format"] for i in items):
+        seen, parts = set(), []
+        for i in sorted((i for i in items if i["format"] == fmt), key=lambda i: i["width"]):
+            if i["width"] in seen:
+                continue
+            seen.add(i["width"])
+            parts.append(f"{url_of(i['path'])} {i['width']}w")
+        sources[FORMATS[fmt][1]] = ", ".join(parts)
+    largest = max(items, key=lambda i: (i["width"], i["format"] == "webp"))
+    fallback = [i for i in items if i["width"] == largest["width"]]
+    src = next((i for i in fallback if i["format"] == "webp"), fallback[0])
+    return {"width": largest["width"], "height": largest["height"], "src": url_of(src["path"]), "sources": sources}
+
+def write_srcset(path: Path, entries: Dict[str, Dict[str, Any]]) -> bool:
+    """srcset.json を書く（中身が同じなら書かない）。書いたら True"""
+    text = json.dumps(dict(sorted(entries.items())), ensure_ascii=False, indent=2) + "\n"
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return False
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+    return True
+
+def public_url(root: Path):
+    """public/ 配下のパス -> サイト上の URL（/gates/galaxy.webp など）"""
+    public = Path(root) / "public"
+    return lambda p: "/" + Path(os.path.relpath(p, public)).as_posix()
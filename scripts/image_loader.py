@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+image_loader.py
+- 縮小前提の画像読み込み（optimize-images.py / optimize-kannon100-v3.py / アウトプット/ の壁紙・商品画像・御籤カード）
+- JPEG は Image.draft() で DCT 段階の 1/2・1/4・1/8 縮小デコード（全画素を展開しないので速く、メモリも縮小率の2乗で減る）
+- 縮小率は「その後の LANCZOS で作る最終サイズ以上」を保つ最大の 2 の冪。仕上げの LANCZOS は呼び出し側で従来どおり
+- JPEG 以外（PNG/WebP 等）は通常どおり全体を読む
+"""
+import math
+from typing import Optional, Tuple
+
+from PIL import Image
+
+Box = Tuple[Optional[int], Optional[int]]
+
+def _need_scale(size, fit: Optional[Box], cover: Optional[Box]) -> float:
+    """最終的に必要な倍率（1 以上なら縮小デコードしない）"""
+    w, h = size
+    if fit:
+        return min([b / s for b, s in zip(fit, (w, h)) if b] or [1.0])
+    if cover:
+        return max([b / s for b, s in zip(cover, (w, h)) if b] or [1.0])
+    return 1.0
+
+def open_reduced(path, fit: Optional[Box] = None, cover: Optional[Box] = None,
+                 mode: Optional[str] = "RGB") -> Tuple[Image.Image, Tuple[int, int]]:
+    """(読み込み済み画像, 元の画素サイズ) を返す。
+    fit=(w, h): 箱に収める（thumbnail / 幅合わせ）。片方 None なら残りの辺だけで決める
+    cover=(w, h): 箱を覆う（拡大縮小→crop）
+    mode: 変換先（None ならファイルのモードのまま。RGBA を自前で合成する時など）
+    最終サイズは元サイズから計算すること（縮小デコード後の寸法から計算すると丸めで 1px ずれうる）"""
+    with Image.open(path) as im:
+        orig = im.size
+        s = _need_scale(orig, fit, cover)
+        if im.format == "JPEG" and s < 1:
+            im.draft(im.mode, (max(1, math.ceil(orig[0] * s)), max(1, math.ceil(orig[1] * s))))
+        im.load()
+        return (im.convert(mode) if mode else im.copy()), orig
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+image_manifest.py
+- 画像最適化（optimize-images.py / optimize-kannon100-v3.py）共通の「出力 → 入力ハッシュ」台帳
+- 出力ファイルごとに sha256(元画像のバイト列 + 変換設定{max_width, quality, method, alpha の扱い}) を記録し、
+  同じで出力も残っていれば再エンコードしない
+- 元画像の sha256 は (サイズ, mtime_ns) が前回と同じなら台帳の値を使う（無変更なら stat だけで判定が終わる）
+- 今回の実行で扱わなかった台帳上の出力は孤児として削除（台帳に無いファイルには触らない）
+台帳は .cache/image-manifests/<ツール名>.json（パスはリポジトリルート相対。gitignore 済みの手元キャッシュなので、
+新しい clone・CI の初回は全件エンコードし、2回目から効く）
+"""
+import hashlib, json, os
+from pathlib import Path
+from typing import Any, Dict, List
+
+MANIFEST_DIR = Path(__file__).resolve().parent.parent / ".cache" / "image-manifests"
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class EncodeManifest:
+    def __init__(self, name: str, root: Path):
+        self.path = MANIFEST_DIR / f"{name}.json"
+        self.root = Path(root)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.seen = set()
+        self.src_sha: Dict[str, str] = {}
+        self.dirty = False
+        self.reused = self.encoded = 0
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("outputs", {})
+            except (ValueError, AttributeError):
+                self.entries = {}   # 壊れた台帳は全件作り直し
+
+    def _rel(self, p: Path) -> str:
+        return Path(os.path.relpath(p, self.root)).as_posix()
+
+    def _source_sha(self, src: Path) -> str:
+        rel = self._rel(src)
+        if rel in self.src_sha:
+            return self.src_sha[rel]
+        st = src.stat()
+        sha = None
+        for e in self.entries.values():
+            if e.get("source") == rel and e.get("src_size") == st.st_size and e.get("src_mtime") == st.st_mtime_ns:
+                sha = e.get("src_sha")
+                break
+        self.src_sha[rel] = sha or file_sha256(src)
+        return self.src_sha[rel]
+
+    def key(self, src: Path, settings: Dict[str, Any]) -> str:
+        return hashlib.sha256((self._source_sha(src) + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+    def is_fresh(self, src: Path, out: Path, settings: Dict[str, Any]) -> bool:
+        """out が src と settings から作られたままなら True（この出力は今回扱った扱いになり prune されない）"""
+        rel = self._rel(out)
+        self.seen.add(rel)
+        e = self.entries.get(rel)
+        fresh = bool(e) and e.get("key") == self.key(src, settings) and out.exists() and out.stat().st_size == e.get("size")
+        if fresh:
+            self.reused += 1
+            st = src.stat()
+            if (e.get("src_size"), e.get("src_mtime")) != (st.st_size, st.st_mtime_ns):
+                # touch されただけ（中身は同じ）→ 次回は stat だけで済むよう記録を更新
+                e["src_size"], e["src_mtime"] = st.st_size, st.st_mtime_ns
+                self.dirty = True
+        return fresh
+
+    def record(self, src: Path, out: Path, settings: Dict[str, Any]):
+        rel, st = self._rel(out), src.stat()
+        self.seen.add(rel)
+        self.entries[rel] = {
+            "source": self._rel(src), "src_sha": self._source_sha(src),
+            "src_size": st.st_size, "src_mtime": st.st_mtime_ns,
+            "settings": settings, "key": self.key(src, settings), "size": out.stat().st_size,
+        }
+        self.encoded += 1
+        self.dirty = True
+
+    def prune(self) -> List[str]:
+        """今回 is_fresh/record されなかった台帳上の出力を削除して、そのパスを返す"""
+        removed = []
+        sources = set(self.src_sha) | {e.get("source") for e in self.entries.values()}
+        for rel in sorted(set(self.entries) - self.seen):
+            p = self.root / rel
+            if p.exists() and rel not in sources:   # 元画像として使われているファイルは消さない
+                p.unlink()
+            del self.entries[rel]
+            removed.append(rel)
+        if removed:
+            self.dirty = True
+        return removed
+
+    def save(self):
+        """変化があった時だけ書く（一時ファイル→置換）"""
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"outputs": dict(sorted(self.entries.items()))}, ensure_ascii=False, indent=2) + "\n",
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def summary(self, removed: List[str]) -> str:
+        return f"[manifest] 再利用 {self.reused} / 再エンコード {self.encoded} / 孤児削除 {len(removed)}"
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+image_quality.py
+- 画像ごとに品質を探す（目標バイト数／画質下限。image_ladder.build_ladder から使う）
+- 探索では decode・縮小済みの1枚をメモリ上（BytesIO）で品質だけ変えてエンコードし直す。元画像は読み直さない
+- 品質に対してバイト数も SSIM もほぼ単調に増えるので二分探索（1出力あたり 5〜8 回のエンコード）
+  - 予算あり: 予算に収まる最大の品質。ただし画質下限（min_quality / min_ssim）は割らない
+    （下限でも収まらなければ下限の品質で書き、予算超過として報告）
+  - 予算なし（min_ssim だけ）: SSIM が下限以上になる最小の品質＝下限を満たす一番小さいファイル
+- SSIM は輝度の 8×8 ブロック単位の平均（numpy なしで Pillow の BOX 縮小と ImageMath だけで計算）
+"""
+import io
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from PIL import Image, ImageMath
+
+SSIM_BLOCK = 8
+C1, C2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+def _mul(a: Image.Image, b: Image.Image) -> Image.Image:
+    return ImageMath.lambda_eval(lambda e: e["a"] * e["b"], a=a, b=b)
+
+def ssim(ref: Image.Image, test: Image.Image) -> float:
+    """ref と test（同じ寸法）の輝度 SSIM。1.0 で同一"""
+    x, y = (im.convert("L").convert("F") for im in (ref, test))
+    size = (max(1, x.width // SSIM_BLOCK), max(1, x.height // SSIM_BLOCK))
+    mx, my, exx, eyy, exy = (im.resize(size, Image.Resampling.BOX)
+                             for im in (x, y, _mul(x, x), _mul(y, y), _mul(x, y)))
+    m = ImageMath.lambda_eval(
+        lambda e: (2 * e["mx"] * e["my"] + C1) * (2 * (e["exy"] - e["mx"] * e["my"]) + C2)
+        / ((e["mx"] * e["mx"] + e["my"] * e["my"] + C1)
+           * (e["exx"] - e["mx"] * e["mx"] + e["eyy"] - e["my"] * e["my"] + C2)),
+        mx=mx, my=my, exx=exx, eyy=eyy, exy=exy)
+    # ImageStat は F 画像を 256 階調のヒストグラムで数えるので、平均は 1×1 への BOX 縮小で取る
+    return m.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+class QualitySearch:
+    """探索の条件。budget は元画像1枚あたり（全幅・全形式の合計）のバイト数。
+    プロセスプールへそのまま渡せるよう属性は素の値だけ"""
+    def __init__(self, budget: Optional[int] = None, min_ssim: Optional[float] = None,
+                 min_quality: int = 30, max_quality: int = 90):
+        if budget is None and min_ssim is None:
+            raise ValueError("QualitySearch needs a byte budget and/or min_ssim")
+        if not 1 <= min_quality <= max_quality <= 100:
+            raise ValueError(f"bad quality range: {min_quality}..{max_quality}")
+        self.budget, self.min_ssim = budget, min_ssim
+        self.min_quality, self.max_quality = min_quality, max_quality
+
+    def settings(self, budget: Optional[int]) -> Dict[str, Any]:
+        """台帳のキーに入れる設定（固定品質の代わり。budget はこの出力に割り当てたバイト数）"""
+        return {"search": "budget" if budget is not None else "ssim", "budget": budget,
+                "min_ssim": self.min_ssim, "min_quality": self.min_quality, "max_quality": self.max_quality}
+
+    def pick(self, img: Image.Image, encode: Callable[[Image.Image, int], bytes],
+             budget: Optional[int]) -> Tuple[int, bytes, Dict[str, Any]]:
+        """(品質, エンコード結果, {"attempts","ssim","over_budget"})。encode(img, 品質) -> bytes"""
+        data: Dict[int, bytes] = {}
+        scores: Dict[int, float] = {}
+
+        def enc(q):
+            if q not in data:
+                data[q] = encode(img, q)
+            return data[q]
+
+        def ssim_ok(q):
+            if q not in scores:
+                with Image.open(io.BytesIO(enc(q))) as im:
+                    scores[q] = ssim(img, im)
+            return scores[q] >= self.min_ssim
+
+        lo, hi = self.min_quality, self.max_quality
+        floor = lo
+        if self.min_ssim is not None:
+            # ssim_ok を満たす最小の品質（最高品質でも届かなければ最高品質）
+            a, b = lo, hi
+            while a < b:
+                mid = (a + b) // 2
+                if ssim_ok(mid):
+                    b = mid
+                else:
+                    a = mid + 1
+            floor = a
+        q = floor
+        if budget is not None:
+            # [floor, hi] で予算に収まる最大の品質
+            a, b = floor, hi
+            while a < b:
+                mid = (a + b + 1) // 2
+                if len(enc(mid)) <= budget:
+                    a = mid
+                else:
+                    b = mid - 1
+            q = a
+        out = enc(q)
+        if self.min_ssim is not None:
+            ssim_ok(q)   # 予算で floor より上を選んだ時も記録用に SSIM を出しておく
+        return q, out, {"attempts": len(data), "ssim": scores.get(q),
+                        "over_budget": budget is not None and len(out) > budget}
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+kannon_extract.py
+- 籤ページ HTML から見出しと四句を抜く（scrape_kannon100.py / patch_missing_kannon.py 共通）
+- 木を作らず html.parser のトークン列を1回流すだけ。テキストノード・<title>・最初の <h1> を同時に集める
+  （BeautifulSoup(html, "html.parser") の get_text と同じ区切り: script/style/template/コメント/doctype は除外、CDATA は含む）
+- 詩行判定は句読点の有無 → 漢字数の順（前コンパイル済み）。本文が見つからない時の先頭400字もこの1回のパースから作る
+"""
+import re
+from html.parser import HTMLParser
+from typing import List, Tuple
+
+_HAN_RE = re.compile(r"[一-鿿]")
+_POEM_PUNCT = ("，", "。", "．", "、")
+_SKIP_TAGS = frozenset({"script", "style", "template"})
+_PRE_TAGS = frozenset({"pre", "textarea"})
+_ASCII_WS = " \t\n\r\f"
+# bs4 の HTMLTreeBuilder が空要素として即閉じするタグ（開いた要素の stack に積まない）
+_VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem",
+                        "meta", "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame",
+                        "image", "isindex", "nextid", "spacer"})
+
+class _PageScanner(HTMLParser):
+    """開いた要素を stack で追う（終了タグは対応する開始タグまでまとめて閉じる = bs4 の木と同じ範囲）"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.nodes: List[str] = []        # テキストノード（strip 前）
+        self.buf: List[str] = []
+        self.stack: List[str] = []
+        self.skip = 0                      # stack 中の script/style/template の数
+        self.closed_void: List[str] = []   # <br> 等で開いた空要素（後から来た </br> は区切らず捨てる = bs4 と同じ）
+        self.title_at = self.h1_at = -1    # 最初の <title>/<h1> の stack 位置（開いている間だけ）
+        self.title = None                  # 最初の <title> の生テキスト
+        self.h1 = None                     # 最初の <h1> の各ノード（strip 前）
+
+    def _flush(self):
+        if self.buf:
+            s = "".join(self.buf)
+            self.buf = []
+            # bs4 と同じく ASCII 空白だけのノードは "\n" か " " に畳む（pre/textarea 内は除く）
+            if not s.strip(_ASCII_WS) and not any(t in _PRE_TAGS for t in self.stack):
+                s = "\n" if "\n" in s else " "
+            self.nodes.append(s)
+            if self.title_at >= 0:
+                self.title += s
+            if self.h1_at >= 0:
+                self.h1.append(s)
+
+    def _pop_to(self, depth: int):
+        for t in self.stack[depth:]:
+            if t in _SKIP_TAGS:
+                self.skip -= 1
+        del self.stack[depth:]
+        if self.title_at >= depth:
+            self.title_at = -1
+        if self.h1_at >= depth:
+            self.h1_at = -1
+
+    def handle_starttag(self, tag, attrs, self_closing=False):
+        self._flush()
+        if tag == "title" and self.title is None:
+            self.title, self.title_at = "", len(self.stack)
+        elif tag == "h1" and self.h1 is None:
+            self.h1, self.h1_at = [], len(self.stack)
+        if tag in _VOID_TAGS:
+            if not self_closing:
+                self.closed_void.append(tag)
+            return
+        self.stack.append(tag)
+        if tag in _SKIP_TAGS:
+            self.skip += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, self_closing=True)
+        if tag not in _VOID_TAGS:
+            self._close(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            self.closed_void.remove(tag)
+            return
+        self._close(tag)
+
+    def _close(self, tag):
+        self._flush()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i] == tag:
+                self._pop_to(i)
+                break
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.buf.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.upper().startswith("CDATA["):
+            self.buf.append(data[6:])
+            self._flush()
+
+def scan_page(html: str) -> Tuple[str, List[str]]:
+    """(見出し, strip 済みテキストノード列)。見出しは最初の <h1>（なければ <title>）"""
+    p = _PageScanner()
+    p.feed(html)
+    p.close()
+    p._flush()
+    if p.h1 is not None:
+        header = "".join(s.strip() for s in p.h1)
+    else:
+        header = p.title.strip() if p.title is not None else ""
+    return header, [s for s in (n.strip() for n in p.nodes) if s]
+
+def is_poem_line(s: str) -> bool:
+    if not any(p in s for p in _POEM_PUNCT):
+        return False
+    n = 0
+    for _ in _HAN_RE.finditer(s):
+        n += 1
+        if n >= 4:
+            return True
+    return False
+
+def pick_poem(lines: List[str]) -> List[str]:
+    poem_lines = [ln for ln in lines if is_poem_line(ln)]
+    for i in range(len(poem_lines) - 3):
+        chunk = poem_lines[i:i+4]
+        lens = [len(x) for x in chunk]
+        if max(lens) - min(lens) <= 12:
+            return chunk
+    return poem_lines[:4]
+
+def extract_page(html: str) -> Tuple[str, List[str], str]:
+    """(見出し, 四句, 本文先頭400字)。四句が取れない時の代替テキストまで1回のパースで返す"""
+    header, nodes = scan_page(html)
+    lines = [ln.strip() for s in nodes for ln in s.split("\n") if ln.strip()]
+    return header, pick_poem(lines), "\n".join(nodes)[:400]
+
+def extract_poem(html: str):
+    header, poem, _ = extract_page(html)
+    return header, poem
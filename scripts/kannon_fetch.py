@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+kannon_fetch.py
+- スクレイパー共通の HTTP 取得（scrape_kannon100.py / patch_missing_kannon.py）
+- requests.Session を1本共有（接続プールで keep-alive 再利用）し、ホストごとに
+  同時接続数（セマフォ）と送信レート（トークンバケット）を絞る → 固定 sleep なしで礼儀正しく並列取得
+- 429/503 は Retry-After（なければ指数）だけそのホストのバケットを止めて再送
+- CdxIndex: ディレクトリごとに CDX を1回（matchType=prefix）だけ引き、URL→最新スナップショットを辞書で返す
+"""
+import threading, time
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"}
+CDX_API = "https://web.archive.org/cdx/search/cdx"
+
+class TokenBucket:
+    """rate 個/秒で補充、最大 burst 個。acquire はトークンが出るまで待つ"""
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+class PoliteSession:
+    """requests.Session.get 互換（get(url, params=, headers=, timeout=)）。既存の fetch 関数にそのまま渡せる"""
+    def __init__(self, session: Optional[requests.Session] = None, per_host: int = 4,
+                 rate: float = 4.0, burst: float = 4.0, retries: int = 3):
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(4, per_host))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.per_host = max(1, per_host)
+        self.rate, self.burst, self.retries = rate, burst, retries
+        self.hosts: Dict[str, Tuple[threading.Semaphore, TokenBucket]] = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+
+    @property
+    def proxies(self):
+        return self.session.proxies
+
+    def _host(self, url: str) -> Tuple[threading.Semaphore, TokenBucket]:
+        host = urlsplit(url).hostname or ""
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (threading.Semaphore(self.per_host), TokenBucket(self.rate, self.burst))
+            return self.hosts[host]
+
+    def get(self, url: str, **kw) -> requests.Response:
+        kw.setdefault("headers", HEADERS)
+        sem, bucket = self._host(url)
+        for attempt in range(self.retries + 1):
+            with sem:
+                bucket.acquire()
+                r = self.session.get(url, **kw)
+            with self.lock:
+                self.requests += 1
+            if r.status_code not in (429, 503) or attempt == self.retries:
+                return r
+            with self.lock:
+                self.throttled += 1
+            try:
+                wait = float(r.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                wait = 2.0 * (2 ** attempt)
+            bucket.pause(min(wait, 60.0))
+        return r
+
+    def summary(self) -> str:
+        return f"[HTTP] requests={self.requests} throttled={self.throttled} hosts={len(self.hosts)}"
+
+def _url_key(url: str) -> str:
+    """CDX の original と照合するための正規化（scheme/www/:80・%エンコードの大小文字差を吸収）"""
+    sp = urlsplit(url.strip())
+    host = (sp.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = unquote(sp.path or "/")
+    return host + path + ("?" + unquote(sp.query) if sp.query else "")
+
+class CdxIndex:
+    """ディレクトリ単位の CDX prefix 問い合わせ1回で original→最新 timestamp の辞書を作り、以降の照会は辞書引き。
+    まだ読んでいないディレクトリは初回照会時に読む。prefix 問い合わせが失敗したディレクトリは
+    URL ごとの CDX 照会（従来動作）に戻す"""
+    PAGE = 5000
+
+    def __init__(self, session, from_year="2008", to_year="2026", timeout=60):
+        self.session = session
+        self.from_year, self.to_year, self.timeout = from_year, to_year, timeout
+        self.latest: Dict[str, Tuple[str, str]] = {}   # url_key -> (timestamp, original)
+        self.loaded: Dict[str, bool] = {}              # prefix -> 成功したか
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def prefix_of(url: str) -> str:
+        return url.rsplit("/", 1)[0] + "/"
+
+    def load_prefix(self, prefix: str) -> bool:
+        with self.lock:
+            if prefix in self.loaded:
+                return self.loaded[prefix]
+            ok = True
+            resume = None
+            try:
+                while True:
+                    params = {
+                        "url": prefix, "matchType": "prefix", "output": "json",
+                        "filter": "statuscode:200", "from": self.from_year, "to": self.to_year,
+                        "fl": "timestamp,original", "limit": str(self.PAGE), "showResumeKey": "true",
+                    }
+                    if resume:
+                        params["resumeKey"] = resume
+                    r = self.session.get(CDX_API, params=params, headers=HEADERS, timeout=self.timeout)
+                    self.queries += 1
+                    r.raise_for_status()
+                    rows = r.json() or []
+                    resume = None
+                    # [ヘッダ, 行..., [], [resumeKey]] の形（resumeKey は最後のページでは無い）
+                    if len(rows) >= 2 and rows[-2] == [] and len(rows[-1]) == 1:
+                        resume = rows[-1][0]
+                        rows = rows[:-2]
+                    for row in rows[1:]:
+                        if len(row) < 2: continue
+                        ts, orig = row[0], row[1]
+                        k = _url_key(orig)
+                        if k not in self.latest or ts > self.latest[k][0]:
+                            self.latest[k] = (ts, orig)
+                    if not resume:
+                        break
+            except Exception as e:
+                print(f"[WARN] CDX prefix query failed for {prefix}: {e} (fallback: per-URL lookup)")
+                ok = False
+            self.loaded[prefix] = ok
+            if ok:
+                print(f"[CDX] indexed {prefix} -> {len(self.latest)} urls total ({self.queries} queries)")
+            return ok
+
+    def covers(self, url: str) -> bool:
+        """url のディレクトリが読み込み済み（＝ lookup の None は「スナップショットなし」と確定）か"""
+        return self.load_prefix(self.prefix_of(url))
+
+    def lookup(self, url: str) -> Optional[str]:
+        hit = self.latest.get(_url_key(url))
+        return f"https://web.archive.org/web/{hit[0]}/{hit[1]}" if hit else None
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+kannon_records.py
+- kannon_100_raw.json / kannon_100.csv の追記型ストア（scrape_kannon100.py / patch_missing_kannon.py 共通）
+- 1ページ取れるたびに <raw>.records.jsonl へ1行追記して fsync → 途中で落ちても取れた分は残る
+- 同じ番号は先に入った方を採用（従来の「番号で安定ソート→先勝ちで重複除去」と同じ）
+- compact() で番号順の raw JSON / CSV に書き出し、追記ログを空にする（途中で落ちても再生は冪等）
+単体で圧縮だけ:
+  python scripts/kannon_records.py --raw tempdata/kannon_100_raw.json --csv tempdata/kannon_100.csv
+"""
+import argparse, csv, json, os, threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+class RecordStore:
+    def __init__(self, raw_path: Path, csv_path: Path, resume: bool = True):
+        """resume=False は新規（既存の raw JSON と追記ログを読まない＝従来の上書き動作）"""
+        self.raw_path, self.csv_path = Path(raw_path), Path(csv_path)
+        self.log_path = self.raw_path.with_name(self.raw_path.name + ".records.jsonl")
+        self.records: Dict[int, Dict[str, Any]] = {}
+        self.added = 0
+        self.lock = threading.Lock()
+        self.fp = None
+        if not resume:
+            if self.log_path.exists():
+                self.log_path.unlink()
+            return
+        if self.raw_path.exists():
+            for r in json.loads(self.raw_path.read_text(encoding="utf-8")):
+                if r.get("number") and r["number"] not in self.records:
+                    self.records[r["number"]] = r
+        self._replay()
+
+    def _replay(self):
+        if not self.log_path.exists():
+            return
+        raw = self.log_path.read_bytes()
+        if raw and not raw.endswith(b"\n"):
+            # 書き込み途中で落ちた末尾行は捨ててから追記を再開
+            with self.log_path.open("r+b") as f:
+                f.truncate(raw.rfind(b"\n") + 1)
+            print("[RECORDS] dropped torn journal tail")
+        n = 0
+        with self.log_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except Exception:
+                    continue
+                if r.get("number") and r["number"] not in self.records:
+                    self.records[r["number"]] = r
+                    n += 1
+        if n:
+            print(f"[RECORDS] replayed {n} records from {self.log_path}")
+
+    def numbers(self) -> set:
+        with self.lock:
+            return set(self.records)
+
+    def has(self, number: int) -> bool:
+        with self.lock:
+            return number in self.records
+
+    def add(self, rec: Dict[str, Any]) -> bool:
+        """番号付きで未登録なら追記して True。番号なし・既にある番号は何もしない"""
+        n = rec.get("number")
+        if not n:
+            return False
+        with self.lock:
+            if n in self.records:
+                return False
+            if self.fp is None:
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                self.fp = self.log_path.open("a", encoding="utf-8")
+            self.fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            self.records[n] = rec
+            self.added += 1
+            return True
+
+    def sorted_records(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [self.records[n] for n in sorted(self.records)]
+
+    def compact(self):
+        """番号順の raw JSON / CSV を書き出し（一時ファイル→置換）、追記ログを消す"""
+        rows = self.sorted_records()
+        self.raw_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.raw_path.with_name(self.raw_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.raw_path)
+
+        self.csv_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.csv_path.with_name(self.csv_path.name + ".tmp")
+        with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f); w.writerow(["number","header","poem","source_url"])
+            for r in rows:
+                w.writerow([r["number"], r["header"], " / ".join(r["poem_lines"]), r["source_url"]])
+        os.replace(tmp, self.csv_path)
+
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+            if self.log_path.exists():
+                self.log_path.unlink()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+    def missing(self, lo: int = 1, hi: int = 100) -> List[int]:
+        have = self.numbers()
+        return [n for n in range(lo, hi + 1) if n not in have]
+
+def main():
+    ap = argparse.ArgumentParser(description="Compact kannon_100 record journal into sorted raw JSON / CSV")
+    ap.add_argument("--raw", default="tempdata/kannon_100_raw.json")
+    ap.add_argument("--csv", default="tempdata/kannon_100.csv")
+    args = ap.parse_args()
+    store = RecordStore(Path(args.raw), Path(args.csv), resume=True)
+    store.compact()
+    print(f"[OK] compacted {len(store.records)} records -> {args.raw} / {args.csv}  missing={store.missing()}")
+
+if __name__ == "__main__":
+    main()
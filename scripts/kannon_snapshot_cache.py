@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+kannon_snapshot_cache.py
+- Wayback スナップショット本文のローカル保存（SQLite, zlib 圧縮）。WARC のレコードに倣い
+  スナップショットURL・timestamp・original・content-type・文字コードを本文と一緒に持つ
+- original URL → スナップショットURL の解決結果も保存（--offline で CDX を引かずに済むように）
+- スナップショットは不変なので TTL なし。--offline はキャッシュだけで解析し、ネットワークに一切出ない
+使い方:
+  python scripts/scrape_kannon100.py --base chance --out tempdata            # 取得しつつ保存
+  python scripts/scrape_kannon100.py --base chance --out tempdata --offline  # extract_poem 調整後の再解析
+"""
+import re, sqlite3, threading, time, zlib
+from pathlib import Path
+from typing import Callable, Optional
+
+from kannon_fetch import HEADERS
+
+SNAPSHOT_MODES = ("read-write", "read-only", "off")
+DEFAULT_SNAPSHOT_PATH = ".cache/kannon_snapshots.sqlite"
+_TS_RE = re.compile(r"/web/(\d{14})")
+
+class SnapshotCache:
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH, mode: str = "read-write", offline: bool = False):
+        if mode not in SNAPSHOT_MODES:
+            raise ValueError(f"unknown snapshot cache mode: {mode}")
+        self.mode = "read-only" if offline and mode == "read-write" else mode
+        self.offline = offline
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if mode == "off":
+            return
+        p = Path(path)
+        if self.mode == "read-only" and not p.exists():
+            return
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(p), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " snap_url TEXT PRIMARY KEY, timestamp TEXT, original TEXT, content_type TEXT,"
+            " encoding TEXT NOT NULL, size INTEGER NOT NULL, fetched REAL NOT NULL, body BLOB NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS resolved ("
+            " original TEXT PRIMARY KEY, snap_url TEXT NOT NULL, checked REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def resolved(self, original: str) -> Optional[str]:
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT snap_url FROM resolved WHERE original=?", (original,)).fetchone()
+        return row[0] if row else None
+
+    def remember(self, original: str, snap_url: str):
+        if self.db is None or self.mode != "read-write":
+            return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO resolved(original, snap_url, checked) VALUES (?,?,?)",
+                            (original, snap_url, time.time()))
+            self.db.commit()
+
+    def get(self, snap_url: str) -> Optional[str]:
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT encoding, body FROM snapshots WHERE snap_url=?", (snap_url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[1]).decode(row[0], errors="replace")
+
+    def put(self, snap_url: str, original: str, content: bytes, encoding: str, content_type: str = ""):
+        if self.db is None or self.mode != "read-write":
+            return
+        m = _TS_RE.search(snap_url)
+        body = zlib.compress(content, 6)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO snapshots(snap_url, timestamp, original, content_type, encoding, size, fetched, body)"
+                " VALUES (?,?,?,?,?,?,?,?)",
+                (snap_url, m.group(1) if m else "", original, content_type, encoding, len(content), time.time(), body),
+            )
+            self.db.commit()
+
+    def close(self):
+        if self.db is None:
+            return
+        with self.lock:
+            self.db.close()
+            self.db = None
+
+    def summary(self) -> str:
+        return f"[SNAPSHOT] mode={self.mode} offline={self.offline} hits={self.hits} misses={self.misses}"
+
+def add_snapshot_args(ap):
+    ap.add_argument("--snapshot-cache", default=DEFAULT_SNAPSHOT_PATH, help="Wayback 本文の保存先（SQLite）")
+    ap.add_argument("--snapshot-mode", default="read-write", choices=SNAPSHOT_MODES)
+    ap.add_argument("--offline", action="store_true", help="保存済みスナップショットだけで解析（通信しない）")
+
+def open_snapshot_cache(args) -> SnapshotCache:
+    return SnapshotCache(args.snapshot_cache, mode=args.snapshot_mode, offline=args.offline)
+
+def wayback_fetch(session, original_url: str, resolve: Callable[[object, str], Optional[str]],
+                  cache: Optional[SnapshotCache], timeout=20) -> str:
+    """original_url のスナップショット HTML。解決結果・本文ともにキャッシュ優先、offline ならキャッシュのみ。
+    resolve(session, original_url) -> スナップショットURL or None（CDX 照会）"""
+    offline = cache is not None and cache.offline
+    snap = cache.resolved(original_url) if cache is not None else None
+    if snap is None:
+        if offline:
+            raise RuntimeError(f"offline: no cached snapshot for {original_url}")
+        snap = resolve(session, original_url)
+        if not snap:
+            raise RuntimeError(f"No snapshot for {original_url}")
+        if cache is not None:
+            cache.remember(original_url, snap)
+    html = cache.get(snap) if cache is not None else None
+    if html is not None:
+        return html
+    if offline:
+        raise RuntimeError(f"offline: snapshot body not cached: {snap}")
+    r = session.get(snap, headers=HEADERS, timeout=timeout)
+    r.raise_for_status()
+    enc = r.apparent_encoding or "utf-8"
+    if cache is not None:
+        cache.put(snap, original_url, r.content, enc, r.headers.get("Content-Type", ""))
+    return r.content.decode(enc, errors="replace")
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 import json, re, io, sys, os
 
+from sync_omikuji import parse_id
+
 ROOT = "src/data/omikuji"
 JA_IN  = os.path.join(ROOT, "ja.txt")
 EN_IN  = os.path.join(ROOT, "en.txt")
@@ -18,23 +20,71 @@ def write_utf8(p, s):
     with io.open(p, "w", encoding="utf-8", newline="\n") as f:
         f.write(s)
 
+# ---- 見出し: 「第N　」(ja) /「<英語序数>: 」(en)。序数の綴りは 1..100 を起動時に1回だけ辞書へ ----
+_UNITS = ["First","Second","Third","Fourth","Fifth","Sixth","Seventh","Eighth","Ninth"]
+_TEENS_ORD = ["Tenth","Eleventh","Twelfth","Thirteenth","Fourteenth","Fifteenth","Sixteenth","Seventeenth","Eighteenth","Nineteenth"]
+_TEENS_CARD = ["Ten","Eleven","Twelve","Thirteen","Fourteen","Fifteen","Sixteen","Seventeen","Eighteen","Nineteen"]
+_TENS_CARD = ["Twenty","Thirty","Forty","Fifty","Sixty","Seventy","Eighty","Ninety"]
+_TENS_ORD = ["Twentieth","Thirtieth","Fortieth","Fiftieth","Sixtieth","Seventieth","Eightieth","Ninetieth"]
+
+def _en_ordinals():
+    """英語見出しの綴り -> 番号（sync_omikuji.to_ordinal の出力と、旧データの Eleven / Twenty 等の両方）"""
+    m = {w: n for n, w in enumerate(_UNITS, 1)}
+    for n, (o, c) in enumerate(zip(_TEENS_ORD, _TEENS_CARD), 10):
+        m[o] = m[c] = n
+    for t, (c, o) in enumerate(zip(_TENS_CARD, _TENS_ORD), 2):
+        m[c] = m[o] = t * 10
+        for u, w in enumerate(_UNITS, 1):
+            m[f"{c}-{w}"] = t * 10 + u
+    m["One Hundredth"] = m["Hundredth"] = m["One Hundred"] = 100
+    return m
+
+EN_ORDINALS = _en_ordinals()
+JA_HEAD_RE = re.compile(r"第[一二三四五六七八九十百]+　")
+EN_HEAD_RE = re.compile("(" + "|".join(sorted(map(re.escape, EN_ORDINALS), key=len, reverse=True)) + r"):(?:\s|$)")
+FIVE_CJK_RE = re.compile(r"[\u3400-\u9FFF\uF900-\uFAFF]{5}")
+LABEL_RE = re.compile(r"([^：:]+)\s*[:：]\s*(.*)")
+_NO_SPACE = str.maketrans("", "", "\u3000\u0020")
+
+def strip_spaces(s):
+    """全角・半角スペースを除去（re.sub より速い str.translate。含まなければそのまま）"""
+    return s.translate(_NO_SPACE) if (" " in s or "\u3000" in s) else s
+
+def header_id(line):
+    """見出し行なら番号、そうでなければ None"""
+    if JA_HEAD_RE.match(line):
+        return parse_id(line)
+    m = EN_HEAD_RE.match(line)
+    return EN_ORDINALS[m.group(1)] if m else None
+
+def iter_records(text):
+    """ja/en テキストを1回走査して (id, 見出し, 本文行) を順に返す。
+    先頭の見出し前の部分は空でなければ (None, "", 行) として返す"""
+    rid, header, lines = None, "", []
+    for line in text.splitlines():
+        n = header_id(line)
+        if n is None:
+            lines.append(line)
+            continue
+        if rid is not None or any(l.strip() for l in lines):
+            yield rid, header, lines
+        rid, header, lines = n, line, []
+    if rid is not None or any(l.strip() for l in lines):
+        yield rid, header, lines
+
 def split_blocks(text):
-    pat = r"(?m)^(?=第[一二三四五六七八九十百]+　|(?:First|Second|Third|Fourth|Fifth|Sixth|Seventh|Eighth|Ninth|Tenth|Eleven|Twelve|Thirteen|Fourteen|Fifteen|Sixteen|Seventeen|Eighteen|Nineteen|(?:Twenty|Thirty|Forty|Fifty|Sixty|Seventy|Eighty|Ninety)(?:-(?:First|Second|Third|Fourth|Fifth|Sixth|Seventh|Eighth|Ninth))?):\s)"
-    import re
-    return list(filter(lambda x: x.strip(), re.split(pat, text)))
-
-def tail_keep(old_block, poems_clean):
-    lines = old_block.splitlines()
-    i, m = 1, 0
-    while i < len(lines) and m < 4:
-        k = re.sub(r"[\u3000\u0020]", "", lines[i].strip()) if i < len(lines) else ""
+    return list(iter_records(text))
+
+def tail_keep(lines, poems_clean):
+    """本文行から四句（と直後の訳行）を読み飛ばし、残り（説明・カテゴリ）を返す"""
+    i, m, want = 0, 0, min(4, len(poems_clean))
+    while i < len(lines) and m < want:
+        k = strip_spaces(lines[i].strip())
         if k and k == poems_clean[m]:
             i += 1  # skip poem line
             # if next is a translation-like free line (non-empty, not 5-cjk, not label), skip it
             nxt = (lines[i].strip() if i < len(lines) else "")
-            is5  = bool(re.match(r"^[\u3400-\u9FFF\uF900-\uFAFF]{5}$", re.sub(r"[\u3000\u0020]","",nxt)))
-            isLb = bool(re.match(r"^([^：:]+)\s*[:：]\s*(.*)$", nxt))
-            if nxt and (not is5) and (not isLb):
+            if nxt and not FIVE_CJK_RE.fullmatch(strip_spaces(nxt)) and not LABEL_RE.match(nxt):
                 i += 1
             m += 1
             continue
@@ -42,15 +92,23 @@ def tail_keep(old_block, poems_clean):
     return "\n".join(lines[i:]).strip()
 
 def inject_by_core(base_text, trans_dict, core_poems_by_id):
-    blocks = split_blocks(base_text)
+    """見出しの番号で core の四句と対応付け（位置ではなく id。ずれた分割があっても後続に波及しない）"""
     out = []
     missing = set()
-    for idx, b in enumerate(blocks):
-        bid = idx + 1
-        poems = core_poems_by_id.get(bid, [])
-        header = b.splitlines()[0] if b.splitlines() else ""
+    seen, dup, unknown = set(), [], []
+    for rid, header, lines in iter_records(base_text):
+        if rid is None:
+            out.append("\n".join(lines).strip())
+            continue
+        if rid in seen:
+            dup.append(rid)
+        seen.add(rid)
+        poems = core_poems_by_id.get(rid)
+        if poems is None:
+            unknown.append(rid)
+            poems = []
         # poems_clean already space-removed
-        tail = tail_keep(b, poems)
+        tail = tail_keep(lines, poems)
         body = []
         for p in poems:
             body.append(p)  # poem (5-cjk, spaceless)
@@ -60,6 +118,8 @@ def inject_by_core(base_text, trans_dict, core_poems_by_id):
             body.append(t)
         block_new = "\n".join([header] + body + ([tail] if tail else []))
         out.append(block_new)
+    if dup: print(f"[WARN] duplicate block ids: {len(dup)} (e.g. {dup[:10]})")
+    if unknown: print(f"[WARN] block ids not in core: {len(unknown)} (e.g. {unknown[:10]})")
     return "\n".join(out) + "\n", sorted(list(missing))
 
 def main():
@@ -67,13 +127,13 @@ def main():
         sys.stderr.write("Required files missing. Need ja.txt, en.txt and core.json under src/data/omikuji.\n")
         sys.exit(2)
     core = json.load(io.open(CORE,"r",encoding="utf-8"))
-    core_poems_by_id = { int(x["id"]): [ re.sub(r"[\u3000\u0020]","",str(s)) for s in (x.get("poem_kanji") or []) ] for x in core }
+    core_poems_by_id = { int(x["id"]): [ strip_spaces(str(s)) for s in (x.get("poem_kanji") or []) ] for x in core }
 
     tja = json.load(io.open("scripts/omikuji/translations_ja.json","r",encoding="utf-8"))
     ten = json.load(io.open("scripts/omikuji/translations_en.json","r",encoding="utf-8"))
     # 正規化：キーを「スペース除去」した5字に揃える
-    tja = { re.sub(r"[\u3000\u0020]","",k): v for k,v in tja.items() }
-    ten = { re.sub(r"[\u3000\u0020]","",k): v for k,v in ten.items() }
+    tja = { strip_spaces(k): v for k,v in tja.items() }
+    ten = { strip_spaces(k): v for k,v in ten.items() }
 
     ja_in = read_utf8(JA_IN)
     en_in = read_utf8(EN_IN)
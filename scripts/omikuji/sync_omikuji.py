@@ -1,10 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import json, re, argparse
+import json, os, re, argparse, hashlib
 from pathlib import Path
 
+# --incremental: 前回の入力ハッシュと組み立て済みブロックを .cache/ に保存し、入力が同じ id は組み立てを省く
+# （状態は配布データの横に置かない。out_dir ごとに別物なので、別の out_dir の状態は使わない）
+SYNC_STATE = ".cache/omikuji_sync_state.json"
+SYNC_CHANGES = "sync_changes.json"
+SYNC_VERSION = 1   # ブロックの組み立て規則を変えたら上げる（保存済みブロックを全て無効にする）
+
 def load_json(p): return json.loads(Path(p).read_text(encoding="utf-8"))
 
+def digest(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(json.dumps(p, ensure_ascii=False, sort_keys=True).encode("utf-8")); h.update(b"\0")
+    return h.hexdigest()
+
+def replace_if_changed(tmp: Path, path: Path) -> bool:
+    """tmp と path のバイト列が同じなら tmp を捨てて False（path の mtime は変えない）"""
+    if path.exists() and path.read_bytes() == tmp.read_bytes():
+        tmp.unlink()
+        return False
+    os.replace(tmp, path)
+    return True
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    return replace_if_changed(tmp, path)
+
 KANJI_DIGITS = ["一","二","三","四","五","六","七","八","九"]
 def int_to_kanji(n:int)->str:
     if n==100: return "百"
@@ -24,23 +49,31 @@ def to_ordinal(n:int)->str:
     base = tens_names[tens] if 0<=tens<len(tens_names) else ""
     return base if ones==0 else f"{base}-{en_ord_units[ones]}"
 
+# 正規表現は読み込み時に1回だけコンパイル（エントリ数が増えても呼び出しごとの再コンパイルなし）
+ENTRY_HEAD_RE = re.compile(r"第[\d一二三四五六七八九十百〇]+|\s*\d{1,3}\s*(?:[:：]|$)")
+ID_KANJI_RE = re.compile(r"^第([\d一二三四五六七八九十百〇]+)")
+ID_NUM_RE = re.compile(r"^\s*(\d{1,3})\b")
+HAN_RE = re.compile(r"[\u4e00-\u9fff]")
+NOISE_RE = re.compile(r"===\s*TEXT START\s*===\s*", re.I)
+POEM_SPACE_RE = re.compile(r"[\u0020\u3000]+")
+
+def iter_entries(text):
+    """見出し行（第N… / N: / N）ごとに区切ったブロックを先頭から順に返す（空ブロックは飛ばす）"""
+    cur = []
+    for i, l in enumerate(text.replace("\r\n","\n").split("\n")):
+        if i and ENTRY_HEAD_RE.match(l):
+            block = "\n".join(cur).strip()
+            if block: yield block
+            cur = []
+        cur.append(l)
+    block = "\n".join(cur).strip()
+    if block: yield block
+
 def split_entries(text):
-    lines = text.replace("\r\n","\n").split("\n")
-    idx = []
-    for i,l in enumerate(lines):
-        if re.match(r"^第[\d一二三四五六七八九十百〇]+", l) or re.match(r"^\s*(\d{1,3})\s*(?:[:：]|$)", l):
-            idx.append(i)
-    if not idx or idx[0]!=0: idx = [0] + idx
-    idx = sorted(set(idx))
-    idx2 = idx + [len(lines)]
-    entries = []
-    for a,b in zip(idx2[:-1], idx2[1:]):
-        block = "\n".join(lines[a:b]).strip()
-        if block: entries.append(block)
-    return entries
+    return list(iter_entries(text))
 
 def parse_id(header):
-    m = re.search(r"^第([\d一二三四五六七八九十百〇]+)", header)
+    m = ID_KANJI_RE.search(header)
     if m:
         token = m.group(1)
         if token.isdigit(): return int(token)
@@ -51,19 +84,21 @@ def parse_id(header):
             ones = (KANJI_DIGITS.index(b)+1 if b in KANJI_DIGITS else 0)
             return tens*10+ones
         if token in KANJI_DIGITS: return KANJI_DIGITS.index(token)+1
-    m = re.match(r"^\s*(\d{1,3})\b", header)
+    m = ID_NUM_RE.match(header)
     if m: return int(m.group(1))
     return None
 
 def is_poem_line(line):
     s = line.strip()
-    if not s: return False
-    han = len(re.findall(r"[\u4e00-\u9fff]", s))
-    return 4 <= han <= 7 and (":" not in s and "：" not in s)
+    if not s or ":" in s or "：" in s: return False
+    han = 0
+    for _ in HAN_RE.finditer(s):
+        han += 1
+        if han > 7: return False
+    return han >= 4
 
 def clean_noise(s):
-    s = re.sub(r"===\s*TEXT START\s*===\s*", "", s, flags=re.I)
-    return s.strip()
+    return NOISE_RE.sub("", s).strip()
 
 def extract_body_without_poem(block):
     if not block: return ""
@@ -80,32 +115,91 @@ def extract_body_without_poem(block):
     return clean_noise("\n".join(out).strip())
 
 def map_by_id(entries):
+    """id -> ブロック（同じ id は後勝ち）。entries は iter_entries のジェネレータでもよい"""
     m = {}
     for e in entries:
-        head = e.split("\n",1)[0]
-        did = parse_id(head)
+        did = parse_id(e.partition("\n")[0])
         if did is not None and 1<=did<=100:
             m[did] = e
     return m
 
-def normalize_categories(text, alias_map):
+def build_alias_index(alias_map):
+    """{正式名: [別名...]} を {名前: 正式名} の逆引き辞書へ（正式名自身も含む。重複は JSON の先の正式名が勝つ）"""
+    index = {}
+    for canonical, alist in alias_map.items():
+        for a in [canonical] + list(alist):
+            index.setdefault(a, canonical)
+    return index
+
+def normalize_categories(text, alias_index):
+    """「カテゴリ: 本文」行のカテゴリ名を正式名へ。alias_index は build_alias_index の逆引き辞書"""
     if not text: return text
-    lines = text.split("\n")
     out = []
-    for ln in lines:
-        if ":" in ln or "：" in ln:
-            sep = ":" if ":" in ln else "："
+    for ln in text.split("\n"):
+        sep = ":" if ":" in ln else ("：" if "：" in ln else None)
+        if sep:
             key, val = ln.split(sep,1)
-            norm_key = key.strip()
-            for canonical, alist in alias_map.items():
-                all_keys = [canonical] + alist
-                if any(norm_key == a for a in all_keys):
-                    norm_key = canonical; break
-            out.append(f"{norm_key}{sep}{val.strip()}")
+            key = key.strip()
+            out.append(f"{alias_index.get(key, key)}{sep}{val.strip()}")
         else:
             out.append(ln)
     return "\n".join(out)
 
+def build_blocks(i, c, final_rank, rank_en, ja_bak_by, en_bak_by, alias_ja, alias_en):
+    """id i の (ja ブロック, en ブロック) を入力から組み立てる"""
+    ja_header = f"第{int_to_kanji(i)}　{final_rank}"
+    en_header = f"{to_ordinal(i)}: {rank_en.get(final_rank,'Good Fortune')}"
+
+    poems = [POEM_SPACE_RE.sub("", p) for p in c.get("poem_kanji", [])]
+
+    ja_body = extract_body_without_poem(ja_bak_by.get(i,""))
+    en_body = extract_body_without_poem(en_bak_by.get(i,""))
+
+    ja_body = normalize_categories(ja_body, alias_ja) if ja_body else ja_body
+    en_body = normalize_categories(en_body, alias_en) if en_body else en_body
+
+    return ("\n".join([ja_header, *poems] + ([ja_body] if ja_body else [])).strip(),
+            "\n".join([en_header] + ([en_body] if en_body else [])).strip())
+
+def iter_blocks(core_by_id, rank_map, rank_en, ja_bak_by, en_bak_by, alias_ja, alias_en, report,
+                prev=None, state=None):
+    """id 順に (ja ブロック, en ブロック) を1件ずつ組み立てて返す（report はその場で更新）。
+    prev: 前回の {id: {"hash","ja","en"}}。入力ハッシュが一致する id は保存済みブロックをそのまま使う
+    state: 今回の {id: {"hash","ja","en"}} を書き込む先"""
+    alias_sig = digest(alias_ja, alias_en)
+    for i in range(1,101):
+        c = core_by_id.get(i)
+        if not c: continue
+        report["total"] += 1
+        final_rank = rank_map.get(str(i), c.get("rank","吉"))
+        if final_rank != c.get("rank",""):
+            report["rank_overrides"].append({"id":i,"core_rank":c.get("rank",""),"final_rank":final_rank})
+        if i not in ja_bak_by: report["missing_in_bak"].append({"lang":"ja","id":i})
+        if i not in en_bak_by: report["missing_in_bak"].append({"lang":"en","id":i})
+
+        h = digest(SYNC_VERSION, c, rank_map.get(str(i)), rank_en.get(final_rank),
+                   ja_bak_by.get(i), en_bak_by.get(i), alias_sig)
+        old = (prev or {}).get(str(i))
+        if old and old.get("hash") == h:
+            ja_block, en_block = old["ja"], old["en"]
+        else:
+            ja_block, en_block = build_blocks(i, c, final_rank, rank_en, ja_bak_by, en_bak_by, alias_ja, alias_en)
+        if state is not None:
+            state[str(i)] = {"hash": h, "ja": ja_block, "en": en_block}
+        yield ja_block, en_block
+
+def write_blocks(blocks, ja_path, en_path):
+    """ブロックを空行区切りで流し書き（一時ファイル→置換。途中で落ちても既存の出力は壊さない）。
+    中身が前と同じファイルは置き換えない。戻り値は書き換えたファイル名のリスト"""
+    ja_tmp, en_tmp = ja_path.with_name(ja_path.name + ".tmp"), en_path.with_name(en_path.name + ".tmp")
+    with open(ja_tmp, "w", encoding="utf-8") as fj, open(en_tmp, "w", encoding="utf-8") as fe:
+        for n, (ja_block, en_block) in enumerate(blocks):
+            if n:
+                fj.write("\n\n"); fe.write("\n\n")
+            fj.write(ja_block); fe.write(en_block)
+        fj.write("\n"); fe.write("\n")
+    return [p.name for tmp, p in ((ja_tmp, ja_path), (en_tmp, en_path)) if replace_if_changed(tmp, p)]
+
 def main():
     ap = argparse.ArgumentParser(description="Sync Omikuji ja/en.txt from core.json + rank_map.json + bak files")
     ap.add_argument("--core", required=True)
@@ -116,55 +210,54 @@ def main():
     ap.add_argument("--alias_ja", default="")
     ap.add_argument("--alias_en", default="")
     ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--incremental", action="store_true",
+                    help="入力ハッシュが前回と同じ id は組み立てを省き、変わった id を sync_changes.json に出す")
+    ap.add_argument("--state", default=SYNC_STATE, help="--incremental の状態ファイル（gitignore 済みの .cache/ 配下）")
     args = ap.parse_args()
 
     core = load_json(args.core)
     rank_map = load_json(args.rankmap)
     rank_en = load_json(args.rank_en_map)
-    alias_ja = load_json(args.alias_ja) if args.alias_ja else {}
-    alias_en = load_json(args.alias_en) if args.alias_en else {}
+    alias_ja = build_alias_index(load_json(args.alias_ja)) if args.alias_ja else {}
+    alias_en = build_alias_index(load_json(args.alias_en)) if args.alias_en else {}
 
     core_by_id = {int(x["id"]): x for x in core}
 
     ja_bak = Path(args.ja_bak).read_text(encoding="utf-8", errors="ignore")
     en_bak = Path(args.en_bak).read_text(encoding="utf-8", errors="ignore")
-    ja_bak_by = map_by_id(split_entries(ja_bak))
-    en_bak_by = map_by_id(split_entries(en_bak))
+    ja_bak_by = map_by_id(iter_entries(ja_bak))
+    en_bak_by = map_by_id(iter_entries(en_bak))
 
     out_dir = Path(args.out_dir); out_dir.mkdir(parents=True, exist_ok=True)
 
-    report = {"total":0,"rank_overrides":[], "missing_in_bak":[]}
-    ja_out, en_out = [], []
+    state_path = Path(args.state)
+    out_key = out_dir.resolve().as_posix()
+    prev = {}
+    if args.incremental and state_path.exists():
+        try:
+            saved = load_json(state_path)
+            if saved.get("version") == SYNC_VERSION and saved.get("out_dir") == out_key:
+                prev = saved.get("entries", {})
+        except (ValueError, AttributeError):
+            prev = {}   # 壊れた状態ファイルは全件作り直し
+    state = {} if args.incremental else None
 
-    for i in range(1,101):
-        c = core_by_id.get(i)
-        if not c: continue
-        report["total"] += 1
-        final_rank = rank_map.get(str(i), c.get("rank","吉"))
-        if final_rank != c.get("rank",""):
-            report["rank_overrides"].append({"id":i,"core_rank":c.get("rank",""),"final_rank":final_rank})
-
-        ja_header = f"第{int_to_kanji(i)}　{final_rank}"
-        en_header = f"{to_ordinal(i)}: {rank_en.get(final_rank,'Good Fortune')}"
-
-        poems = [re.sub(r"[\u0020\u3000]+","", p) for p in c.get("poem_kanji", [])]
-
-        ja_body = extract_body_without_poem(ja_bak_by.get(i,""))
-        en_body = extract_body_without_poem(en_bak_by.get(i,""))
-        if i not in ja_bak_by: report["missing_in_bak"].append({"lang":"ja","id":i})
-        if i not in en_bak_by: report["missing_in_bak"].append({"lang":"en","id":i})
-
-        ja_body = normalize_categories(ja_body, alias_ja) if ja_body else ja_body
-        en_body = normalize_categories(en_body, alias_en) if en_body else en_body
-
-        ja_block = "\n".join([ja_header, *poems] + ([ja_body] if ja_body else [])).strip()
-        en_block = "\n".join([en_header] + ([en_body] if en_body else [])).strip()
-        ja_out.append(ja_block)
-        en_out.append(en_block)
-
-    (out_dir/"ja.txt").write_text("\n\n".join(ja_out)+"\n", encoding="utf-8")
-    (out_dir/"en.txt").write_text("\n\n".join(en_out)+"\n", encoding="utf-8")
-    (out_dir/"sync_report.json").write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    report = {"total":0,"rank_overrides":[], "missing_in_bak":[]}
+    rewritten = write_blocks(iter_blocks(core_by_id, rank_map, rank_en, ja_bak_by, en_bak_by, alias_ja, alias_en, report,
+                                         prev=prev, state=state),
+                             out_dir/"ja.txt", out_dir/"en.txt")
+    if write_text_if_changed(out_dir/"sync_report.json", json.dumps(report, ensure_ascii=False, indent=2)):
+        rewritten.append("sync_report.json")
+    if args.incremental:
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        write_text_if_changed(state_path, json.dumps({"version": SYNC_VERSION, "out_dir": out_key, "entries": state},
+                                                     ensure_ascii=False))
+        changed = [int(k) for k in state if prev.get(k, {}).get("hash") != state[k]["hash"]]
+        removed = sorted(int(k) for k in prev if k not in state)
+        changes = {"changed_ids": changed, "removed_ids": removed, "rewritten": rewritten}
+        write_text_if_changed(out_dir/SYNC_CHANGES, json.dumps(changes, ensure_ascii=False, indent=2))
+        print(f"[SYNC] incremental: changed={len(changed)} reused={len(state) - len(changed)} "
+              f"removed={len(removed)} rewritten={rewritten or '-'}")
 
 if __name__ == "__main__":
     main()
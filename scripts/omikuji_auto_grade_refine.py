@@ -1,91 +1,88 @@
 # scripts/omikuji_auto_grade_refine.py
 # 目的: 既訳JSONを "採点→修正→再採点" し、スコア>=targetで自動確定
-import argparse, json, re, sys, time
+import argparse, hashlib, json, os, sys, time, threading
 from pathlib import Path
 from typing import Dict, Any, List, Tuple
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from omikuji_llm_cache import ResponseCache, add_cache_args, open_cache, cached_chat
+from omikuji_lint import EN_MAX, JA_MAX, lint_poem, sanitize_en
 
-EN_MAX = 48
-JA_MAX = 28
-BANNED_WORDS_RE  = re.compile(r"\b(I|me|my|mine|we|us|our|ours|you|your|yours)\b", re.IGNORECASE)
-BANNED_PUNCT_RE  = re.compile(r"[,\?\!\u2026\u2014;:\.]", re.UNICODE)  # , ? ! … — ; :
-GLOSSARY_FIXES = [
-    (re.compile(r"\bLord\s+Yin\b", re.IGNORECASE), "hidden grace"),
-    (re.compile(r"\bstupa\b", re.IGNORECASE), "pagoda"),
-    (re.compile(r"\bfamily path\b", re.IGNORECASE), "family fortunes"),
-    (re.compile(r"\bone stick of incense\b", re.IGNORECASE), "a single prayer"),
-]
-
-def sanitize_en(s: str) -> str:
-    if not s: return s
-    s = BANNED_PUNCT_RE.sub("", s)           # 句読点除去
-    s = re.sub(r"\s+", " ", s).strip()
-    # 人称の弱体化
-    if BANNED_WORDS_RE.search(s):
-        s = re.sub(r"\b[Yy]our\b\s+", "", s)
-        s = re.sub(r"\b[Yy]ou\b\s+", "", s)
-        s = re.sub(r"\b[Ii]\b\s*", "", s)
-        s = re.sub(r"\b[Ww]e\b\s*", "", s)
-    # glossary軽矯正
-    for pat, rep in GLOSSARY_FIXES:
-        s = pat.sub(rep, s)
-    # 長さ調整（機能語間引き）
-    if len(s) > EN_MAX:
-        for pat in [r"\bthat\b", r"\bthe\b", r"\band\b", r"\bthen\b", r"\bso\b", r"\bwill\b"]:
-            s2 = re.sub(pat, "", s, flags=re.IGNORECASE)
-            s2 = re.sub(r"\s{2,}", " ", s2).strip()
-            if len(s2) < len(s):
-                s = s2
-            if len(s) <= EN_MAX: break
-    return s[:EN_MAX].rstrip()
+# sanitize 前のチェック対象（固有名・glossary は sanitize が直すのでここでは数えない）
+LINT_KINDS = frozenset({"empty", "ja_long", "pronoun", "punct", "en_long"})
+# sanitize 後の再チェック対象
+RECHECK_KINDS = frozenset({"pronoun", "punct", "en_long"})
+# build_judge_prompt の採点基準を変えたら上げる（スコア台帳のキーに入る）
+RUBRIC_VERSION = 1
 
 def lint_lines(lines: List[Dict[str,str]]) -> Tuple[List[Dict[str,str]], List[str]]:
-    errs = []
-    for i,x in enumerate(lines):
-        ja, en = (x.get("ja","") or "").strip(), (x.get("en","") or "").strip()
-        if not ja or not en: errs.append(f"line{i+1}: empty")
-        if len(ja) > JA_MAX: errs.append(f"line{i+1}: JA too long ({len(ja)})")
-        if BANNED_WORDS_RE.search(en): errs.append(f"line{i+1}: pronoun in EN")
-        if BANNED_PUNCT_RE.search(en): errs.append(f"line{i+1}: punctuation in EN")
-        if len(en) > EN_MAX: errs.append(f"line{i+1}: EN too long ({len(en)})")
+    # 規則は omikuji_lint.py（1行1走査）。違反を拾ってから sanitize し、残った違反も返す
+    errs = lint_poem(lines, LINT_KINDS, EN_MAX, JA_MAX)
     # sanitize pass（副作用OK）
     for x in lines:
-        x["en"] = sanitize_en(x["en"])
-    # 再チェック
-    errs2 = []
-    for i,x in enumerate(lines):
-        en = x["en"]
-        if BANNED_WORDS_RE.search(en): errs2.append(f"line{i+1}: pronoun in EN")
-        if BANNED_PUNCT_RE.search(en): errs2.append(f"line{i+1}: punctuation in EN")
-        if len(en) > EN_MAX: errs2.append(f"line{i+1}: EN too long ({len(en)})")
+        x["en"] = sanitize_en(x["en"], EN_MAX)
+    errs2 = lint_poem(lines, RECHECK_KINDS, EN_MAX, JA_MAX)
     return lines, (errs + errs2)
 
-def build_judge_prompt(item: Dict[str,Any], glossary_note: str, target: int) -> List[Dict[str,str]]:
-    # 評価用プロンプト（JSONで返す）
-    sysmsg = (
-        "You are a strict reviewer for translations of Classical Chinese five-character quatrains (omikuji). "
-        "Score 0–100 with this rubric: fidelity(0-40), JA naturalness(0-15), EN poetic naturalness(0-20), "
-        "imagery preservation(0-10), style compliance(0-10), glossary consistency(0-5). "
-        "Style rules: EN has no punctuation (, . ? ! … — ; :), no personal pronouns (I/you/we), EN line<=48 chars; "
-        "JA concise; preserve imagery; follow glossary hints if relevant. "
-        "Return ONLY JSON: {\"score\":int, \"subscores\":{\"fidelity\":int,...}, "
-        "\"pass\":bool, \"issues\":[{\"line\":1..4, \"ja\":\"...\", \"en\":\"...\", \"hint\":\"...\"}], "
-        "\"summary\":\"...\" } "
-        f"Threshold is {target}."
-    )
+JUDGE_RUBRIC = (
+    "You are a strict reviewer for translations of Classical Chinese five-character quatrains (omikuji). "
+    "Score 0–100 with this rubric: fidelity(0-40), JA naturalness(0-15), EN poetic naturalness(0-20), "
+    "imagery preservation(0-10), style compliance(0-10), glossary consistency(0-5). "
+    "Style rules: EN has no punctuation (, . ? ! … — ; :), no personal pronouns (I/you/we), EN line<=48 chars; "
+    "JA concise; preserve imagery; follow glossary hints if relevant. "
+)
+JUDGE_REPORT_SCHEMA = (
+    "{\"score\":int, \"subscores\":{\"fidelity\":int,...}, "
+    "\"pass\":bool, \"issues\":[{\"line\":1..4, \"ja\":\"...\", \"en\":\"...\", \"hint\":\"...\"}], "
+    "\"summary\":\"...\" }"
+)
+
+def judge_payload(item: Dict[str,Any], glossary_note: str = None) -> Dict[str,Any]:
     poem = {
         "id": item["id"],
         "orig": [ln["orig"] for ln in item["lines"]],
         "ja":   [ln["ja"]   for ln in item["lines"]],
         "en":   [ln["en"]   for ln in item["lines"]],
-        "glossary": glossary_note
     }
+    if glossary_note is not None:
+        poem["glossary"] = glossary_note
+    return poem
+
+def build_judge_prompt(item: Dict[str,Any], glossary_note: str, target: int) -> List[Dict[str,str]]:
+    # 評価用プロンプト（JSONで返す）
+    sysmsg = JUDGE_RUBRIC + "Return ONLY JSON: " + JUDGE_REPORT_SCHEMA + " " + f"Threshold is {target}."
+    return [
+        {"role":"system","content": sysmsg},
+        {"role":"user","content": json.dumps(judge_payload(item, glossary_note), ensure_ascii=False)}
+    ]
+
+def build_judge_batch_prompt(items: List[Dict[str,Any]], glossary_note: str, target: int) -> List[Dict[str,str]]:
+    # 複数首をまとめて採点（system/ルーブリックの固定費を K 首で割る）
+    sysmsg = (
+        JUDGE_RUBRIC + "Score every poem independently; never compare poems. "
+        "Return ONLY JSON: {\"results\":[" + JUDGE_REPORT_SCHEMA[:-1] + ", \"id\":int}, ...]} "
+        "with exactly one result per input id. " + f"Threshold is {target}."
+    )
+    payload = {"glossary": glossary_note, "poems": [judge_payload(it) for it in items]}
     return [
         {"role":"system","content": sysmsg},
-        {"role":"user","content": json.dumps(poem, ensure_ascii=False)}
+        {"role":"user","content": json.dumps(payload, ensure_ascii=False)}
     ]
 
+def parse_judge_batch(obj: Dict[str,Any], want_ids: set) -> Dict[int,Dict[str,Any]]:
+    """results[] を id→report に。依頼していない id・score欠落は捨てる（欠けた id は単独採点へ回す）"""
+    results = obj.get("results")
+    if not isinstance(results, list):
+        raise RuntimeError("judge batch: missing 'results'")
+    out = {}
+    for r in results:
+        if not isinstance(r, dict): continue
+        rid = r.get("id")
+        if rid in want_ids and rid not in out and isinstance(r.get("score"), (int, float)):
+            out[rid] = r
+    return out
+
 def build_improve_prompt(item: Dict[str,Any], judge_json: Dict[str,Any], glossary_note: str) -> List[Dict[str,str]]:
     sysmsg = (
         "You are a careful fixer. Improve the 4 lines faithfully based on the judge issues. "
@@ -105,18 +102,87 @@ def build_improve_prompt(item: Dict[str,Any], judge_json: Dict[str,Any], glossar
         {"role":"user","content": json.dumps(payload, ensure_ascii=False)}
     ]
 
-def chat_json(client: OpenAI, model: str, messages: List[Dict[str,str]], temperature: float=0.0) -> Dict[str,Any]:
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        response_format={"type":"json_object"}
-    )
-    raw = resp.choices[0].message.content
-    try:
-        return json.loads(raw)
-    except Exception as e:
-        raise RuntimeError(f"JSON parse failed: {e}\nRAW:\n{raw}")
+class ModelRateLimiter:
+    """モデルごとの requests/min 上限。送信時刻を最小間隔で均して予約する（キャッシュヒットは消費しない）"""
+    def __init__(self, rpm_by_model: Dict[str,float]):
+        self.interval = {m: 60.0 / r for m, r in rpm_by_model.items() if r > 0}
+        self.next_at: Dict[str,float] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, model: str):
+        iv = self.interval.get(model)
+        if not iv: return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at.get(model, 0.0))
+            self.next_at[model] = at + iv
+        if at > now:
+            time.sleep(at - now)
+
+def parse_model_rpm(spec: str) -> Dict[str,float]:
+    # "gpt-4.1=500,gpt-4o-mini=3000"
+    out = {}
+    for part in spec.split(","):
+        if not part.strip(): continue
+        m, _, r = part.partition("=")
+        out[m.strip()] = float(r)
+    return out
+
+class ScoreLedger:
+    """(orig, ja, en, glossary, judge model, rubric) のハッシュ → 最新スコア。
+    未変更で合格済みの詩は採点を飛ばす"""
+    def __init__(self, path: Path, judge_model: str, glossary_note: str):
+        self.path = path
+        self.judge_model = judge_model
+        self.glossary_note = glossary_note
+        self.lock = threading.Lock()
+        self.entries: Dict[str,Dict[str,Any]] = {}
+        if path.exists():
+            try:
+                self.entries = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"[WARN] score ledger unreadable, starting fresh: {e}")
+        self.dirty = False
+
+    def key(self, item: Dict[str,Any]) -> str:
+        payload = json.dumps({
+            "orig": [ln["orig"] for ln in item["lines"]],
+            "ja":   [ln["ja"]   for ln in item["lines"]],
+            "en":   [ln["en"]   for ln in item["lines"]],
+            "glossary": self.glossary_note,
+            "judge_model": self.judge_model,
+            "rubric": RUBRIC_VERSION,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def passing_score(self, item: Dict[str,Any], target: int):
+        with self.lock:
+            e = self.entries.get(self.key(item))
+        if e and e["score"] >= target:
+            return e["score"]
+        return None
+
+    def record(self, item: Dict[str,Any], score: int):
+        k = self.key(item)
+        with self.lock:
+            self.entries[k] = {"id": item["id"], "score": score, "at": int(time.time())}
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            text = json.dumps(self.entries, ensure_ascii=False, indent=0, sort_keys=True)
+            self.dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.path)
+
+def chat_json(client: OpenAI, cache: ResponseCache, model: str, messages: List[Dict[str,str]],
+              temperature: float=0.0, parse=None, limiter: ModelRateLimiter=None) -> Any:
+    # 同一 (model, temperature, messages) はキャッシュから再生
+    return cached_chat(client, cache, model, messages, temperature, parse=parse,
+                       before_call=(lambda: limiter.acquire(model)) if limiter else None)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -128,6 +194,12 @@ def main():
     ap.add_argument("--target", type=int, default=90)
     ap.add_argument("--ids", type=str, default="")
     ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--concurrency", type=int, default=1, help="poems refined in parallel")
+    ap.add_argument("--model-rpm", type=str, default="", help="per-model requests/min, e.g. gpt-4.1=500,gpt-4o-mini=3000")
+    ap.add_argument("--score-ledger", default=".cache/omikuji_score_ledger.json", help="persisted judge scores ('' = off)")
+    ap.add_argument("--rejudge", action="store_true", help="ignore passing scores in the ledger (still records new ones)")
+    ap.add_argument("--judge-batch", type=int, default=1, help="poems per first-round judge request (missing ids fall back to single)")
+    add_cache_args(ap)
     args = ap.parse_args()
 
     src = Path(args.input)
@@ -136,6 +208,8 @@ def main():
     ids_filter = set(int(x) for x in args.ids.split(",") if x.strip()) if args.ids.strip() else set()
 
     client = OpenAI(timeout=60.0)
+    cache = open_cache(args)
+    limiter = ModelRateLimiter(parse_model_rpm(args.model_rpm))
     updated = deepcopy(data)
 
     glossary_note = (
@@ -143,43 +217,82 @@ def main():
         "東君=the Lord of Spring; 祿馬=fortune and steed; 侯手印=marquis seal; 禾刀=profit (ideographic hint)."
     )
 
+    ledger = ScoreLedger(Path(args.score_ledger), args.judge_model, glossary_note) if args.score_ledger else None
+
     def judge(item) -> Dict[str,Any]:
         msgs = build_judge_prompt(item, glossary_note, args.target)
-        return chat_json(client, args.judge_model, msgs, temperature=0.0)
+        report = chat_json(client, cache, args.judge_model, msgs, temperature=0.0, limiter=limiter)
+        if ledger:
+            ledger.record(item, int(report.get("score", 0)))
+        return report
+
+    def judge_batch(items) -> Dict[int,Dict[str,Any]]:
+        want = {it["id"] for it in items}
+        msgs = build_judge_batch_prompt(items, glossary_note, args.target)
+        try:
+            reports = chat_json(client, cache, args.judge_model, msgs, temperature=0.0,
+                                parse=lambda obj: parse_judge_batch(obj, want), limiter=limiter)
+        except Exception as e:
+            print(f"[WARN] judge batch failed ids={sorted(want)}: {e}", flush=True)
+            return {}
+        if ledger:
+            for it in items:
+                if it["id"] in reports:
+                    ledger.record(it, int(reports[it["id"]].get("score", 0)))
+        return reports
 
     def improve(item, judge_json, escalate=False) -> List[Dict[str,str]]:
         mdl = args.model if not escalate else args.judge_model
         msgs = build_improve_prompt(item, judge_json, glossary_note)
-        obj = chat_json(client, mdl, msgs, temperature=0.0)
+        return chat_json(client, cache, mdl, msgs, temperature=0.0, parse=parse_improved, limiter=limiter)
+
+    def parse_improved(obj) -> List[Dict[str,str]]:
         lines = obj.get("lines", [])
         if not isinstance(lines, list) or len(lines)!=4:
             raise RuntimeError("improve: invalid lines")
         return [{"ja":x.get("ja","").strip(), "en":x.get("en","").strip()} for x in lines]
 
-    ok_cnt, changed_cnt = 0, 0
-    logs = []
-
-    for it in updated:
-        if ids_filter and it["id"] not in ids_filter:
-            continue
-
-        # 1) 機械Lintだけ先に通す（外形減点の自動回収）
+    def lint_base(it):
+        # 機械Lintだけ先に通す（外形減点の自動回収）
         base_lines = [{"ja":ln["ja"], "en":ln["en"]} for ln in it["lines"]]
         base_lines, _ = lint_lines(base_lines)
         for idx, ln in enumerate(it["lines"]):
             ln["en"] = base_lines[idx]["en"]
 
-        # 2) 採点
-        report = judge(it)
+    def run_pool(fn, items):
+        # map は入力順で返す → 直列実行と同じ順で集計
+        if W > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=min(W, len(items))) as ex:
+                return list(ex.map(fn, items))
+        return [fn(x) for x in items]
+
+    def restore(it, snapshot):
+        for idx, ln in enumerate(it["lines"]):
+            ln["ja"] = snapshot[idx]["ja"]
+            ln["en"] = snapshot[idx]["en"]
+
+    def refine(it) -> Tuple[str, str]:
+        """1首の失敗（壊れた JSON・API エラー等）で全体を止めない: その首だけ原状に戻して fail 扱い"""
+        snapshot = [{"ja":ln["ja"], "en":ln["en"]} for ln in it["lines"]]
+        try:
+            return refine_one(it)
+        except Exception as e:
+            restore(it, snapshot)
+            msg = (str(e).splitlines() or [type(e).__name__])[0]
+            return "fail", f"[FAIL] id={it['id']} error={msg}"
+
+    def refine_one(it) -> Tuple[str, str]:
+        """1首の 採点→修正→再採点。it だけを書き換えるので詩ごとに独立して並列実行できる"""
+        # 1) 採点（台帳に同一内容の合格スコアがあれば採点しない／一括採点済みならその結果）
+        if it["id"] in ledger_hits:
+            return "ok", f"[OK] id={it['id']} score={ledger_hits[it['id']]} (ledger)"
+        report = first_reports.get(it["id"]) or judge(it)
         score = int(report.get("score", 0))
         if score >= args.target:
-            ok_cnt += 1
-            logs.append(f"[OK] id={it['id']} score={score}")
-            continue
+            return "ok", f"[OK] id={it['id']} score={score}"
 
-        # 3) 反復リライト
+        # 2) 反復リライト（再採点は1首ずつ）
         orig_snapshot = [{"ja":ln["ja"], "en":ln["en"]} for ln in it["lines"]]
-        improved = False
         for p in range(1, args.passes+1):
             # mini → ダメなら hard へ
             escalate = (p == args.passes)
@@ -195,17 +308,49 @@ def main():
             report = judge(it)
             score = int(report.get("score", 0))
             if score >= args.target:
-                improved = True
-                changed_cnt += 1
-                logs.append(f"[FIXED] id={it['id']} pass={p} score={score} escalate={escalate}")
-                break
+                return "fixed", f"[FIXED] id={it['id']} pass={p} score={score} escalate={escalate}"
 
-        if not improved:
-            # 失敗したら原状維持（安全）
-            for idx, ln in enumerate(it["lines"]):
-                ln["ja"] = orig_snapshot[idx]["ja"]
-                ln["en"] = orig_snapshot[idx]["en"]
-            logs.append(f"[FAIL] id={it['id']} last_score={score} issues={len(report.get('issues',[]))}")
+        # 失敗したら原状維持（安全）
+        restore(it, orig_snapshot)
+        return "fail", f"[FAIL] id={it['id']} last_score={score} issues={len(report.get('issues',[]))}"
+
+    targets = [it for it in updated if not ids_filter or it["id"] in ids_filter]
+    W = max(1, args.concurrency)
+    for it in targets:
+        lint_base(it)
+
+    ledger_hits: Dict[int,int] = {}
+    if ledger and not args.rejudge:
+        for it in targets:
+            prev = ledger.passing_score(it, args.target)
+            if prev is not None:
+                ledger_hits[it["id"]] = prev
+
+    try:
+        # --judge-batch K: 初回採点だけ K 首ずつまとめる（返ってこなかった id は refine 内で単独採点）
+        first_reports: Dict[int,Dict[str,Any]] = {}
+        K = max(1, args.judge_batch)
+        if K > 1:
+            pending = [it for it in targets if it["id"] not in ledger_hits]
+            groups = [pending[i:i+K] for i in range(0, len(pending), K)]
+            for reports in run_pool(judge_batch, groups):
+                first_reports.update(reports)
+            print(f"[JUDGE-BATCH] requests={len(groups)} scored={len(first_reports)} fallback={len(pending)-len(first_reports)}", flush=True)
+
+        results = run_pool(refine, targets)
+    finally:
+        # 途中で落ちても（Ctrl-C 含む）支払い済みの採点は台帳に残す
+        cache.close()
+        if ledger:
+            ledger.save()
+
+    ok_cnt = sum(1 for st, _ in results if st == "ok")
+    changed_cnt = sum(1 for st, _ in results if st == "fixed")
+    logs = [line for _, line in results]
+
+    print(cache.summary())
+    if ledger:
+        print(f"[LEDGER] skipped={sum(1 for _, line in results if line.endswith('(ledger)'))} entries={len(ledger.entries)}")
 
     # 出力
     if args.dry_run:
@@ -0,0 +1,75 @@
+# scripts/omikuji_batching.py
+# 目的: 翻訳プロンプトのバッチを「詩の数」ではなく推定トークン量で組む
+# - plan_batches: プロンプト+応答の推定トークンが budget に収まるよう順に詰める（--batch は上限件数）
+# - call_split:   バッチが失敗したら半分に割って再帰（1首まで落とす前に O(log batch) 回で切り分け）
+import json
+from typing import Any, Callable, Dict, List, Tuple
+
+# 1リクエストあたりの固定分（system/指示文/スキーマ例）
+REQUEST_OVERHEAD_TOKENS = 450
+# 応答側: 1行 {"orig","ja","en"} ≒ 原文5字 + 和訳 + 英訳(<=48字) + JSONの括り
+RESPONSE_TOKENS_PER_LINE = 70
+
+def estimate_tokens(text: str) -> int:
+    """tiktoken なしの概算: CJK は1字≒1.5トークン、それ以外は4字≒1トークン"""
+    cjk = sum(1 for ch in text if "　" <= ch <= "鿿" or "豈" <= ch <= "﫿")
+    return int(cjk * 1.5 + (len(text) - cjk) / 4) + 1
+
+def poem_tokens(item: Dict[str, Any]) -> int:
+    lines = item.get("lines", [])
+    task = json.dumps({"id": item.get("id"), "lines": [ln.get("orig", "") for ln in lines]}, ensure_ascii=False)
+    return estimate_tokens(task) + RESPONSE_TOKENS_PER_LINE * max(1, len(lines))
+
+def plan_batches(items: List[Dict[str, Any]], budget: int, max_items: int) -> List[List[Dict[str, Any]]]:
+    """入力順を保ったまま、推定トークン <= budget かつ件数 <= max_items で貪欲に詰める。
+    1首で budget を超える場合もその1首だけのバッチにする"""
+    batches, cur, used = [], [], REQUEST_OVERHEAD_TOKENS
+    for it in items:
+        cost = poem_tokens(it)
+        if cur and (used + cost > budget or len(cur) >= max_items):
+            batches.append(cur)
+            cur, used = [], REQUEST_OVERHEAD_TOKENS
+        cur.append(it)
+        used += cost
+    if cur:
+        batches.append(cur)
+    return batches
+
+def call_split(fn: Callable[[List[Dict[str, Any]], int], Dict[int, Any]],
+               batch: List[Dict[str, Any]]) -> Tuple[Dict[int, Any], List[Tuple[Dict[str, Any], Exception]], int]:
+    """fn(batch, depth) -> {id: result}。例外なら半分に割って再帰、応答から欠けた id も割って再送。
+    戻り値: (id→結果, [(取れなかった詩, 最後の例外)], API呼び出し回数)"""
+    results: Dict[int, Any] = {}
+    failures: List[Tuple[Dict[str, Any], Exception]] = []
+    calls = 0
+
+    def solve(part: List[Dict[str, Any]], depth: int):
+        nonlocal calls
+        calls += 1
+        try:
+            out = fn(part, depth)
+        except Exception as e:
+            if len(part) == 1:
+                failures.append((part[0], e))
+                return
+            mid = len(part) // 2
+            solve(part[:mid], depth + 1)
+            solve(part[mid:], depth + 1)
+            return
+        results.update(out)
+        missing = [it for it in part if it["id"] not in out]
+        if not missing:
+            return
+        if len(missing) == len(part):
+            # 1件も返らない応答は失敗扱い（同じバッチの再送は無意味なので割る）
+            if len(part) == 1:
+                failures.append((part[0], RuntimeError(f"id={part[0]['id']} missing in result")))
+                return
+            mid = len(part) // 2
+            solve(part[:mid], depth + 1)
+            solve(part[mid:], depth + 1)
+            return
+        solve(missing, depth + 1)
+
+    solve(batch, 0)
+    return results, failures, calls
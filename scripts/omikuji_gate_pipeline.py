@@ -1,17 +1,15 @@
-import argparse, json, os, re, sys, time
+import argparse, json, os, sys, time, threading
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable, Iterator, Optional
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from omikuji_llm_cache import add_cache_args, open_cache, cached_chat
+from omikuji_batching import plan_batches, call_split
+from omikuji_lint import EN_MAX, JA_MAX, GATE_KINDS, PRONOUN_RE, PUNCT_RE, lint_poem, normalize_en_line
 
-# ===== 設定（現実寄りに微緩和）=====
-EN_MAX = 48   # 英行の長さ上限（40→48）
-JA_MAX = 28   # 和行の長さ上限（25→28）
-
-# 句読点の禁止（英行）
-BANNED_WORDS_RE  = re.compile(r"\b(I|me|my|mine|we|us|our|ours|you|your|yours)\b", re.IGNORECASE)
-BANNED_PROPER_RE = re.compile(r"\bLord\s+Yin\b", re.IGNORECASE)
-BANNED_PUNCT_RE  = re.compile(r"[,\?\!\u2026\u2014;:\.]", re.UNICODE)  # , ? ! … — ; : .
+# ===== 設定 =====
+# 長さ上限（EN_MAX/JA_MAX）・禁止人称・句読点・glossary などの規則は omikuji_lint.py に集約
 
 def is_placeholder_ja(s: str) -> bool:
     s = (s or "").strip()
@@ -20,16 +18,63 @@ def is_placeholder_ja(s: str) -> bool:
 def is_placeholder_en(s: str) -> bool:
     return (s or "").strip().upper() == "TBD"
 
-def poem_has_placeholder(item: Dict[str, Any]) -> bool:
-    for ln in item.get("lines", []):
-        if is_placeholder_ja(ln.get("ja","")) or is_placeholder_en(ln.get("en","")):
-            return True
-    return False
-
 def count_remaining_placeholders(dat) -> int:
     return sum(1 for it in dat for ln in it.get("lines", [])
                if is_placeholder_ja(ln.get("ja","")) or is_placeholder_en(ln.get("en","")))
 
+def placeholder_mask(item: Dict[str, Any]) -> int:
+    """行ごとのプレースホルダ bitmap（bit 2i = 行i の ja, bit 2i+1 = 行i の en）"""
+    mask = 0
+    for i, ln in enumerate(item.get("lines", [])):
+        if is_placeholder_ja(ln.get("ja","")): mask |= 1 << (2*i)
+        if is_placeholder_en(ln.get("en","")): mask |= 1 << (2*i + 1)
+    return mask
+
+class PoemIndex:
+    """id→レコード と id→プレースホルダ bitmap。対象選択・commit を O(対象数) にする"""
+    def __init__(self, dat: List[Dict[str, Any]]):
+        self.data = dat
+        self.by_id: Dict[int, Dict[str, Any]] = {}
+        self.masks: Dict[int, int] = {}
+        for it in dat:
+            rid = it.get("id")
+            if rid in self.by_id:
+                raise RuntimeError(f"duplicate id in input: {rid}")
+            self.by_id[rid] = it
+            self.masks[rid] = placeholder_mask(it)
+        # 挿入順を保つ dict を順序付き集合として使う（削除 O(1)）
+        self.pending_ids = dict.fromkeys(rid for rid, m in self.masks.items() if m)
+
+    def select(self, ids_filter: set, skip: set) -> List[Dict[str, Any]]:
+        if ids_filter:
+            return [self.by_id[rid] for rid in self.masks if rid in ids_filter and rid not in skip]
+        return [self.by_id[rid] for rid in self.pending_ids]
+
+    def fill_placeholders(self, rid: int, lines_out: List[Dict[str, str]]):
+        mask = self.masks[rid]
+        for i, ln in enumerate(self.by_id[rid]["lines"]):
+            if mask >> (2*i) & 1:     ln["ja"] = lines_out[i]["ja"]
+            if mask >> (2*i + 1) & 1: ln["en"] = lines_out[i]["en"]
+        self._set_mask(rid, 0)
+
+    def overwrite(self, rid: int, lines_out: List[Dict[str, str]]):
+        for i, ln in enumerate(self.by_id[rid]["lines"]):
+            ln["ja"] = lines_out[i]["ja"]
+            ln["en"] = lines_out[i]["en"]
+        self._set_mask(rid, placeholder_mask(self.by_id[rid]))
+
+    def _set_mask(self, rid: int, mask: int):
+        self.masks[rid] = mask
+        if mask:
+            self.pending_ids.setdefault(rid)
+        else:
+            self.pending_ids.pop(rid, None)
+
+    def remaining(self) -> int:
+        # 行単位（ja/en どちらかが残っていれば1）で count_remaining_placeholders と同じ数え方
+        return sum(1 for rid in self.pending_ids for i in range(len(self.by_id[rid]["lines"]))
+                   if self.masks[rid] >> (2*i) & 3)
+
 def build_prompt(batch_items: List[Dict[str, Any]]) -> str:
     tasks = []
     for it in batch_items:
@@ -76,86 +121,123 @@ def normalize_result(raw_obj: Dict[str, Any], input_origs_by_id: Dict[int, List[
         raise RuntimeError(f"id={rid}: unsupported result shape")
     return out
 
-def normalize_en_line(s: str, limit: int) -> str:
-    if not s: return s
-    s = re.sub(r"[,\?\!\u2026\u2014;:\.]", "", s)  # 句読点を落とす
-    s = re.sub(r"\s+", " ", s).strip()
-    if len(s) > limit:
-        for pat in [r"\bthat\b", r"\bthe\b", r"\band\b", r"\bthen\b", r"\bso\b"]:
-            s = re.sub(pat, "", s, flags=re.IGNORECASE)
-            s = re.sub(r"\s{2,}", " ", s).strip()
-            if len(s) <= limit: break
-    return s[:limit].rstrip() if len(s) > limit else s
-
 def validate_poem(item_in: Dict[str, Any], lines_out: List[Dict[str, str]]) -> Tuple[bool, List[str]]:
-    errs = []
     if not isinstance(lines_out, list) or len(lines_out)!=4:
         return False, ["shape: lines != 4"]
-    for i,x in enumerate(lines_out):
-        if not x.get("ja") or not x.get("en") or not x.get("orig"):
-            errs.append(f"line{i+1}: empty field")
+    errs = []
     for i,(ln_in,ln_out) in enumerate(zip(item_in["lines"], lines_out)):
-        if ln_in.get("orig") != ln_out.get("orig"):
+        if not ln_out.get("orig"):
+            errs.append(f"line{i+1}: empty orig")
+        elif ln_in.get("orig") != ln_out.get("orig"):
             errs.append(f"line{i+1}: orig mismatch")
-    for i,x in enumerate(lines_out):
-        en = x["en"]
-        if BANNED_WORDS_RE.search(en):  errs.append(f"line{i+1}: banned pronoun in EN")
-        if BANNED_PROPER_RE.search(en): errs.append(f"line{i+1}: banned proper name in EN")
-        if BANNED_PUNCT_RE.search(en):  errs.append(f"line{i+1}: banned punctuation in EN")
-        if len(en) > EN_MAX:            errs.append(f"line{i+1}: EN too long")
-        if len(x["ja"]) > JA_MAX:       errs.append(f"line{i+1}: JA too long")
-    # glossaryの“stupa”誤用などの軽警告（任意）
-    for i,x in enumerate(lines_out):
-        if "stupa" in x["en"].lower():
-            errs.append(f"line{i+1}: use 'pagoda' instead of 'stupa' (glossary)")
+    # EN/JA スタイル（人称・固有名・句読点・長さ・glossary）は1行1走査で全違反を拾う
+    errs.extend(lint_poem(lines_out, GATE_KINDS, EN_MAX, JA_MAX))
     return (len(errs)==0), errs
 
 def tone_breaks_with_existing(item_in: Dict[str, Any], lines_out: List[Dict[str, str]]) -> bool:
     existing_en = [ln["en"] for ln in item_in["lines"] if not is_placeholder_en(ln.get("en",""))]
     if not existing_en: return False
-    existing_has_punct   = any(BANNED_PUNCT_RE.search(e or "") for e in existing_en)
-    existing_has_pronoun = any(BANNED_WORDS_RE.search(e or "") for e in existing_en)
+    existing_has_punct   = any(PUNCT_RE.search(e or "") for e in existing_en)
+    existing_has_pronoun = any(PRONOUN_RE.search(e or "") for e in existing_en)
     new_en = [x["en"] for x in lines_out]
-    new_has_punct   = any(BANNED_PUNCT_RE.search(e or "") for e in new_en)
-    new_has_pronoun = any(BANNED_WORDS_RE.search(e or "") for e in new_en)
+    new_has_punct   = any(PUNCT_RE.search(e or "") for e in new_en)
+    new_has_pronoun = any(PRONOUN_RE.search(e or "") for e in new_en)
     if (not existing_has_punct)   and new_has_punct:   return True
     if (not existing_has_pronoun) and new_has_pronoun: return True
     return False
 
 client = OpenAI(timeout=60.0)
 
-def call_api(batch_items: List[Dict[str, Any]], model: str, temperature: float) -> Dict[int, List[Dict[str, str]]]:
+# ===== 並列実行（--concurrency）=====
+class AdaptiveBackoff:
+    """429/5xx を受けたら全ワーカー共通で送信を止め、成功が続けば待ち時間を縮める"""
+    def __init__(self, base: float = 1.0, cap: float = 60.0):
+        self.lock = threading.Lock()
+        self.base, self.cap = base, cap
+        self.delay = 0.0
+        self.until = 0.0
+
+    def wait(self):
+        while True:
+            with self.lock:
+                rest = self.until - time.monotonic()
+            if rest <= 0:
+                return
+            time.sleep(rest)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        with self.lock:
+            self.delay = min(self.cap, max(self.base, self.delay * 2))
+            pause = max(self.delay, retry_after or 0.0)
+            self.until = max(self.until, time.monotonic() + pause)
+
+    def on_success(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > self.base else 0.0
+
+backoff = AdaptiveBackoff()
+
+def throttle_info(e: Exception) -> Tuple[bool, Optional[float]]:
+    """(429/5xx か, Retry-After 秒) を返す"""
+    status = getattr(e, "status_code", None)
+    if status is None or not (status == 429 or 500 <= status < 600):
+        return False, None
+    retry_after = None
+    resp = getattr(e, "response", None)
+    if resp is not None:
+        try:
+            retry_after = float(resp.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return True, retry_after
+
+def iter_ordered(fn: Callable[[Any], Any], items: List[Any], workers: int) -> Iterator[Tuple[Any, Optional[Exception]]]:
+    """items を最大 workers 本で並列処理し、入力順に (結果, 例外) を届いた所から yield（commit/ログ順を決定的に保つ）"""
+    def wrap(x):
+        try:
+            return fn(x), None
+        except Exception as e:
+            return None, e
+    if workers <= 1 or len(items) <= 1:
+        for x in items:
+            yield wrap(x)
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as ex:
+        yield from ex.map(wrap, items)
+
+def run_ordered(fn: Callable[[Any], Any], items: List[Any], workers: int) -> List[Tuple[Any, Optional[Exception]]]:
+    return list(iter_ordered(fn, items, workers))
+
+def call_api(batch_items: List[Dict[str, Any]], model: str, temperature: float, variant: str = "") -> Dict[int, List[Dict[str, str]]]:
     prompt = build_prompt(batch_items)
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role":"system","content":(
-                "You translate Classical Chinese five-character quatrains faithfully. "
-                "Read each poem as a whole, then output per-line JA/EN. "
-                "No added subjects, no invented proper nouns, no explanations. "
-                "Return ONLY JSON. "
-                "Each EN line MUST contain NO punctuation (no comma/period/question/exclamation/ellipsis/em-dash/colon/semicolon). "
-                "Hyphen is allowed (e.g., cloud-ladder). Keep each EN line <= 40 characters."
-            )},
-            {"role":"user","content": prompt}
-        ],
-        temperature=temperature,
-        response_format={"type":"json_object"}
-    )
-    raw = resp.choices[0].message.content
-    try:
-        obj = json.loads(raw)
-    except Exception as e:
-        raise RuntimeError(f"JSON parse failed: {e}\n--- RAW ---\n{raw}")
+    messages = [
+        {"role":"system","content":(
+            "You translate Classical Chinese five-character quatrains faithfully. "
+            "Read each poem as a whole, then output per-line JA/EN. "
+            "No added subjects, no invented proper nouns, no explanations. "
+            "Return ONLY JSON. "
+            "Each EN line MUST contain NO punctuation (no comma/period/question/exclamation/ellipsis/em-dash/colon/semicolon). "
+            "Hyphen is allowed (e.g., cloud-ladder). Keep each EN line <= 40 characters."
+        )},
+        {"role":"user","content": prompt}
+    ]
     input_origs_by_id = { it["id"]: [ln["orig"] for ln in it["lines"]] for it in batch_items }
-    return normalize_result(obj, input_origs_by_id)
+    return cached_chat(client, cache, model, messages, temperature, variant,
+                       parse=lambda obj: normalize_result(obj, input_origs_by_id))
 
-def process_chunk(chunk, model, temperature, max_retries=3):
+def process_chunk(chunk, model, temperature, max_retries=3, variant=""):
     for attempt in range(max_retries):
+        backoff.wait()
         try:
-            return call_api(chunk, model=model, temperature=temperature if attempt==0 else 0.0)
+            out = call_api(chunk, model=model, temperature=temperature if attempt==0 else 0.0, variant=variant)
+            backoff.on_success()
+            return out
         except Exception as e:
-            time.sleep(0.4*(attempt+1))
+            throttled, retry_after = throttle_info(e)
+            if throttled:
+                backoff.on_throttle(retry_after)
+            else:
+                time.sleep(0.4*(attempt+1))
             if attempt==max_retries-1:
                 raise
 
@@ -166,7 +248,8 @@ ap.add_argument("--output", required=True)
 ap.add_argument("--model", default="gpt-4o-mini")
 ap.add_argument("--hard-model", default="gpt-4.1")
 ap.add_argument("--temperature", type=float, default=0.1)
-ap.add_argument("--batch", type=int, default=20)
+ap.add_argument("--batch", type=int, default=20, help="max poems per request")
+ap.add_argument("--token-budget", type=int, default=6000, help="estimated prompt+response tokens per request")
 ap.add_argument("--max-retries", type=int, default=3)
 ap.add_argument("--dry-run", action="store_true")
 ap.add_argument("--ids", type=str, default="")
@@ -174,6 +257,10 @@ ap.add_argument("--no-auto-force", action="store_true")
 ap.add_argument("--auto-complete", action="store_true", help="loop until placeholders=0 or no progress")
 ap.add_argument("--max-passes", type=int, default=4)
 ap.add_argument("--stop-if-unchanged", action="store_true")
+ap.add_argument("--concurrency", type=int, default=1, help="max in-flight API calls (chunk/retry/force)")
+ap.add_argument("--checkpoint", default="", help="commit journal (JSONL); default: <output>.journal.jsonl")
+ap.add_argument("--resume", action="store_true", help="replay the checkpoint journal onto the input before running")
+add_cache_args(ap)
 args = ap.parse_args()
 
 src_path = Path(args.input)
@@ -182,137 +269,204 @@ if not src_path.exists():
     print(f"[ERR] input not found: {src_path}", file=sys.stderr); sys.exit(1)
 
 data = json.loads(src_path.read_text(encoding="utf-8"))
+cache = open_cache(args)
 
-def one_pass(updated_data, ids_filter: set):
-    targets = []
-    for it in updated_data:
-        if ids_filter:
-            if it.get("id") in ids_filter:
-                targets.append(it)
-        else:
-            if poem_has_placeholder(it):
-                targets.append(it)
-    total = len(updated_data)
+# ===== チェックポイント（詩のcommitごとに追記、--resume で再生）=====
+class CommitJournal:
+    """1 commit = 1 行の追記専用 JSONL。行はcommit後の4行全体を持つので再生は冪等"""
+    def __init__(self, path: Path, resume: bool):
+        self.path = path
+        if not resume and path.exists():
+            path.unlink()
+        self.fp = None
+
+    def replay(self, dat) -> set:
+        if not self.path.exists():
+            return set()
+        # 改行で終わらない末尾（書き込み途中で落ちた行）は切り落としてから追記を再開
+        raw = self.path.read_bytes()
+        if raw and not raw.endswith(b"\n"):
+            with self.path.open("r+b") as f:
+                f.truncate(raw.rfind(b"\n") + 1)
+            print("[RESUME] dropped torn journal tail", flush=True)
+        by_id = {it.get("id"): it for it in dat}
+        done = set()
+        with self.path.open("r", encoding="utf-8") as f:
+            for n, line in enumerate(f, start=1):
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    print(f"[RESUME] skip broken journal line {n}", flush=True)
+                    continue
+                it = by_id.get(rec.get("id"))
+                if it is None or len(rec.get("lines", [])) != len(it.get("lines", [])):
+                    continue
+                for ln, rl in zip(it["lines"], rec["lines"]):
+                    ln["ja"], ln["en"] = rl["ja"], rl["en"]
+                done.add(rec["id"])
+        return done
+
+    def record(self, rid: int, lines: List[Dict[str, Any]], model: str, gate: str, pass_no: int):
+        if self.fp is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fp = self.path.open("a", encoding="utf-8")
+        rec = {"id": rid, "lines": [{"orig": ln.get("orig"), "ja": ln.get("ja"), "en": ln.get("en")} for ln in lines],
+               "model": model, "gate": gate, "pass": pass_no}
+        self.fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+journal = CommitJournal(Path(args.checkpoint) if args.checkpoint else out_path.with_suffix(out_path.suffix + ".journal.jsonl"),
+                        resume=args.resume)
+resumed_ids = set()
+
+def one_pass(index: PoemIndex, ids_filter: set, pass_no: int = 1):
+    # --resume: ジャーナル済みの指定IDは再送しない
+    targets = index.select(ids_filter, resumed_ids)
+    total = len(index.data)
     print(f"[INFO] poems total={total}, selected={len(targets)}, model={args.model}, hard={args.hard_model}", flush=True)
     if not targets:
-        return updated_data, set(), [], [], 0
+        return set(), [], [], 0
 
     B = max(1, args.batch)
-    result_map = {}
+    W = max(1, args.concurrency)
+    # キャッシュ枝番: --auto-complete の2周目以降は同じ単首プロンプトでも引き直す
+    tag = "" if pass_no == 1 else f"pass{pass_no}"
     failed_ids, log_lines = [], []
-    # API呼び
-    for i in range(0, len(targets), B):
-        chunk = targets[i:i+B]
-        print(f"[CALL] chunk {i//B + 1}/{(len(targets)+B-1)//B} -> ids={[it['id'] for it in chunk]}", flush=True)
-        try:
-            out = process_chunk(chunk, model=args.model, temperature=args.temperature, max_retries=args.max_retries)
-            result_map.update(out)
-        except Exception as e:
-            for it in chunk:
-                try:
-                    single = process_chunk([it], model=args.model, temperature=0.0, max_retries=args.max_retries)
-                    result_map.update(single)
-                except Exception as ee:
-                    failed_ids.append(it["id"])
-                    log_lines.append(f"[ERR] id={it['id']} API failed: {ee}")
-
     committed_ids = set()
     force_queue = []
-    # Gate判定 + 自動整形
-    for it in targets:
-        rid = it["id"]
-        if rid in failed_ids or rid not in result_map:
-            continue
-        lines_out = result_map[rid]
+    # API呼び（推定トークンで組んだ chunk 単位で並列、結果は chunk 順に取り込む）
+    chunks = plan_batches(targets, args.token_budget, B)
+    for n, chunk in enumerate(chunks, start=1):
+        print(f"[CALL] chunk {n}/{len(chunks)} -> ids={[it['id'] for it in chunk]}", flush=True)
+
+    def send(part, depth):
+        # 割った後は低温（旧・単首フォールバックと同じ）
+        return process_chunk(part, model=args.model, temperature=args.temperature if depth == 0 else 0.0,
+                             max_retries=args.max_retries, variant=tag)
+
+    def normalize_and_validate(it, lines_out):
         # 自動整形（英行）
         for x in lines_out:
             x["en"] = normalize_en_line(x["en"], EN_MAX)
+        return validate_poem(it, lines_out)
 
-        ok1, errs = validate_poem(it, lines_out)
-        if not ok1:
-            # リトライ（mini 低温）
-            retried = False
-            for _ in range(args.max_retries):
-                try:
-                    single = process_chunk([it], model=args.model, temperature=0.0, max_retries=args.max_retries)
-                    lines_out = single[rid]
-                    for x in lines_out:
-                        x["en"] = normalize_en_line(x["en"], EN_MAX)
-                    ok1, errs = validate_poem(it, lines_out)
-                    if ok1: retried = True; break
-                except Exception as e:
-                    pass
-            if not ok1:
-                if not args.no_auto_force:
-                    force_queue.append(it)
-                    log_lines.append(f"[GATE1->FORCE] id={rid} errs={errs}")
-                    continue
-                else:
-                    failed_ids.append(rid)
-                    log_lines.append(f"[FAIL] id={rid} gate1 errs={errs}")
-                    continue
+    def retry_gate1(it):
+        # リトライ（mini 低温）
+        rid = it["id"]
+        lines_out, ok1, errs = None, False, []
+        for k in range(args.max_retries):
+            try:
+                # キャッシュ上は試行ごとに別枠（同じ失敗応答の再生を避ける）
+                single = process_chunk([it], model=args.model, temperature=0.0, max_retries=args.max_retries,
+                                       variant=f"{tag}gate1-retry-{k+1}")
+                lines_out = single[rid]
+                ok1, errs = normalize_and_validate(it, lines_out)
+                if ok1: break
+            except Exception as e:
+                pass
+        return lines_out, ok1, errs
 
+    def gate2_commit(it, lines_out):
+        rid = it["id"]
         if tone_breaks_with_existing(it, lines_out):
             if not args.no_auto_force:
                 force_queue.append(it)
                 log_lines.append(f"[GATE2->FORCE] id={rid} tone break")
-                continue
             else:
                 failed_ids.append(rid)
                 log_lines.append(f"[FAIL] id={rid} tone break (no_auto_force)")
-                continue
-
+            return
         # プレースホルダのみ上書き
-        idx_in_data = updated_data.index(it)
-        for idx, ln in enumerate(updated_data[idx_in_data]["lines"]):
-            if is_placeholder_ja(ln.get("ja","")):
-                ln["ja"] = lines_out[idx]["ja"]
-            if is_placeholder_en(ln.get("en","")):
-                ln["en"] = lines_out[idx]["en"]
+        index.fill_placeholders(rid, lines_out)
+        journal.record(rid, index.by_id[rid]["lines"], args.model, "ok", pass_no)
         committed_ids.add(rid)
         log_lines.append(f"[OK] id={rid} placeholders filled")
 
-    # Force: 詩単位で刷新
-    if force_queue:
-        for it in force_queue:
+    # 失敗 chunk は半分ずつ割って再送（1首ずつの直列フォールバックの代わり）。
+    # chunk の結果が届いたら chunk 順に Gate を通った詩をその場で commit/ジャーナル（途中で止めてもそこまでは --resume で戻る）
+    retry_items, first_errs = [], {}
+    for n, ((out, fails, calls), _) in enumerate(iter_ordered(lambda c: call_split(send, c), chunks, W), start=1):
+        if calls > 1:
+            log_lines.append(f"[SPLIT] chunk {n}: calls={calls} failed={len(fails)}")
+        failed_set = set()
+        for it, err in fails:
+            failed_ids.append(it["id"])
+            failed_set.add(it["id"])
+            log_lines.append(f"[ERR] id={it['id']} API failed: {err}")
+        for it in chunks[n-1]:
             rid = it["id"]
-            success = False
-            for mdl in (args.model, args.hard_model):
-                try:
-                    single = process_chunk([it], model=mdl, temperature=0.0, max_retries=args.max_retries)
-                    lines_out = single[rid]
-                    for x in lines_out:
-                        x["en"] = normalize_en_line(x["en"], EN_MAX)
-                    ok1, errs = validate_poem(it, lines_out)
-                    if not ok1:
-                        continue
-                    idx_in_data = updated_data.index(it)
-                    for idx, ln in enumerate(updated_data[idx_in_data]["lines"]):
-                        ln["ja"] = lines_out[idx]["ja"]
-                        ln["en"] = lines_out[idx]["en"]
-                    committed_ids.add(rid)
-                    log_lines.append(f"[FORCE-OK] id={rid} model={mdl}")
-                    success = True
-                    break
-                except Exception as e:
-                    pass
-            if not success:
-                failed_ids.append(rid)
-                log_lines.append(f"[FORCE-FAIL] id={rid}")
+            if rid in failed_set or rid not in out:
+                continue
+            ok1, errs = normalize_and_validate(it, out[rid])
+            if ok1:
+                gate2_commit(it, out[rid])
+            else:
+                retry_items.append(it)
+                first_errs[rid] = errs
+
+    # Gate1 落ちは mini 低温で単首リトライ（APIは並列、commitは retry_items 順）
+    for it, ((retry_lines, ok1, retry_errs), _) in zip(retry_items, run_ordered(retry_gate1, retry_items, W)):
+        rid = it["id"]
+        if ok1:
+            gate2_commit(it, retry_lines)
+            continue
+        errs = retry_errs if retry_lines is not None else first_errs[rid]
+        if not args.no_auto_force:
+            force_queue.append(it)
+            log_lines.append(f"[GATE1->FORCE] id={rid} errs={errs}")
+        else:
+            failed_ids.append(rid)
+            log_lines.append(f"[FAIL] id={rid} gate1 errs={errs}")
+
+    # Force: 詩単位で刷新（APIは並列、commitは force_queue 順）
+    def force_one(it):
+        rid = it["id"]
+        for mdl in (args.model, args.hard_model):
+            try:
+                single = process_chunk([it], model=mdl, temperature=0.0, max_retries=args.max_retries,
+                                       variant=f"{tag}force")
+                lines_out = single[rid]
+                ok1, errs = normalize_and_validate(it, lines_out)
+                if ok1:
+                    return mdl, lines_out
+            except Exception as e:
+                pass
+        return None, None
+
+    for it, ((mdl, lines_out), _) in zip(force_queue, run_ordered(force_one, force_queue, W)):
+        rid = it["id"]
+        if lines_out is None:
+            failed_ids.append(rid)
+            log_lines.append(f"[FORCE-FAIL] id={rid}")
+            continue
+        index.overwrite(rid, lines_out)
+        journal.record(rid, index.by_id[rid]["lines"], mdl, "force", pass_no)
+        committed_ids.add(rid)
+        log_lines.append(f"[FORCE-OK] id={rid} model={mdl}")
 
     print("\n".join(log_lines[:120]))
-    return updated_data, committed_ids, force_queue, failed_ids, len(committed_ids)
+    return committed_ids, force_queue, failed_ids, len(committed_ids)
 
 # --- AUTO ループ or 単発 ---
 ids_filter = set(int(x.strip()) for x in args.ids.split(",") if x.strip()) if args.ids.strip() else set()
 updated = deepcopy(data)
+if args.resume:
+    resumed_ids = journal.replay(updated)
+    print(f"[RESUME] replayed {len(resumed_ids)} committed poems from {journal.path}", flush=True)
+index = PoemIndex(updated)
 
 if args.auto_complete:
-    prev_remaining = count_remaining_placeholders(updated)
+    prev_remaining = index.remaining()
     for p in range(1, args.max_passes+1):
         print(f"[AUTO] pass {p} start (remaining={prev_remaining})", flush=True)
-        updated, ok_ids, fq, failed, changed = one_pass(updated, ids_filter)
-        remaining = count_remaining_placeholders(updated)
+        ok_ids, fq, failed, changed = one_pass(index, ids_filter, pass_no=p)
+        remaining = index.remaining()
         print(f"[AUTO] pass {p} end   (remaining={remaining}, ok={len(ok_ids)}, force_q={len(fq)}, failed={len(failed)})", flush=True)
         if remaining == 0:
             break
@@ -321,13 +475,16 @@ if args.auto_complete:
             break
         prev_remaining = remaining
 else:
-    updated, ok_ids, fq, failed, changed = one_pass(updated, ids_filter)
+    ok_ids, fq, failed, changed = one_pass(index, ids_filter)
 
+journal.close()
+cache.close()
+print(cache.summary())
 final_json = json.dumps(updated, ensure_ascii=False, indent=2)
 
 if args.dry_run:
     print("[DRY-RUN] no write.")
-    print(f'[SUMMARY] remaining={count_remaining_placeholders(updated)}')
+    print(f'[SUMMARY] remaining={index.remaining()}')
     sys.exit(0)
 
 # .bak（出力先の既存を退避）
@@ -338,4 +495,7 @@ if out_path.exists():
 
 out_path.write_text(final_json, encoding="utf-8")
 print(f"[DONE] wrote -> {out_path}")
-print(f'[SUMMARY] remaining={count_remaining_placeholders(updated)}')
+# 出力が確定したのでジャーナルは不要
+if journal.path.exists():
+    journal.path.unlink()
+print(f'[SUMMARY] remaining={index.remaining()}')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# scripts/omikuji_lint.py
+# 目的: おみくじ訳の EN/JA スタイル規則を1か所にまとめた Lint エンジン
+# - 禁止人称・禁止固有名・句読点・glossary を1本の正規表現に前コンパイルし、1行1回の走査で全違反を拾う
+# - gate_pipeline（validate/normalize）と auto_grade_refine（lint/sanitize）が共用
+# - データセット一括: python scripts/omikuji_lint.py dist/omikuji.final.json  （違反があれば exit 1）
+import json, re, sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 長さ上限の正本（gate_pipeline / auto_grade_refine はここから import する。現実寄りに微緩和: 40→48 / 25→28）
+EN_MAX = 48   # 英行の長さ上限
+JA_MAX = 28   # 和行の長さ上限
+
+# 個別判定用（tone 比較など「有無」だけ知りたい所）
+PRONOUN_RE = re.compile(r"\b(?:I|me|my|mine|we|us|our|ours|you|your|yours)\b", re.IGNORECASE)
+PUNCT_RE   = re.compile(r"[,\?\!…—;:\.]")  # , ? ! … — ; : .
+WS_RE      = re.compile(r"\s+")
+MULTI_WS_RE = re.compile(r"\s{2,}")
+
+# (種別, パターン, メッセージ)。先頭ほど優先（同位置で重なったとき）
+_SCAN_RULES: List[Tuple[str, str, str]] = [
+    ("proper",          r"\bLord\s+Yin\b",             "banned proper name in EN"),
+    ("gloss:stupa",     r"\bstupa",                    "use 'pagoda' instead of 'stupa' (glossary)"),
+    ("gloss:family",    r"\bfamily path\b",            "use 'family fortunes' instead of 'family path' (glossary)"),
+    ("gloss:incense",   r"\bone stick of incense\b",   "use 'a single prayer' instead of 'one stick of incense' (glossary)"),
+    ("pronoun",         PRONOUN_RE.pattern,            "banned pronoun in EN"),
+    ("punct",           PUNCT_RE.pattern,              "banned punctuation in EN"),
+]
+_SCAN_RE = re.compile("|".join(f"(?P<r{i}>{pat})" for i, (_, pat, _) in enumerate(_SCAN_RULES)), re.IGNORECASE)
+_GROUP_KIND = {f"r{i}": kind for i, (kind, _, _) in enumerate(_SCAN_RULES)}
+MESSAGES = {kind: msg for kind, _, msg in _SCAN_RULES}
+MESSAGES.update({"empty": "empty field", "en_long": "EN too long", "ja_long": "JA too long"})
+
+ALL_KINDS = frozenset(MESSAGES)
+# gate_pipeline の Gate1 が落とす種別（glossary は stupa のみ）
+GATE_KINDS = frozenset({"empty", "proper", "gloss:stupa", "pronoun", "punct", "en_long", "ja_long"})
+
+# 自動矯正（sanitize）用
+GLOSSARY_FIXES = [
+    (re.compile(r"\bLord\s+Yin\b", re.IGNORECASE), "hidden grace"),
+    (re.compile(r"\bstupa\b", re.IGNORECASE), "pagoda"),
+    (re.compile(r"\bfamily path\b", re.IGNORECASE), "family fortunes"),
+    (re.compile(r"\bone stick of incense\b", re.IGNORECASE), "a single prayer"),
+]
+_PRONOUN_STRIP = [
+    re.compile(r"\b[Yy]our\b\s+"),
+    re.compile(r"\b[Yy]ou\b\s+"),
+    re.compile(r"\b[Ii]\b\s*"),
+    re.compile(r"\b[Ww]e\b\s*"),
+]
+# 長さ超過時に間引く機能語（この順に1語ずつ）
+FILLERS = ["that", "the", "and", "then", "so", "will"]
+_FILLER_RES = {w: re.compile(rf"\b{w}\b", re.IGNORECASE) for w in FILLERS}
+
+def scan_en(en: str) -> List[str]:
+    """EN 1行を1回だけ走査し、出現した違反種別を出現順・重複なしで返す"""
+    kinds: List[str] = []
+    for m in _SCAN_RE.finditer(en or ""):
+        k = _GROUP_KIND[m.lastgroup]
+        if k not in kinds:
+            kinds.append(k)
+    return kinds
+
+def lint_line(ja: str, en: str, en_max: int = EN_MAX, ja_max: int = JA_MAX) -> List[str]:
+    ja, en = ja or "", en or ""
+    kinds = []
+    if not ja.strip() or not en.strip():
+        kinds.append("empty")
+    kinds.extend(scan_en(en))
+    if len(en) > en_max: kinds.append("en_long")
+    if len(ja) > ja_max: kinds.append("ja_long")
+    return kinds
+
+def lint_poem(lines: Iterable[Dict[str, Any]], kinds: Optional[frozenset] = None,
+              en_max: int = EN_MAX, ja_max: int = JA_MAX) -> List[str]:
+    """"line{n}: <message>" の一覧。kinds で対象種別を絞る（None=全部）"""
+    errs = []
+    for i, x in enumerate(lines):
+        en, ja = x.get("en", "") or "", x.get("ja", "") or ""
+        for k in lint_line(ja, en, en_max, ja_max):
+            if kinds is not None and k not in kinds:
+                continue
+            msg = MESSAGES[k]
+            if k == "en_long": msg += f" ({len(en)})"
+            if k == "ja_long": msg += f" ({len(ja)})"
+            errs.append(f"line{i+1}: {msg}")
+    return errs
+
+def lint_dataset(data: Iterable[Dict[str, Any]], kinds: Optional[frozenset] = None,
+                 en_max: int = EN_MAX, ja_max: int = JA_MAX) -> Dict[Any, List[str]]:
+    """データセット一括。違反のある id → メッセージ一覧"""
+    out = {}
+    for it in data:
+        errs = lint_poem(it.get("lines", []), kinds, en_max, ja_max)
+        if errs:
+            out[it.get("id")] = errs
+    return out
+
+def _drop_fillers(s: str, limit: int, words: List[str], only_if_shorter: bool) -> str:
+    for w in words:
+        s2 = MULTI_WS_RE.sub(" ", _FILLER_RES[w].sub("", s)).strip()
+        if not only_if_shorter or len(s2) < len(s):
+            s = s2
+        if len(s) <= limit: break
+    return s
+
+def normalize_en_line(s: str, limit: int = EN_MAX) -> str:
+    """句読点除去・空白整理、長すぎれば機能語を間引いて切り詰め（gate_pipeline 用）"""
+    if not s: return s
+    s = WS_RE.sub(" ", PUNCT_RE.sub("", s)).strip()
+    if len(s) > limit:
+        s = _drop_fillers(s, limit, FILLERS[:5], only_if_shorter=False)
+    return s[:limit].rstrip() if len(s) > limit else s
+
+def sanitize_en(s: str, limit: int = EN_MAX) -> str:
+    """normalize に加えて人称の弱体化と glossary 矯正（auto_grade_refine 用）"""
+    if not s: return s
+    s = WS_RE.sub(" ", PUNCT_RE.sub("", s)).strip()
+    if PRONOUN_RE.search(s):
+        for pat in _PRONOUN_STRIP:
+            s = pat.sub("", s)
+    for pat, rep in GLOSSARY_FIXES:
+        s = pat.sub(rep, s)
+    if len(s) > limit:
+        s = _drop_fillers(s, limit, FILLERS, only_if_shorter=True)
+    return s[:limit].rstrip()
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Lint omikuji translations (EN/JA style rules)")
+    ap.add_argument("inputs", nargs="+", help="JSON files: [{id, lines:[{orig, ja, en}]}]")
+    ap.add_argument("--gate-only", action="store_true", help="only the kinds the gate pipeline rejects")
+    ap.add_argument("--en-max", type=int, default=EN_MAX)
+    ap.add_argument("--ja-max", type=int, default=JA_MAX)
+    args = ap.parse_args()
+
+    bad = 0
+    for p in args.inputs:
+        data = json.loads(Path(p).read_text(encoding="utf-8"))
+        report = lint_dataset(data, GATE_KINDS if args.gate_only else None, args.en_max, args.ja_max)
+        for rid, errs in report.items():
+            print(f"{p}: id={rid} " + "; ".join(errs))
+        bad += len(report)
+    print(f"[LINT] poems with violations: {bad}")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
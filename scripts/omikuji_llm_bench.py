@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# scripts/omikuji_llm_bench.py
+# 目的: 偽 LLM サーバ（omikuji_mock_llm.py）相手に3本の翻訳/採点スクリプトを実際に走らせ、
+#       スループット・再送の膨らみ・1首あたり費用を測る（実トークンを使わずに並列度/バッチを調整する）
+# - 各シナリオは本物のスクリプトを subprocess で起動（OPENAI_BASE_URL を偽サーバへ向けるだけ。コードは無改変）
+# - 障害は本文+到着回数で決まるので、同じ seed/profile なら出力も同一 → --repeat で再現性を確認
+# 使い方:
+#   python scripts/omikuji_llm_bench.py --poems 40 --profile flaky --time-scale 0.2 --concurrency 1,4,8
+#   python scripts/omikuji_llm_bench.py --scenarios refine --refine-args "--judge-batch 5" --report .cache/bench.json
+import argparse, hashlib, json, os, shlex, subprocess, sys, tempfile, threading, time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from omikuji_mock_llm import MockLLMServer, PROFILES, profile_from_spec, fake_en, fake_ja
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+# USD / 1M tokens (input, output)。公開価格の目安なので --price で上書きする前提
+PRICES_PER_MTOK: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini":  (0.15, 0.60),
+    "gpt-4o":       (2.50, 10.00),
+    "gpt-4.1":      (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+# 原文用の字（決定的に5字×4行を組む）
+_CHARS = "山水月花風雲雨雪春秋松竹梅鶴亀龍虎門家道心福禄寿吉凶財宝光明清静遠近高低新旧天地人"
+
+def make_fixture(n: int, translated: bool) -> List[Dict[str, Any]]:
+    """n 首の合成データ。translated=False はプレースホルダ（gate/fill 用）、True は既訳あり（refine 用）"""
+    data = []
+    for pid in range(1, n + 1):
+        lines = []
+        for i in range(4):
+            orig = "".join(_CHARS[(pid * 7 + i * 13 + k * 5) % len(_CHARS)] for k in range(5))
+            if translated:
+                lines.append({"orig": orig, "ja": fake_ja(orig), "en": fake_en(orig)})
+            else:
+                lines.append({"orig": orig, "ja": "訳準備中", "en": "TBD"})
+        data.append({"id": pid, "lines": lines})
+    return data
+
+def blank_translations(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out = json.loads(json.dumps(data, ensure_ascii=False))
+    for it in out:
+        for ln in it.get("lines", []):
+            ln["ja"], ln["en"] = "訳準備中", "TBD"
+    return out
+
+def parse_prices(specs: List[str]) -> Dict[str, Tuple[float, float]]:
+    prices = dict(PRICES_PER_MTOK)
+    for spec in specs:
+        try:
+            model, io = spec.split("=", 1)
+            pin, pout = io.split(":", 1)
+            prices[model.strip()] = (float(pin), float(pout))
+        except ValueError:
+            raise SystemExit(f"[ERR] --price must be model=in:out (USD/1M tokens): {spec}")
+    return prices
+
+def cost_usd(by_model: Dict[str, Dict[str, int]], prices: Dict[str, Tuple[float, float]]) -> Tuple[float, List[str]]:
+    total, unknown = 0.0, []
+    for model, m in by_model.items():
+        if model not in prices:
+            unknown.append(model)
+            continue
+        pin, pout = prices[model]
+        total += (m["prompt_tokens"] * pin + m["completion_tokens"] * pout) / 1e6
+    return total, unknown
+
+def scenario_cmd(name: str, inp: Path, out: Path, conc: int, extra: List[str]) -> List[str]:
+    py = sys.executable
+    if name == "gate":
+        return [py, str(SCRIPTS_DIR / "omikuji_gate_pipeline.py"), "--input", str(inp), "--output", str(out),
+                "--cache-mode", "off", "--auto-complete", "--concurrency", str(conc)] + extra
+    if name == "fill":
+        # fill_omikuji_translations は直列のみ（--concurrency なし）
+        return [py, str(SCRIPTS_DIR / "fill_omikuji_translations.py"), "--input", str(inp), "--output", str(out),
+                "--cache-mode", "off", "--force"] + extra
+    if name == "refine":
+        return [py, str(SCRIPTS_DIR / "omikuji_auto_grade_refine.py"), "--input", str(inp), "--output", str(out),
+                "--cache-mode", "off", "--score-ledger", "", "--concurrency", str(conc)] + extra
+    raise SystemExit(f"[ERR] unknown scenario: {name}")
+
+def run_one(srv: MockLLMServer, name: str, inp: Path, workdir: Path, conc: int, extra: List[str],
+            n_poems: int, prices: Dict[str, Tuple[float, float]], rep: int, timeout: float) -> Dict[str, Any]:
+    out = workdir / f"{name}.c{conc}.r{rep}.json"
+    log = workdir / f"{name}.c{conc}.r{rep}.log"
+    env = dict(os.environ, OPENAI_BASE_URL=srv.base_url, OPENAI_API_KEY="mock-key")
+    srv.stats.reset()
+    t0 = time.perf_counter()
+    with log.open("w", encoding="utf-8") as lf:
+        try:
+            proc = subprocess.run(scenario_cmd(name, inp, out, conc, extra), cwd=str(workdir), env=env,
+                                  stdout=lf, stderr=subprocess.STDOUT, timeout=timeout)
+            rc = proc.returncode
+        except subprocess.TimeoutExpired:
+            rc = "timeout"
+    wall = time.perf_counter() - t0
+    st = srv.stats.snapshot()
+    status = st["status"]
+    cost, unknown = cost_usd(st["by_model"], prices)
+    reqs = st["requests"]
+    # 途中で落ちた run は全首を処理していないので、1首あたりの数字（スループット・費用）は出さない
+    ok = rc == 0
+    return {
+        "scenario": name, "concurrency": conc, "repeat": rep, "exit": rc, "failed": not ok,
+        "poems": n_poems, "wall_s": round(wall, 3),
+        "poems_per_s": round(n_poems / wall, 3) if ok and wall > 0 else None,
+        "requests": reqs, "distinct_requests": st["distinct"],
+        "ok": status.get("200", 0), "throttled": status.get("429", 0), "server_errors": status.get("500", 0),
+        "malformed": status.get("malformed", 0),
+        # 再送の膨らみ: 送った回数 / 異なる本文の数（SDK内リトライ・スクリプトのリトライ・分割再送を含む）
+        "retry_amplification": round(reqs / st["distinct"], 3) if st["distinct"] else None,
+        "requests_per_poem": round(reqs / n_poems, 3) if ok and n_poems else None,
+        "tokens": {m: {"prompt": v["prompt_tokens"], "completion": v["completion_tokens"]}
+                   for m, v in st["by_model"].items()},
+        "cost_usd": round(cost, 6), "cost_per_poem_usd": round(cost / n_poems, 8) if ok and n_poems else None,
+        "unpriced_models": unknown,
+        "output_sha256": hashlib.sha256(out.read_bytes()).hexdigest() if out.exists() else None,
+        "log": str(log),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark omikuji LLM scripts against the offline mock server")
+    ap.add_argument("--input", default="", help="real dataset to use (gate/fill get it blanked to placeholders)")
+    ap.add_argument("--poems", type=int, default=40, help="synthetic dataset size (ignored with --input)")
+    ap.add_argument("--scenarios", default="gate,fill,refine")
+    ap.add_argument("--concurrency", default="1,4", help="comma-separated sweep (fill always runs with 1)")
+    ap.add_argument("--profile", default="realistic",
+                    help=f"{'/'.join(PROFILES)}, optionally with overrides: flaky,error_rate=0.3")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--time-scale", type=float, default=1.0, help="multiply mock latency/Retry-After (0 = no sleeping)")
+    ap.add_argument("--repeat", type=int, default=1, help="run each config N times and check outputs are identical")
+    ap.add_argument("--timeout", type=float, default=1800.0, help="per-run timeout seconds")
+    ap.add_argument("--gate-args", default="", help="extra args for omikuji_gate_pipeline.py")
+    ap.add_argument("--fill-args", default="", help="extra args for fill_omikuji_translations.py")
+    ap.add_argument("--refine-args", default="", help="extra args for omikuji_auto_grade_refine.py")
+    ap.add_argument("--price", action="append", default=[], help="model=in:out USD per 1M tokens (repeatable)")
+    ap.add_argument("--report", default="", help="write all results as JSON")
+    ap.add_argument("--keep-dir", default="", help="keep fixtures/outputs/logs here instead of a temp dir")
+    args = ap.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    sweep = sorted({max(1, int(x)) for x in args.concurrency.split(",") if x.strip()})
+    prices = parse_prices(args.price)
+    extra = {"gate": shlex.split(args.gate_args), "fill": shlex.split(args.fill_args),
+             "refine": shlex.split(args.refine_args)}
+
+    if args.input:
+        src = json.loads(Path(args.input).read_text(encoding="utf-8"))
+        placeholder_data, translated_data = blank_translations(src), src
+    else:
+        placeholder_data, translated_data = make_fixture(args.poems, False), make_fixture(args.poems, True)
+    n_poems = len(placeholder_data)
+
+    tmp = None
+    if args.keep_dir:
+        workdir = Path(args.keep_dir)
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="omikuji_bench_")
+        workdir = Path(tmp.name)
+    inputs = {"gate": workdir / "fixture.placeholders.json", "fill": workdir / "fixture.placeholders.json",
+              "refine": workdir / "fixture.translated.json"}
+    inputs["gate"].write_text(json.dumps(placeholder_data, ensure_ascii=False, indent=2), encoding="utf-8")
+    inputs["refine"].write_text(json.dumps(translated_data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    srv = MockLLMServer(("127.0.0.1", 0), profile_from_spec(args.profile), args.seed, args.time_scale)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    print(f"[BENCH] mock={srv.base_url} profile={args.profile} seed={args.seed} time_scale={args.time_scale} "
+          f"poems={n_poems} dir={workdir}", flush=True)
+
+    results: List[Dict[str, Any]] = []
+    replay_ok = True
+    try:
+        for name in scenarios:
+            for conc in ([1] if name == "fill" else sweep):
+                shas = set()
+                for rep in range(1, args.repeat + 1):
+                    r = run_one(srv, name, inputs[name], workdir, conc, extra[name], n_poems, prices, rep, args.timeout)
+                    results.append(r)
+                    shas.add(r["output_sha256"])
+                    faults = (f"req={r['requests']} (429={r['throttled']} 5xx={r['server_errors']} "
+                              f"bad_json={r['malformed']}) amp={r['retry_amplification']}")
+                    if r["failed"]:
+                        print(f"[BENCH] {name:<6} c={conc:<2} r={rep} FAILED exit={r['exit']} wall={r['wall_s']:.2f}s "
+                              f"{faults} (throughput/cost omitted)", flush=True)
+                    else:
+                        print(f"[BENCH] {name:<6} c={conc:<2} r={rep} exit={r['exit']} wall={r['wall_s']:.2f}s "
+                              f"poems/s={r['poems_per_s']} {faults} req/poem={r['requests_per_poem']} "
+                              f"$/poem={r['cost_per_poem_usd']}", flush=True)
+                    if r["unpriced_models"]:
+                        print(f"[WARN] no price for {r['unpriced_models']} (use --price model=in:out)")
+                if args.repeat > 1:
+                    if None in shas:
+                        verdict = "missing (see logs)"
+                    else:
+                        verdict = "identical" if len(shas) == 1 else "DIFFER"
+                        replay_ok &= len(shas) == 1
+                    print(f"[REPLAY] {name} c={conc}: outputs {verdict} over {args.repeat} runs")
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+    if args.report:
+        rp = Path(args.report)
+        rp.parent.mkdir(parents=True, exist_ok=True)
+        rp.write_text(json.dumps({"profile": args.profile, "seed": args.seed, "time_scale": args.time_scale,
+                                  "poems": n_poems, "results": results}, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[DONE] report -> {rp}")
+    if tmp is not None:
+        tmp.cleanup()
+    failed = [r for r in results if r["failed"]]
+    if failed and tmp is not None:
+        print(f"[HINT] {len(failed)} run(s) failed; rerun with --keep-dir DIR to inspect the logs")
+    sys.exit(1 if failed or not replay_ok else 0)
+
+if __name__ == "__main__":
+    main()
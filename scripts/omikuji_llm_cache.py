@@ -0,0 +1,141 @@
+# scripts/omikuji_llm_cache.py
+# 目的: 翻訳/採点スクリプト共通の LLM 応答キャッシュ（SQLite, 内容アドレス）
+# - キー = sha256(model, temperature, messages)。同じプロンプトの再実行はAPIを叩かずに再生
+# - TTL / 総サイズ上限で古いものから掃除
+# - --cache-mode read-write（既定）/ read-only（参照のみ）/ off（無効）
+import hashlib, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+CACHE_MODES = ("read-write", "read-only", "off")
+DEFAULT_CACHE_PATH = ".cache/omikuji_llm.sqlite"
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, mode: str = "read-write",
+                 ttl_days: float = 90.0, max_mb: float = 256.0):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"unknown cache mode: {mode}")
+        self.mode = mode
+        self.ttl = ttl_days * 86400 if ttl_days > 0 else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb > 0 else None
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if mode == "off":
+            return
+        p = Path(path)
+        if mode == "read-only" and not p.exists():
+            return
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(p), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, raw TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses(used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(model: str, temperature: float, messages: List[Dict[str, str]], variant: str = "") -> str:
+        # variant: 同一プロンプトを意図的に引き直す（ゲート再試行など）とき用の枝番
+        body = {"model": model, "temperature": float(temperature), "messages": messages}
+        if variant:
+            body["variant"] = variant
+        payload = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.db is None:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT raw, created FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            if self.mode == "read-write":
+                self.db.execute("UPDATE responses SET used=? WHERE key=?", (now, key))
+                self.db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, raw: str):
+        if self.db is None or self.mode != "read-write":
+            return
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses(key, model, raw, size, created, used) VALUES (?,?,?,?,?,?)",
+                (key, model, raw, len(raw.encode("utf-8")), now, now),
+            )
+            self.db.commit()
+
+    def evict(self):
+        """TTL切れを削除し、総サイズ上限を超えた分を最終利用が古い順に削除"""
+        if self.db is None or self.mode != "read-write":
+            return
+        with self.lock:
+            if self.ttl is not None:
+                self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            if self.max_bytes is not None:
+                total = self.db.execute("SELECT COALESCE(SUM(size),0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    drop, freed = [], 0
+                    for k, size in self.db.execute("SELECT key, size FROM responses ORDER BY used"):
+                        if total - freed <= self.max_bytes:
+                            break
+                        drop.append((k,)); freed += size
+                    self.db.executemany("DELETE FROM responses WHERE key=?", drop)
+            self.db.commit()
+
+    def close(self):
+        if self.db is None:
+            return
+        self.evict()
+        with self.lock:
+            self.db.close()
+            self.db = None
+
+    def summary(self) -> str:
+        return f"[CACHE] mode={self.mode} hits={self.hits} misses={self.misses}"
+
+def add_cache_args(ap):
+    ap.add_argument("--cache-mode", default="read-write", choices=CACHE_MODES,
+                    help="LLM response cache: read-write / read-only / off")
+    ap.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    ap.add_argument("--cache-ttl-days", type=float, default=90.0, help="0 = no expiry")
+    ap.add_argument("--cache-max-mb", type=float, default=256.0, help="0 = no size limit")
+
+def open_cache(args) -> ResponseCache:
+    return ResponseCache(args.cache_path, mode=args.cache_mode,
+                         ttl_days=args.cache_ttl_days, max_mb=args.cache_max_mb)
+
+def cached_chat(client: Any, cache: ResponseCache, model: str, messages: List[Dict[str, str]],
+                temperature: float, variant: str = "",
+                parse: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                before_call: Optional[Callable[[], None]] = None) -> Any:
+    """chat.completions(JSONモード) を叩き、parse(obj) の結果を返す（parse省略時は dict）。
+    JSONパースと parse を両方通った応答だけキャッシュする（壊れた応答を再生し続けないため）。
+    before_call はキャッシュミスで実際に送る直前だけ呼ぶ（レート制限など）"""
+    key = cache.key(model, temperature, messages, variant)
+    raw = cache.get(key)
+    if raw is not None:
+        obj = json.loads(raw)
+        return parse(obj) if parse else obj
+    if before_call:
+        before_call()
+    resp = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        response_format={"type": "json_object"}
+    )
+    raw = resp.choices[0].message.content
+    try:
+        obj = json.loads(raw)
+    except Exception as e:
+        raise RuntimeError(f"JSON parse failed: {e}\n--- RAW ---\n{raw}")
+    out = parse(obj) if parse else obj
+    cache.put(key, model, raw)
+    return out
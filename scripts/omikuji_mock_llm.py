@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# scripts/omikuji_mock_llm.py
+# 目的: OpenAI chat.completions(JSONモード) 互換のローカル偽サーバ（ネットワーク・課金なしで計測/試験）
+# - gate_pipeline / fill_omikuji_translations / auto_grade_refine のプロンプトを見分けて、それらしい JSON を返す
+# - プロファイルで遅延・429/5xx・壊れたJSON・スタイル違反の率を指定
+# - 障害の有無は sha256(seed, リクエスト本文, 同一本文の何回目か) で決める → 並列度や到着順に関係なく再現する
+# 使い方:
+#   python scripts/omikuji_mock_llm.py --port 8808 --profile flaky
+#   OPENAI_BASE_URL=http://127.0.0.1:8808/v1 OPENAI_API_KEY=mock python scripts/omikuji_gate_pipeline.py ...
+#   curl http://127.0.0.1:8808/stats   （集計）
+import argparse, hashlib, json, random, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from omikuji_batching import estimate_tokens
+
+# latency_ms: 平均, jitter_ms: ±幅, ms_per_1k_out: 出力1kトークンあたりの追加遅延
+# error_rate: 429/5xx を返す率（うち throttle_share が 429）, malformed_rate: 途中で切れたJSON
+# style_error_rate: 翻訳行に句読点/人称を混ぜる率（Gate1 の再試行経路を通すため）
+# drop_rate: バッチ応答から1首抜く率（call_split / 単独採点フォールバックの経路）
+PROFILES: Dict[str, Dict[str, float]] = {
+    "ideal":     dict(latency_ms=0,   jitter_ms=0,   ms_per_1k_out=0,   error_rate=0.0,  throttle_share=1.0,
+                      malformed_rate=0.0,  style_error_rate=0.0,  drop_rate=0.0,  retry_after=0.0),
+    "realistic": dict(latency_ms=600, jitter_ms=300, ms_per_1k_out=400, error_rate=0.02, throttle_share=0.8,
+                      malformed_rate=0.01, style_error_rate=0.05, drop_rate=0.02, retry_after=0.5),
+    "flaky":     dict(latency_ms=200, jitter_ms=150, ms_per_1k_out=100, error_rate=0.15, throttle_share=0.6,
+                      malformed_rate=0.05, style_error_rate=0.15, drop_rate=0.05, retry_after=0.2),
+    "throttled": dict(latency_ms=100, jitter_ms=50,  ms_per_1k_out=50,  error_rate=0.35, throttle_share=1.0,
+                      malformed_rate=0.0,  style_error_rate=0.02, drop_rate=0.0,  retry_after=1.0),
+}
+
+def profile_from_spec(spec: str) -> Dict[str, float]:
+    """"flaky" / "realistic,error_rate=0.1,latency_ms=50" の形。先頭がプロファイル名、以降で上書き"""
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    name = parts[0] if parts and "=" not in parts[0] else "ideal"
+    if name not in PROFILES:
+        raise ValueError(f"unknown profile: {name} (choices: {', '.join(PROFILES)})")
+    prof = dict(PROFILES[name])
+    for p in parts:
+        if "=" not in p:
+            continue
+        k, v = p.split("=", 1)
+        if k not in prof:
+            raise ValueError(f"unknown profile key: {k}")
+        prof[k] = float(v)
+    return prof
+
+def _h(*parts: Any) -> int:
+    return int(hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:12], 16)
+
+# ===== 応答の組み立て（プロンプト種別ごと） =====
+def fake_ja(orig: str) -> str:
+    return f"{orig}の趣"
+
+def fake_en(orig: str) -> str:
+    words = ["pine", "moon", "river", "cloud", "bell", "path", "rain", "blossom", "lantern", "mountain"]
+    return " ".join(words[_h(orig, k) % len(words)] for k in range(4))
+
+def _translate(user: str, model: str, rng: random.Random, prof: Dict[str, float]) -> Dict[str, Any]:
+    tasks = json.loads(user.split("INPUT_TASKS:\n", 1)[1])["tasks"]
+    results = []
+    for t in tasks:
+        if len(tasks) > 1 and rng.random() < prof["drop_rate"]:
+            continue
+        lines = []
+        for o in t["lines"]:
+            en = fake_en(o)
+            if rng.random() < prof["style_error_rate"]:
+                en = "you see the " + en + ", then."
+            lines.append({"orig": o, "ja": fake_ja(o), "en": en})
+        results.append({"id": t["id"], "lines": lines})
+    return {"results": results}
+
+def _judge_report(poem: Dict[str, Any]) -> Dict[str, Any]:
+    score = 70 + _h(json.dumps(poem, ensure_ascii=False, sort_keys=True)) % 31
+    issues = [] if score >= 90 else [{"line": 1 + _h(poem.get("id"), "line") % 4, "ja": "", "en": "", "hint": "tighten imagery"}]
+    return {"score": score, "subscores": {"fidelity": min(40, score * 40 // 100)},
+            "pass": score >= 90, "issues": issues, "summary": "mock"}
+
+def _judge_batch(user: str, rng: random.Random, prof: Dict[str, float]) -> Dict[str, Any]:
+    poems = json.loads(user)["poems"]
+    results = []
+    for p in poems:
+        if len(poems) > 1 and rng.random() < prof["drop_rate"]:
+            continue
+        results.append(dict(_judge_report(p), id=p["id"]))
+    return {"results": results}
+
+def _improve(user: str) -> Dict[str, Any]:
+    p = json.loads(user)
+    return {"lines": [{"ja": c["ja"], "en": fake_en(o + c["en"])} for o, c in zip(p["orig"], p["current"])]}
+
+def build_content(messages: List[Dict[str, str]], model: str, rng: random.Random, prof: Dict[str, float]) -> Dict[str, Any]:
+    sysmsg = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    user = messages[-1].get("content", "") if messages else ""
+    if "INPUT_TASKS:\n" in user:
+        return _translate(user, model, rng, prof)
+    if "Score every poem independently" in sysmsg:
+        return _judge_batch(user, rng, prof)
+    if "strict reviewer" in sysmsg:
+        return _judge_report(json.loads(user))
+    if "careful fixer" in sysmsg:
+        return _improve(user)
+    return {}
+
+# ===== 集計 =====
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.status = Counter()        # "200" / "429" / "500" / "malformed"
+            self.by_model = {}             # model -> {requests, prompt_tokens, completion_tokens}
+            self.seen = Counter()          # 本文ハッシュ -> 到着回数（決定的な障害判定と重複率に使う）
+
+    def arrive(self, body_key: str) -> int:
+        with self.lock:
+            self.requests += 1
+            self.seen[body_key] += 1
+            return self.seen[body_key]
+
+    def account(self, model: str, outcome: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self.lock:
+            self.status[outcome] += 1
+            m = self.by_model.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            m["requests"] += 1
+            m["prompt_tokens"] += prompt_tokens
+            m["completion_tokens"] += completion_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"requests": self.requests, "distinct": len(self.seen),
+                    "status": dict(self.status), "by_model": json.loads(json.dumps(self.by_model))}
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int], profile: Dict[str, float], seed: int = 0, time_scale: float = 1.0):
+        super().__init__(addr, _Handler)
+        self.profile = profile
+        self.seed = seed
+        self.time_scale = time_scale   # 遅延/Retry-After の倍率（0 で無遅延、障害率はそのまま）
+        self.stats = MockStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockLLMServer
+
+    def log_message(self, fmt, *a):
+        pass
+
+    def _send(self, code: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code: int, kind: str, msg: str, headers: Optional[Dict[str, str]] = None):
+        self._send(code, json.dumps({"error": {"message": msg, "type": kind, "code": kind}}).encode(), headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            self._send(200, json.dumps(self.server.stats.snapshot()).encode())
+        else:
+            self._error(404, "not_found", self.path)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.rstrip("/") in ("/reset", "/v1/reset"):
+            self.server.stats.reset()
+            return self._send(200, b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._error(404, "not_found", self.path)
+        try:
+            req = json.loads(raw)
+        except Exception:
+            return self._error(400, "invalid_request_error", "body is not JSON")
+
+        srv, prof = self.server, self.server.profile
+        model = req.get("model", "")
+        body_key = hashlib.sha256(raw).hexdigest()
+        nth = srv.stats.arrive(body_key)
+        rng = random.Random(_h(srv.seed, body_key, nth))
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in req.get("messages", []))
+
+        delay = max(0.0, prof["latency_ms"] + (rng.random() * 2 - 1) * prof["jitter_ms"]) / 1000.0
+        if rng.random() < prof["error_rate"]:
+            time.sleep(delay * 0.2 * srv.time_scale)
+            if rng.random() < prof["throttle_share"]:
+                srv.stats.account(model, "429")
+                ra = prof["retry_after"] * srv.time_scale
+                return self._error(429, "rate_limit_exceeded", "mock rate limit",
+                                   {"retry-after": f"{ra:g}"} if ra > 0 else None)
+            srv.stats.account(model, "500")
+            return self._error(500, "server_error", "mock upstream error")
+
+        try:
+            content = json.dumps(build_content(req.get("messages", []), model, rng, prof), ensure_ascii=False)
+        except Exception as e:
+            srv.stats.account(model, "400", prompt_tokens)
+            return self._error(400, "invalid_request_error", f"mock could not read prompt: {e}")
+        if rng.random() < prof["malformed_rate"]:
+            content = content[: max(1, len(content) // 2)]
+            outcome = "malformed"
+        else:
+            outcome = "200"
+        completion_tokens = estimate_tokens(content)
+        time.sleep((delay + prof["ms_per_1k_out"] * completion_tokens / 1e6) * srv.time_scale)
+        srv.stats.account(model, outcome, prompt_tokens, completion_tokens)
+        resp = {
+            "id": f"chatcmpl-mock-{body_key[:12]}-{nth}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        self._send(200, json.dumps(resp, ensure_ascii=False).encode("utf-8"))
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline OpenAI chat.completions stand-in for omikuji scripts")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8808)
+    ap.add_argument("--profile", default="realistic",
+                    help=f"{'/'.join(PROFILES)}, optionally with overrides: flaky,error_rate=0.3")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--time-scale", type=float, default=1.0, help="multiply latency and Retry-After (0 = no sleeping)")
+    args = ap.parse_args()
+
+    srv = MockLLMServer((args.host, args.port), profile_from_spec(args.profile), args.seed, args.time_scale)
+    print(f"[MOCK] {srv.base_url} profile={args.profile} seed={args.seed}", flush=True)
+    print(f"[MOCK] export OPENAI_BASE_URL={srv.base_url} OPENAI_API_KEY=mock", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[MOCK] {json.dumps(srv.stats.snapshot(), ensure_ascii=False)}")
+        srv.server_close()
+
+if __name__ == "__main__":
+    main()
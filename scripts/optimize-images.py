@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
-"""画像最適化スクリプト - WebP変換（PIL使用）"""
+"""画像最適化スクリプト - WebP変換（PIL使用）
 
+元画像と設定が前回と同じ出力は再エンコードしない（台帳: .cache/image-manifests/optimize-images.json）。
+全部作り直すなら --force
+
+gates は1回の decode から 1200/800/500px を段々に縮めて作る（image_ladder.py）。AVIF/JPEG も並べるなら:
+  python scripts/optimize-images.py --formats webp,avif,jpeg
+幅・形式ごとの srcset は public/gates/srcset.json（Next.js から import して <picture>/<Image> に渡す）
+"""
+
+import argparse
 import os
 import sys
 from pathlib import Path
@@ -11,33 +20,13 @@ except ImportError:
     print("Error: Pillow not installed. Install with: pip install Pillow")
     sys.exit(1)
 
+from image_ladder import run_ladder, parse_formats, parse_widths, public_url, srcset_entry, write_srcset
+from image_manifest import EncodeManifest
+
 ROOT_DIR = Path(__file__).parent.parent
 GATES_DIR = ROOT_DIR / "public" / "gates"
 BRAND_DIR = ROOT_DIR / "public" / "brand"
 
-def convert_to_webp(input_path, output_path, max_width, quality=85):
-    """画像をWebPに変換"""
-    with Image.open(input_path) as img:
-        # RGBA → RGB変換（WebPは透過をサポートするが最適化のため）
-        if img.mode == 'RGBA':
-            # 白背景で合成
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # リサイズ
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-
-        # WebP保存
-        img.save(output_path, 'WEBP', quality=quality, method=6)
-
-        return output_path.stat().st_size
-
 def format_size(size_bytes):
     """バイトサイズを読みやすい形式に変換"""
     if size_bytes < 1024:
@@ -48,6 +37,18 @@ def format_size(size_bytes):
         return f"{size_bytes / 1024 / 1024:.2f}MB"
 
 def main():
+    ap = argparse.ArgumentParser(description="gates / brand 画像を WebP に変換")
+    ap.add_argument("--force", action="store_true", help="台帳を無視して全部再エンコード")
+    ap.add_argument("--widths", default="1200,800,500", help="gates の幅（先頭が無印、以降は -<幅>）")
+    ap.add_argument("--formats", default="webp", help="gates の形式（webp,avif,jpeg から）")
+    ap.add_argument("--quality", type=int, default=85, help="gates の WebP 品質")
+    args = ap.parse_args()
+    widths = parse_widths(args.widths)
+    formats = parse_formats(args.formats)
+    to_url = public_url(ROOT_DIR)
+    srcset = {}
+    manifest = EncodeManifest("optimize-images", ROOT_DIR)
+
     print("=== 画像最適化開始 ===\n")
 
     before_sizes = {}
@@ -67,18 +68,17 @@ def main():
 
         print(f"変換中: {filename}")
 
-        # 3サイズ生成
-        sizes_config = [
-            (1200, '', 85),
-            (800, '-800', 85),
-            (500, '-500', 85)
-        ]
-
-        for max_width, suffix, quality in sizes_config:
-            output_path = GATES_DIR / f"{basename}{suffix}.webp"
-            size = convert_to_webp(input_path, output_path, max_width, quality)
-            after_sizes[output_path.name] = size
-            print(f"  ✓ {basename}{suffix}.webp ({format_size(size)})")
+        # 全サイズ・全形式を1回の decode から
+        items = run_ladder(input_path, GATES_DIR, basename, widths, formats,
+                           quality={"webp": args.quality}, manifest=manifest, force=args.force)
+        for item in items:
+            name = item["path"].name
+            after_sizes[name] = item["bytes"]
+            if item["encoded"]:
+                print(f"  ✓ {name} ({format_size(item['bytes'])})")
+            else:
+                print(f"  = {name} ({format_size(item['bytes'])}, 変更なし)")
+        srcset[basename] = srcset_entry(items, to_url)
 
     # abi-seal.png変換
     abi_input = BRAND_DIR / "abi-seal.png"
@@ -87,18 +87,30 @@ def main():
 
         print(f"\n変換中: abi-seal.png")
         abi_output = BRAND_DIR / "abi-seal.webp"
-
-        # PNG透過を保持する版
-        with Image.open(abi_input) as img:
-            if img.width > 512:
-                ratio = 512 / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((512, new_height), Image.Resampling.LANCZOS)
-            img.save(abi_output, 'WEBP', quality=90, method=6)
-
-        abi_size = abi_output.stat().st_size
-        after_sizes['abi-seal.webp'] = abi_size
-        print(f"  ✓ abi-seal.webp ({format_size(abi_size)})")
+        abi_settings = {"max_width": 512, "quality": 90, "method": 6, "alpha": "keep"}
+
+        if not args.force and manifest.is_fresh(abi_input, abi_output, abi_settings):
+            abi_size = abi_output.stat().st_size
+            after_sizes['abi-seal.webp'] = abi_size
+            print(f"  = abi-seal.webp ({format_size(abi_size)}, 変更なし)")
+        else:
+            # PNG透過を保持する版
+            with Image.open(abi_input) as img:
+                if img.width > 512:
+                    ratio = 512 / img.width
+                    new_height = int(img.height * ratio)
+                    img = img.resize((512, new_height), Image.Resampling.LANCZOS)
+                img.save(abi_output, 'WEBP', quality=90, method=6)
+            manifest.record(abi_input, abi_output, abi_settings)
+
+            abi_size = abi_output.stat().st_size
+            after_sizes['abi-seal.webp'] = abi_size
+            print(f"  ✓ abi-seal.webp ({format_size(abi_size)})")
+
+    removed = manifest.prune()
+    manifest.save()
+    if srcset and write_srcset(GATES_DIR / "srcset.json", srcset):
+        print("\n✓ public/gates/srcset.json を更新")
 
     # サマリー
     print("\n=== 変換完了 ===")
@@ -116,6 +128,7 @@ def main():
     reduction = ((total_before - total_after) / total_before) * 100
     print(f"  削減率: {reduction:.1f}%")
 
+    print(manifest.summary(removed))
     print("\n✓ 元のJPG/PNGファイルは保持されています")
     print("✓ 次のステップ: src/app/page.tsxで.webpファイルを参照するよう更新")
 
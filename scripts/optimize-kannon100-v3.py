@@ -1,37 +1,61 @@
 #!/usr/bin/env python3
-"""観音百籤画像WebP変換スクリプト v3 - 目標達成版"""
-
+"""観音百籤画像WebP変換スクリプト v3 - 目標達成版
+
+使い方:
+  python scripts/optimize-kannon100-v3.py            # 1枚ずつ順に変換
+  python scripts/optimize-kannon100-v3.py --jobs 16  # プロセスプールで並列変換（0 = CPU数）
+  python scripts/optimize-kannon100-v3.py --force    # 台帳を無視して全部作り直す
+元JPGと設定が前回と同じ出力は再エンコードしない（台帳: .cache/image-manifests/optimize-kannon100-v3.json）
+複数幅・複数形式（1回の decode から段々に縮める。先頭の幅が front.webp、以降は front-<幅>.webp）:
+  python scripts/optimize-kannon100-v3.py --widths 500,320 --formats webp,avif
+srcset は public/images/kannon100/srcset.json（キーは "001/front"）
+品質を固定せず画像ごとに探索（1回の decode・縮小済みの画像をメモリ上でエンコードし直して二分探索）:
+  python scripts/optimize-kannon100-v3.py --total-mb 15                 # 全体 15MB を元画像の枚数で等分し、各枚で予算内の最高品質
+  python scripts/optimize-kannon100-v3.py --target-kb 70 --min-ssim 0.95 # 1枚 70KB 以内で最高品質。ただし SSIM 0.95 は割らない
+  python scripts/optimize-kannon100-v3.py --min-ssim 0.95               # SSIM 0.95 を満たす最小のファイル
+  品質の探索範囲は --min-quality〜--max-quality（既定 30〜90。min-quality が画質の下限）
+"""
+
+import argparse
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 try:
-    from PIL import Image
+    import PIL  # noqa: F401  Pillow の有無だけ確認（画像処理は image_* モジュール側）
 except ImportError:
     print("Error: Pillow not installed")
     sys.exit(1)
 
+from image_ladder import (DEFAULT_QUALITY, build_ladder, fresh_outputs, ladder_plan, parse_formats,
+                          parse_widths, public_url, record_ladder, srcset_entry, write_srcset)
+from image_manifest import EncodeManifest
+from image_quality import QualitySearch
+
 ROOT_DIR = Path(__file__).parent.parent
 KANNON_DIR = ROOT_DIR / "public" / "images" / "kannon100"
 
-def convert_to_webp(input_path, output_path, max_width=500, quality=70):
-    """画像をリサイズしてWebPに変換"""
-    with Image.open(input_path) as img:
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # リサイズ
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-
-        img.save(output_path, 'WEBP', quality=quality, method=6)
-        return output_path.stat().st_size
+def collect_jobs():
+    """元JPG を 001/front, 001/back, 002/front ... の順に"""
+    jobs = []
+    for i in range(1, 101):
+        dir_path = KANNON_DIR / f"{i:03d}"
+        if not dir_path.exists():
+            continue
+        for filename in ['front.jpg', 'back.jpg']:
+            input_path = dir_path / filename
+            if input_path.exists():
+                jobs.append(input_path)
+    return jobs
+
+def convert_job(job):
+    """プロセスプール用（トップレベル関数）。job = (元JPG, 幅, 形式, 品質, 作らない (幅, 形式), QualitySearch or None)。
+    (元JPG, 変換前バイト数, build_ladder の結果) を返す"""
+    input_path, widths, formats, quality, skip, search = job
+    items = build_ladder(input_path, input_path.parent, input_path.stem, widths, formats, quality, skip=skip,
+                         workers=1, search=search)
+    return input_path, input_path.stat().st_size, items
 
 def format_size(size_bytes):
     if size_bytes < 1024:
@@ -42,39 +66,101 @@ def format_size(size_bytes):
         return f"{size_bytes / 1024 / 1024:.2f}MB"
 
 def main():
+    ap = argparse.ArgumentParser(description="観音百籤 front/back JPG → WebP（最大幅500px・品質70）")
+    ap.add_argument("--jobs", type=int, default=1, help="並列プロセス数（1=従来どおり直列、0=CPU数）")
+    ap.add_argument("--force", action="store_true", help="台帳を無視して全部再エンコード")
+    ap.add_argument("--widths", default="500", help="幅（カンマ区切り。先頭が front.webp、以降は front-<幅>.webp）")
+    ap.add_argument("--formats", default="webp", help="形式（webp,avif,jpeg から）")
+    ap.add_argument("--quality", type=int, default=70, help="WebP 品質（以下の探索オプションが無い時）")
+    ap.add_argument("--target-kb", type=float, help="元画像1枚あたりの予算KB（全幅・全形式の合計）。予算内の最高品質を探す")
+    ap.add_argument("--total-mb", type=float, help="全体の予算MB（元画像の枚数で等分）。予算内の最高品質を探す")
+    ap.add_argument("--min-ssim", type=float, help="SSIM の下限（0〜1）。予算なしなら下限を満たす最小の品質")
+    ap.add_argument("--min-quality", type=int, default=30, help="探索する品質の下限（画質の床）")
+    ap.add_argument("--max-quality", type=int, default=90, help="探索する品質の上限")
+    args = ap.parse_args()
+    if args.target_kb and args.total_mb:
+        ap.error("--target-kb と --total-mb はどちらか一方")
+    jobs_n = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    widths = parse_widths(args.widths)
+    formats = parse_formats(args.formats)
+    quality = dict(DEFAULT_QUALITY, webp=args.quality)
+
     print("=== 観音百籤画像WebP変換 v3（目標達成版）===\n")
-    print("設定: 最大幅500px、品質70\n")
+    sources = collect_jobs()
+    search = None
+    if args.target_kb or args.total_mb or args.min_ssim is not None:
+        if args.target_kb:
+            budget = int(args.target_kb * 1024)
+        elif args.total_mb:
+            budget = int(args.total_mb * 1024 * 1024) // max(1, len(sources))
+        else:
+            budget = None
+        search = QualitySearch(budget, args.min_ssim, args.min_quality, args.max_quality)
+        goal = [f"1枚{format_size(budget)}以内" if budget else "", f"SSIM≥{args.min_ssim}" if args.min_ssim is not None else ""]
+        q_desc = f"品質探索（{'、'.join(g for g in goal if g)}、品質{args.min_quality}〜{args.max_quality}）"
+    else:
+        q_desc = f"WebP品質{args.quality}"
+    print(f"設定: 幅{'/'.join(map(str, widths))}px、{'/'.join(formats)}、{q_desc}、並列{jobs_n}\n")
 
     before_total = 0
     after_total = 0
     converted_count = 0
-
-    for i in range(1, 101):
-        dir_name = f"{i:03d}"
-        dir_path = KANNON_DIR / dir_name
-
-        if not dir_path.exists():
-            continue
-
-        for filename in ['front.jpg', 'back.jpg']:
-            input_path = dir_path / filename
-            if not input_path.exists():
-                continue
-
-            before_size = input_path.stat().st_size
-            before_total += before_size
-
-            output_filename = filename.replace('.jpg', '.webp')
-            output_path = dir_path / output_filename
-
-            after_size = convert_to_webp(input_path, output_path, max_width=500, quality=70)
-            after_total += after_size
+    manifest = EncodeManifest("optimize-kannon100-v3", ROOT_DIR)
+    srcset = {}
+    to_url = public_url(ROOT_DIR)
+    searched = []
+    fresh, jobs = [], []
+    for src in sources:
+        plan = ladder_plan(src.parent, src.stem, widths, formats, quality, search)
+        skip = fresh_outputs(manifest, src, plan, args.force)
+        (fresh if len(skip) == len(plan) else jobs).append((src, widths, formats, quality, skip, search))
+
+    def tally(result):
+        nonlocal before_total, after_total, converted_count
+        src, before_size, items = result
+        before_total += before_size
+        after_total += sum(item["bytes"] for item in items)
+        record_ladder(manifest, src, widths, items, quality, search)
+        searched.extend(item for item in items if item["search"])
+        srcset[src.relative_to(KANNON_DIR).with_suffix("").as_posix()] = srcset_entry(items, to_url)
+        if any(item["encoded"] for item in items):
             converted_count += 1
-
             if converted_count % 20 == 0:
-                print(f"変換中... {converted_count}/200")
+                print(f"変換中... {converted_count}/{len(jobs)}", flush=True)
+
+    # 全出力が最新の元画像は decode せず寸法を読むだけ（合計と予算チェックは全ファイルで行う）
+    for job in fresh:
+        tally(convert_job(job))
+    if jobs_n == 1 or len(jobs) <= 1:
+        for job in jobs:
+            tally(convert_job(job))
+    else:
+        # 終わった順に集計（合計は順序に依存しない）
+        with ProcessPoolExecutor(max_workers=jobs_n) as ex:
+            for f in as_completed([ex.submit(convert_job, job) for job in jobs]):
+                tally(f.result())
+    removed = manifest.prune()
+    manifest.save()
+    if srcset and write_srcset(KANNON_DIR / "srcset.json", srcset):
+        print("✓ public/images/kannon100/srcset.json を更新")
 
     print(f"\n✓ 変換完了: {converted_count}ファイル")
+    print(manifest.summary(removed))
+    if searched:
+        qs = sorted(item["quality"] for item in searched)
+        attempts = sum(item["search"]["attempts"] for item in searched)
+        over = [item for item in searched if item["search"]["over_budget"]]
+        print(f"[quality] {len(searched)}出力: 品質 最小{qs[0]} / 中央{qs[len(qs) // 2]} / 最大{qs[-1]}"
+              f"（エンコード {attempts}回、1出力あたり {attempts / len(searched):.1f}回）")
+        if args.min_ssim is not None:
+            low = [item for item in searched if item["search"]["ssim"] < args.min_ssim]
+            if low:
+                print(f"⚠️ 品質{args.max_quality}でも SSIM {args.min_ssim} に届かない: {len(low)}出力"
+                      f"（例: {low[0]['path'].relative_to(KANNON_DIR).as_posix()}）")
+        if over:
+            print(f"⚠️ 画質下限のため予算超過: {len(over)}出力"
+                  f"（例: {over[0]['path'].relative_to(KANNON_DIR).as_posix()}"
+                  f" {format_size(over[0]['bytes'])} > {format_size(over[0]['search']['budget'])}）")
 
     print("\n=== 変換結果 ===")
     print(f"Before: {format_size(before_total)}")
@@ -82,7 +168,7 @@ def main():
     reduction = ((before_total - after_total) / before_total) * 100
     print(f"削減率: {reduction:.1f}%")
 
-    target_mb = 15
+    target_mb = args.total_mb or 15
     actual_mb = after_total / 1024 / 1024
     print(f"\n目標: <{target_mb}MB")
     print(f"実測: {actual_mb:.2f}MB")
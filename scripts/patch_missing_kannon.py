@@ -6,23 +6,36 @@ patch_missing_kannon.py
 - chance.org.tw の URL 表記揺れを多数試行（「金龍山」の有無・記号差異・全角/半角）
 使い方:
   python scripts/patch_missing_kannon.py --nums 38,57,60,62,71,72,73,74,89 --raw tempdata/kannon_100_raw.json --csv tempdata/kannon_100.csv
+  --cdx-index: 表記揺れ URL ごとに CDX を叩かず、ディレクトリごとの prefix 照会1回（計1〜2回）で引く
+  --offline:   .cache/kannon_snapshots.sqlite に保存済みのスナップショットだけで解析（通信しない）
+  --concurrency 8 --rate 4: 1番号の表記揺れを並列に試し、当たったら残りを取り消す。番号どうしも並列
+             （web.archive.org への送信は全体で --rate req/s のトークンバケットに従う）
+  取れた番号は1件ずつ <raw>.records.jsonl に追記（途中で落ちても残る）。最後に番号順の JSON/CSV へ圧縮、
+  --no-compact なら追記だけ（後で scripts/kannon_records.py で圧縮）
 """
 
 import re
-import json
-import csv
 import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from urllib.parse import quote
 
 import requests
-from bs4 import BeautifulSoup
+from kannon_extract import extract_page
+from kannon_fetch import HEADERS, CDX_API, CdxIndex, PoliteSession
+from kannon_records import RecordStore
+from kannon_snapshot_cache import add_snapshot_args, open_snapshot_cache, wayback_fetch
 
-HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"}
-CDX_API = "https://web.archive.org/cdx/search/cdx"
+# --cdx-index 時に main で設定
+CDX_INDEX = None
+# main で設定（スナップショット本文の保存/--offline）
+SNAP_CACHE = None
 
 def cdx_latest_snapshot(session: requests.Session, original_url: str, timeout=25):
+    if CDX_INDEX is not None and CDX_INDEX.covers(original_url):
+        return CDX_INDEX.lookup(original_url)
     params = {
         "url": original_url,
         "output": "json",
@@ -41,37 +54,8 @@ def cdx_latest_snapshot(session: requests.Session, original_url: str, timeout=25
     return None
 
 def fetch_wayback(session: requests.Session, orig_url: str, timeout=30):
-    snap = cdx_latest_snapshot(session, orig_url, timeout=max(20, timeout-5))
-    if not snap:
-        raise RuntimeError(f"No snapshot for {orig_url}")
-    r = session.get(snap, headers=HEADERS, timeout=timeout)
-    r.raise_for_status()
-    r.encoding = r.apparent_encoding or "utf-8"
-    return r.text
-
-def extract_poem(html: str):
-    soup = BeautifulSoup(html, "html.parser")
-    title = soup.title.get_text().strip() if soup.title else ""
-    h1 = soup.find("h1")
-    header = h1.get_text(strip=True) if h1 else title
-
-    text = soup.get_text("\n", strip=True)
-    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
-    def is_poem_line(s: str):
-        han = len(re.findall(r"[\u4e00-\u9fff]", s))
-        return (han >= 4) and (any(p in s for p in ["，", "。", "．", "、"]))
-    poem_lines = [ln for ln in lines if is_poem_line(ln)]
-
-    poem = []
-    for i in range(len(poem_lines) - 3):
-        chunk = poem_lines[i:i+4]
-        lens = [len(x) for x in chunk]
-        if max(lens) - min(lens) <= 12:
-            poem = chunk; break
-    if not poem and poem_lines:
-        poem = poem_lines[:4]
-    return header, poem
+    resolve = lambda s, u: cdx_latest_snapshot(s, u, timeout=max(20, timeout-5))
+    return wayback_fetch(session, orig_url, resolve, SNAP_CACHE, timeout=timeout)
 
 def chance_variants(num: int):
     """
@@ -100,13 +84,53 @@ def chance_variants(num: int):
                 p = "/" + "/".join(quote(seg) for seg in d.split("/")) + "/" + quote(name) + file
                 yield base + p
 
+def make_record(n: int, url: str, html: str):
+    header, poem, head_text = extract_page(html)
+    if not poem:
+        poem = [head_text]
+    return {"number": n, "header": header, "poem_lines": poem, "source_url": url}
+
+def probe_variants(sess, n: int, pool: ThreadPoolExecutor):
+    """n の表記揺れを pool で並列に試す。i 番目が当たったら i より後ろの試行は取り消し（未着手は開始しない）、
+    i より前の結果だけ待つ → 直列と同じ「先頭から最初に当たった URL」を返す。(url, html) or None"""
+    urls = list(chance_variants(n))
+    best = [len(urls)]
+    lock = threading.Lock()
+
+    def probe(i: int, url: str):
+        if i > best[0]:
+            return None
+        try:
+            html = fetch_wayback(sess, url)
+        except Exception as e:
+            print(f"[TRY] {n} miss: {url} -> {e}")
+            return None
+        with lock:
+            best[0] = min(best[0], i)
+        return html
+
+    futs = [pool.submit(probe, i, u) for i, u in enumerate(urls)]
+    for i, f in enumerate(futs):
+        html = f.result()
+        if html is not None:
+            for g in futs[i+1:]:
+                g.cancel()
+            return urls[i], html
+    return None
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--nums", required=True, help="例: 38,57,60")
     ap.add_argument("--raw", default="tempdata/kannon_100_raw.json")
     ap.add_argument("--csv", default="tempdata/kannon_100.csv")
     ap.add_argument("--delay", type=float, default=0.5)
+    ap.add_argument("--cdx-index", action="store_true", help="CDX をディレクトリ単位の prefix 照会にまとめる")
+    ap.add_argument("--concurrency", type=int, default=1, help="同時に試す URL 数（1=従来どおり直列 + --delay）")
+    ap.add_argument("--rate", type=float, default=4.0, help="並列時の送信レート上限（req/s, ホストごと）")
+    ap.add_argument("--no-compact", action="store_true", help="追記ログに足すだけで raw JSON/CSV は書き直さない")
+    add_snapshot_args(ap)
     args = ap.parse_args()
+    global CDX_INDEX, SNAP_CACHE
 
     want = sorted({int(x) for x in re.split(r"[,\s]+", args.nums.strip()) if x})
     raw_path = Path(args.raw)
@@ -115,60 +139,74 @@ def main():
         print(f"[ERR] raw json not found: {raw_path}")
         return
 
-    data = json.loads(raw_path.read_text(encoding="utf-8"))
-    have = {r["number"] for r in data if r.get("number")}
+    store = RecordStore(raw_path, csv_path, resume=True)
+    have = store.numbers()
     target = [n for n in want if n not in have]
     if not target:
         print("[OK] nothing to patch (all present).")
+        if store.log_path.exists() and not args.no_compact:
+            store.compact()
         return
 
     sess = requests.Session()
+    workers = max(1, args.concurrency)
+    if workers > 1:
+        sess = PoliteSession(sess, per_host=workers, rate=args.rate, burst=max(1.0, args.rate))
+    SNAP_CACHE = open_snapshot_cache(args)
+    if args.cdx_index and not args.offline:
+        CDX_INDEX = CdxIndex(sess)
     patched = 0
-    for n in target:
-        hit = False
-        for url in chance_variants(n):
-            try:
-                html = fetch_wayback(sess, url)
-                header, poem = extract_poem(html)
-                num = n
-                if not poem:
-                    soup = BeautifulSoup(html, "html.parser")
-                    txt = soup.get_text("\n", strip=True)[:400]
-                    poem = [txt]
-                data.append({
-                    "number": num,
-                    "header": header,
-                    "poem_lines": poem,
-                    "source_url": url,
-                })
-                print(f"[OK] patched {n} via {url}")
-                patched += 1
-                hit = True
-                break
-            except Exception as e:
-                print(f"[TRY] {n} miss: {url} -> {e}")
-                time.sleep(args.delay)
-        if not hit:
-            print(f"[MISS] {n}: no snapshot across variants.")
-
-    # 整理＆保存
-    data2 = [r for r in data if r.get("number")]
-    data2.sort(key=lambda x: x["number"])
-    dedup, seen = [], set()
-    for r in data2:
-        n = r["number"]
-        if n not in seen:
-            dedup.append(r); seen.add(n)
-    json.dump(dedup, open(raw_path, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
-
-    with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
-        w = csv.writer(f); w.writerow(["number","header","poem","source_url"])
-        for r in dedup:
-            poem_str = " / ".join(r["poem_lines"])
-            w.writerow([r["number"], r["header"], poem_str, r["source_url"]])
-
-    missing = [n for n in range(1,101) if n not in {r['number'] for r in dedup if r['number'] is not None}]
+    if workers > 1:
+        # 番号ごとの調整役スレッド（待つだけ）と、URL 試行の共有プールを分ける（入れ子の待ちで詰まらないように）
+        with ThreadPoolExecutor(max_workers=workers) as probe_pool, \
+             ThreadPoolExecutor(max_workers=min(len(target), workers)) as num_pool:
+            futs = {num_pool.submit(probe_variants, sess, n, probe_pool): n for n in target}
+            hits = {}
+            # 当たった番号から即 store.add（追記ログへ flush）。途中で止めてもそこまでは残る
+            for f in as_completed(futs):
+                n = futs[f]
+                hits[n] = f.result()
+                if hits[n] is not None:
+                    store.add(make_record(n, *hits[n]))
+        for n in target:
+            if hits[n] is None:
+                print(f"[MISS] {n}: no snapshot across variants.")
+                continue
+            print(f"[OK] patched {n} via {hits[n][0]}")
+            patched += 1
+    else:
+        for n in target:
+            hit = False
+            for url in chance_variants(n):
+                try:
+                    html = fetch_wayback(sess, url)
+                    store.add(make_record(n, url, html))
+                    print(f"[OK] patched {n} via {url}")
+                    patched += 1
+                    hit = True
+                    break
+                except Exception as e:
+                    print(f"[TRY] {n} miss: {url} -> {e}")
+                    # 索引で「なし」と分かった miss・offline の miss は通信していないので待たない
+                    if not args.offline and (CDX_INDEX is None or not CDX_INDEX.covers(url)):
+                        time.sleep(args.delay)
+            if not hit:
+                print(f"[MISS] {n}: no snapshot across variants.")
+
+    # 整理＆保存（番号順・先勝ちの重複除去は RecordStore が済ませている）
+    if args.no_compact:
+        store.close()
+        print(f"[NOTE] records appended to {store.log_path} (not compacted)")
+    else:
+        store.compact()
+    missing = store.missing()
     print(f"[DONE] patched={patched}  missing={missing}")
+    if isinstance(sess, PoliteSession):
+        print(sess.summary())
+    if CDX_INDEX is not None:
+        print(f"[CDX] prefix queries={CDX_INDEX.queries} indexed urls={len(CDX_INDEX.latest)}")
+    SNAP_CACHE.close()
+    print(SNAP_CACHE.summary())
     if missing:
         print("[NOTE] 上記が残れば temples.tw の Wayback も試す追加パターンを差し込み可能。")
 
@@ -10,16 +10,31 @@
 使い方（最短）:
   pip install requests beautifulsoup4
   python scripts/scrape_kannon100.py --base chance --out tempdata --force-wayback
+並列取得（接続再利用 + ホストごとの同時数/レート制限、固定 sleep なし。結果は番号順）:
+  python scripts/scrape_kannon100.py --base chance --out tempdata --concurrency 8 --rate 8
+CDX をディレクトリごとに1回だけ引く（URLごとの CDX 照会をやめる）:
+  python scripts/scrape_kannon100.py --base chance --out tempdata --cdx-index
+取得したスナップショットは .cache/kannon_snapshots.sqlite に保存され、--offline で通信なしに再解析できる:
+  python scripts/scrape_kannon100.py --base chance --out tempdata --offline
+取れた番号は1件ずつ <out>/kannon_100_raw.json.records.jsonl に追記（最後に番号順の JSON/CSV へ圧縮）。
+途中で落ちたら --resume で取得済みの番号を飛ばして続きから:
+  python scripts/scrape_kannon100.py --base chance --out tempdata --resume
+--base auto は番号ごとに「その時点で一番調子の良いソース」へ取りに行く（成功率・レイテンシを追跡、
+失敗した番号は別ソースへ回す、取れた番号は二度と頼まない。temples の索引は chance で取れない番号が出るまで読まない）:
+  python scripts/scrape_kannon100.py --base auto --out tempdata --concurrency 4
 """
-import re, csv, json, time, argparse
+import re, time, argparse, threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from urllib.parse import quote
+from urllib.parse import quote, unquote
 
 import requests
 from bs4 import BeautifulSoup
-
-HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"}
-CDX_API = "https://web.archive.org/cdx/search/cdx"
+from kannon_extract import extract_page
+from kannon_fetch import HEADERS, CDX_API, CdxIndex, PoliteSession
+from kannon_records import RecordStore
+from kannon_snapshot_cache import SnapshotCache, add_snapshot_args, open_snapshot_cache, wayback_fetch
 
 SITES = {
     "temples": {
@@ -30,6 +45,11 @@ SITES = {
     },
 }
 
+# --cdx-index 時に main で設定（prefix 一括照会の結果を引く）
+CDX_INDEX: CdxIndex | None = None
+# main で設定（スナップショット本文の保存/--offline）
+SNAP_CACHE: SnapshotCache | None = None
+
 def fetch(url: str, session: requests.Session, timeout=20) -> str:
     r = session.get(url, headers=HEADERS, timeout=timeout)
     r.raise_for_status()
@@ -40,6 +60,8 @@ def wayback_snapshot_url(session: requests.Session, original_url: str, from_year
     """
     CDX APIで original_url の最新スナップショットを取得し、スナップショットURLを返す
     """
+    if CDX_INDEX is not None and CDX_INDEX.covers(original_url):
+        return CDX_INDEX.lookup(original_url)
     params = {
         "url": original_url,
         "output": "json",
@@ -63,20 +85,23 @@ def wayback_snapshot_url(session: requests.Session, original_url: str, from_year
 
 def fetch_with_wayback_only(session: requests.Session, original_url: str, timeout=20) -> str:
     """
-    originに触れず、Waybackのスナップショットだけで取得
+    originに触れず、Waybackのスナップショットだけで取得（保存済みならそれを使う）
     """
-    snap = wayback_snapshot_url(session, original_url)
-    if not snap:
-        raise RuntimeError(f"No snapshot for {original_url}")
-    r = session.get(snap, headers=HEADERS, timeout=timeout)
-    r.raise_for_status()
-    r.encoding = r.apparent_encoding or "utf-8"
-    return r.text
+    return wayback_fetch(session, original_url, wayback_snapshot_url, SNAP_CACHE, timeout=timeout)
+
+def snap_hits() -> int:
+    return SNAP_CACHE.hits if SNAP_CACHE is not None else 0
+
+def polite_sleep(delay: float, hits_before: int):
+    """直列取得の間隔。--offline、または保存済みスナップショットを読んだだけなら通信していないので待たない"""
+    if SNAP_CACHE is not None and (SNAP_CACHE.offline or SNAP_CACHE.hits > hits_before):
+        return
+    time.sleep(delay)
 
 # ---------- temples: indexからリンクを拾う（Wayback優先） ----------
-def discover_links_from_temples(index_html: str, base_url: str):
+def _temples_anchors(index_html: str, base_url: str):
+    """籤ページらしいリンクの (絶対URL, リンク文字列)"""
     soup = BeautifulSoup(index_html, "html.parser")
-    links = []
     for a in soup.find_all("a", href=True):
         href = a["href"]
         text = (a.get_text() or "").strip()
@@ -85,7 +110,10 @@ def discover_links_from_temples(index_html: str, base_url: str):
         elif not href.startswith("http"):
             href = base_url.rstrip("/") + "/" + href.lstrip("./")
         if re.search(r"(第\s*\d{1,3}\s*籤|第\d{1,3}籤)", text) or re.search(r"(第\s*\d{1,3}\s*籤|第\d{1,3}籤)", href):
-            links.append(href)
+            yield href, text
+
+def discover_links_from_temples(index_html: str, base_url: str):
+    links = [href for href, _ in _temples_anchors(index_html, base_url)]
     out, seen = [], set()
     for h in links:
         if h not in seen:
@@ -100,35 +128,43 @@ def chance_url(num: int) -> str:
     p3 = "/" + quote("籤詩網‧淺草金龍山觀音寺一百籤") + f"__第{num:03d}籤.htm"
     return base + p1 + p2 + p3
 
-def extract_poem(html: str):
-    soup = BeautifulSoup(html, "html.parser")
-    title = (soup.title.get_text().strip() if soup.title else "")
-    h1 = soup.find("h1")
-    header = h1.get_text(strip=True) if h1 else title
-
-    text = soup.get_text("\n", strip=True)
-    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
-    def is_poem_line(s):
-        han = len(re.findall(r"[\u4e00-\u9fff]", s))
-        return (han >= 4) and (any(p in s for p in ["，", "。", "．", "、"]))
-
-    poem_lines = [ln for ln in lines if is_poem_line(ln)]
-    poem = []
-    for i in range(len(poem_lines) - 3):
-        chunk = poem_lines[i:i+4]
-        lens = [len(x) for x in chunk]
-        if max(lens) - min(lens) <= 12:
-            poem = chunk; break
-    if not poem and poem_lines:
-        poem = poem_lines[:4]
-    return header, poem
-
 def number_from_header(header: str):
     m = re.search(r"第\s*(\d{1,3})\s*籤", header) or re.search(r"第(\d{1,3})籤", header)
     return int(m.group(1)) if m else None
 
-def run_temples_wayback(session: requests.Session, delay=0.5):
+def temples_links_by_number(index_html: str, base_url: str):
+    """番号 -> temples の籤ページURL（リンク文字列か URL の「第N籤」から。同じ番号は先勝ち）"""
+    out = {}
+    for href, text in _temples_anchors(index_html, base_url):
+        n = number_from_header(text) or number_from_header(unquote(href))
+        if n and n not in out:
+            out[n] = href
+    return out
+
+def page_record(html: str, url: str, default_num=None):
+    header, poem, head_text = extract_page(html)
+    num = number_from_header(header) or default_num
+    if not poem:
+        poem = [head_text]
+    return {"number": num, "header": header, "poem_lines": poem, "source_url": url}
+
+def fetch_pages(session, urls, workers: int, label: str):
+    """urls を workers 本で並列取得し、urls と同じ順に (url, HTML or None) を取れた所から順に返す"""
+    def one(url):
+        try:
+            return fetch_with_wayback_only(session, url)
+        except Exception as e:
+            print(f"[WARN] {label} fetch fail: {url} -> {e}")
+            return None
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        yield from zip(urls, ex.map(one, urls))
+
+def keep(results, rec, store: RecordStore | None):
+    results.append(rec)
+    if store is not None:
+        store.add(rec)
+
+def run_temples_wayback(session: requests.Session, delay=0.5, workers=1, store: RecordStore | None = None):
     base = SITES["temples"]["index"].rsplit("/", 1)[0]
     try:
         idx_html = fetch_with_wayback_only(session, SITES["temples"]["index"])
@@ -138,41 +174,155 @@ def run_temples_wayback(session: requests.Session, delay=0.5):
     links = discover_links_from_temples(idx_html, base)
     print(f"[INFO] temples links: {len(links)}")
     results, seen = [], set()
+    if workers > 1:
+        for url, html in fetch_pages(session, links, workers, "temples"):
+            if html is not None:
+                keep(results, page_record(html, url), store)
+        return results
     for url in links:
         if url in seen: continue
+        hits = snap_hits()
         try:
             html = fetch_with_wayback_only(session, url)
         except Exception as e:
             print(f"[WARN] temples fetch fail: {url} -> {e}")
             continue
-        header, poem = extract_poem(html)
-        num = number_from_header(header)
-        if not poem:
-            soup = BeautifulSoup(html, "html.parser")
-            txt = soup.get_text("\n", strip=True)[:400]
-            poem = [txt]
-        results.append({"number": num, "header": header, "poem_lines": poem, "source_url": url})
+        keep(results, page_record(html, url), store)
         seen.add(url)
-        time.sleep(delay)
+        polite_sleep(delay, hits)
     return results
 
-def run_chance_wayback(session: requests.Session, delay=0.4):
+def run_chance_wayback(session: requests.Session, delay=0.4, workers=1, store: RecordStore | None = None):
+    # 取得済み（--resume / 先に走った temples）の番号は取りに行かない
+    nums = [n for n in range(1, 101) if store is None or not store.has(n)]
+    if len(nums) < 100:
+        print(f"[INFO] chance: skip {100 - len(nums)} numbers already captured")
     results = []
-    for n in range(1, 101):
+    if workers > 1:
+        urls = [chance_url(n) for n in nums]
+        for n, (url, html) in zip(nums, fetch_pages(session, urls, workers, "chance snapshot")):
+            if html is not None:
+                keep(results, page_record(html, url, n), store)
+        return results
+    for n in nums:
         url = chance_url(n)
+        hits = snap_hits()
         try:
             html = fetch_with_wayback_only(session, url)
         except Exception as e:
             print(f"[WARN] chance snapshot missing: {url} -> {e}")
             continue
-        header, poem = extract_poem(html)
-        num = number_from_header(header) or n
-        if not poem:
-            soup = BeautifulSoup(html, "html.parser")
-            txt = soup.get_text("\n", strip=True)[:400]
-            poem = [txt]
-        results.append({"number": num, "header": header, "poem_lines": poem, "source_url": url})
-        time.sleep(delay)
+        keep(results, page_record(html, url, n), store)
+        polite_sleep(delay, hits)
+    return results
+
+# ---------- auto: 番号ごとに調子の良いソースへ振り分け ----------
+class SourceHealth:
+    """ソースごとの成功率とレイテンシ（指数移動平均）。score の高いソースから取りに行く"""
+    ALPHA = 0.3
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ok_rate = 1.0      # 試す前は成功扱い（一度も試さずに見捨てない）
+        self.latency = 0.0
+        self.ok = self.fail = 0
+        self.lock = threading.Lock()
+
+    def record(self, ok: bool, seconds: float):
+        with self.lock:
+            a = self.ALPHA
+            self.ok_rate = (1 - a) * self.ok_rate + a * (1.0 if ok else 0.0)
+            self.latency = seconds if self.ok + self.fail == 0 else (1 - a) * self.latency + a * seconds
+            if ok: self.ok += 1
+            else: self.fail += 1
+
+    def score(self) -> float:
+        with self.lock:
+            return self.ok_rate / (1.0 + self.latency)
+
+    def summary(self) -> str:
+        return (f"[SOURCE] {self.name}: ok={self.ok} fail={self.fail} "
+                f"ok_rate={self.ok_rate:.2f} latency={self.latency:.2f}s score={self.score():.3f}")
+
+AUTO_SOURCES = ("chance", "temples")  # 同点なら先頭優先（chance は索引なしで URL が決まる）
+AUTO_LOW_OK = 0.5                     # これを下回ったら控えのソースも使い始める
+
+def run_auto_wayback(session: requests.Session, delay=0.6, workers=1, store: RecordStore | None = None):
+    """1..100 の各番号を、その時点で score が最も高い未試行ソースから取得。
+    失敗（取得失敗・別番号のページ）した番号は別ソースに回す。取得済みの番号は誰にも頼まない"""
+    health = {k: SourceHealth(k) for k in AUTO_SOURCES}
+    temples_map = None   # temples の番号->URL。必要になるまで索引を読まない
+    tried = {n: set() for n in range(1, 101)}
+    results = []
+
+    def captured(n):
+        return store.has(n) if store is not None else any(r["number"] == n for r in results)
+
+    def url_for(src, n):
+        if src == "chance":
+            return chance_url(n)
+        return temples_map.get(n) if temples_map else None
+
+    def load_temples():
+        nonlocal temples_map
+        base = SITES["temples"]["index"].rsplit("/", 1)[0]
+        try:
+            temples_map = temples_links_by_number(fetch_with_wayback_only(session, SITES["temples"]["index"]), base)
+        except Exception as e:
+            print(f"[WARN] temples index snapshot not found: {e}")
+            temples_map = {}
+        print(f"[INFO] temples links: {len(temples_map)}")
+
+    def pick(n):
+        cands = [s for s in AUTO_SOURCES if s not in tried[n] and url_for(s, n)]
+        # 候補が尽きたか、chance の成功率が落ちてきたら temples の索引を読んで振り分け先に加える
+        if temples_map is None and (not cands or health["chance"].ok_rate < AUTO_LOW_OK):
+            load_temples()
+            cands = [s for s in AUTO_SOURCES if s not in tried[n] and url_for(s, n)]
+        return max(cands, key=lambda s: health[s].score()) if cands else None
+
+    def attempt(src, n, url):
+        t0 = time.monotonic()
+        try:
+            html = fetch_with_wayback_only(session, url)
+        except Exception as e:
+            health[src].record(False, time.monotonic() - t0)
+            print(f"[WARN] {src} fetch fail for #{n}: {url} -> {e}")
+            return None
+        rec = page_record(html, url, n)
+        health[src].record(rec["number"] == n, time.monotonic() - t0)
+        return rec
+
+    pending = deque(n for n in range(1, 101) if not captured(n))
+    if len(pending) < 100:
+        print(f"[INFO] auto: skip {100 - len(pending)} numbers already captured")
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        while pending or running:
+            hits = snap_hits()
+            while pending and len(running) < workers:
+                n = pending.popleft()
+                if captured(n):
+                    continue
+                src = pick(n)
+                if src is None:
+                    continue   # どのソースにも無い → missing として残る
+                tried[n].add(src)
+                running[ex.submit(attempt, src, n, url_for(src, n))] = n
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                n = running.pop(f)
+                rec = f.result()
+                if rec is not None and not captured(rec["number"]):
+                    keep(results, rec, store)
+                if not captured(n):
+                    pending.append(n)
+            if workers == 1:
+                polite_sleep(delay, hits)
+    for h in health.values():
+        print(h.summary())
     return results
 
 def main():
@@ -182,45 +332,44 @@ def main():
     ap.add_argument("--delay", type=float, default=0.6)
     ap.add_argument("--proxy", default=None)
     ap.add_argument("--force-wayback", action="store_true", help="originへは繋がず Wayback のみを使う（推奨）")
+    ap.add_argument("--concurrency", type=int, default=1, help="並列取得数（1=従来どおり直列 + --delay）")
+    ap.add_argument("--rate", type=float, default=4.0, help="並列時のホストごと送信レート（req/s, トークンバケット）")
+    ap.add_argument("--cdx-index", action="store_true", help="CDX をディレクトリ単位の prefix 照会1回にまとめる")
+    ap.add_argument("--resume", action="store_true", help="既存の raw JSON と追記ログを引き継ぎ、取得済みの番号は飛ばす")
+    add_snapshot_args(ap)
     args = ap.parse_args()
+    global CDX_INDEX, SNAP_CACHE
 
     outdir = Path(args.out); outdir.mkdir(parents=True, exist_ok=True)
-    session = requests.Session()
-    if args.proxy: session.proxies.update({"http": args.proxy, "https": args.proxy})
-
-    results = []
-    order = ["temples","chance"] if args.base=="auto" else [args.base]
-    for key in order:
-        if key == "temples":
-            r = run_temples_wayback(session, delay=args.delay)
-        else:
-            r = run_chance_wayback(session, delay=args.delay)
-        nums = {x["number"] for x in r if x.get("number")}
-        print(f"[INFO] {key}: got {len(nums)} numbers (wayback)")
-        results.extend(r)
-
-    # 整理
-    numbered = [r for r in results if r.get("number")]
-    numbered.sort(key=lambda x: x["number"])
-    dedup, seen = [], set()
-    for r in numbered:
-        n = r["number"]
-        if n not in seen:
-            dedup.append(r); seen.add(n)
-    results = dedup
-
     raw_path = outdir/"kannon_100_raw.json"
     csv_path = outdir/"kannon_100.csv"
-    json.dump(results, open(raw_path, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+    store = RecordStore(raw_path, csv_path, resume=args.resume)
+    session = requests.Session()
+    if args.proxy: session.proxies.update({"http": args.proxy, "https": args.proxy})
+    workers = max(1, args.concurrency)
+    if workers > 1:
+        session = PoliteSession(session, per_host=workers, rate=args.rate, burst=max(1.0, args.rate))
+    SNAP_CACHE = open_snapshot_cache(args)
+    if args.cdx_index and not args.offline:
+        CDX_INDEX = CdxIndex(session)
 
-    with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
-        w = csv.writer(f); w.writerow(["number","header","poem","source_url"])
-        for r in results:
-            poem_str = " / ".join(r["poem_lines"])
-            w.writerow([r["number"], r["header"], poem_str, r["source_url"]])
+    if args.base == "auto":
+        r = run_auto_wayback(session, delay=args.delay, workers=workers, store=store)
+    elif args.base == "temples":
+        r = run_temples_wayback(session, delay=args.delay, workers=workers, store=store)
+    else:
+        r = run_chance_wayback(session, delay=args.delay, workers=workers, store=store)
+    nums = {x["number"] for x in r if x.get("number")}
+    print(f"[INFO] {args.base}: got {len(nums)} numbers (wayback)")
 
-    missing = [n for n in range(1,101) if n not in {r['number'] for r in results if r['number'] is not None}]
-    print(f"[OK] wrote: {csv_path} / {raw_path}")
+    # 整理（番号順・先勝ちの重複除去は RecordStore が済ませている）
+    store.compact()
+    missing = store.missing()
+    print(f"[OK] wrote: {csv_path} / {raw_path}  (new records: {store.added})")
+    if isinstance(session, PoliteSession): print(session.summary())
+    if CDX_INDEX is not None: print(f"[CDX] prefix queries={CDX_INDEX.queries} indexed urls={len(CDX_INDEX.latest)}")
+    SNAP_CACHE.close()
+    print(SNAP_CACHE.summary())
     if missing: print(f"[NOTE] missing numbers: {missing}")
     else: print("[OK] 1..100 captured (wayback)")
 
@@ -0,0 +1,8 @@
+# scripts/ のツールは互いに素の名前で import し合う（python scripts/xxx.py で起動する前提）ので同じ検索パスを用意する
+import sys
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+for p in (SCRIPTS, SCRIPTS / "omikuji"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from kannon_extract import extract_page, extract_poem, is_poem_line, pick_poem
+
+PAGE = """<!DOCTYPE html><html><head><title> 第012籤 吉 </title><script>var x = "山水月花，雲雨";</script></head>
+<body><h1>第012籤 <b>吉</b></h1><!-- 山水月花，雲雨雪春。 -->
+<p>山水月花，雲雨雪春。</p><p>松竹梅鶴，龜龍門家。</p><p>春秋天地，人心福祿。</p><p>吉凶財寶，光明清靜。</p>
+<template><p>遠近高低，新舊天地。</p></template></body></html>"""
+
+def test_header_poem_and_skipped_content():
+    header, poem = extract_poem(PAGE)
+    assert header == "第012籤吉"
+    assert poem == ["山水月花，雲雨雪春。", "松竹梅鶴，龜龍門家。", "春秋天地，人心福祿。", "吉凶財寶，光明清靜。"]
+
+def test_title_is_the_fallback_header():
+    assert extract_poem("<title> 第3籤 </title><p>x</p>")[0] == "第3籤"
+    assert extract_poem("<p>x</p>")[0] == ""
+
+def test_fallback_text_when_no_poem():
+    header, poem, head = extract_page("<h1>第1籤</h1><p>說明</p>")
+    assert poem == [] and head == "第1籤\n說明"
+
+def test_poem_line_rules():
+    assert is_poem_line("山水月花，")
+    assert not is_poem_line("山水月花")      # 句読点なし
+    assert not is_poem_line("山水，ab")      # 漢字 4 未満
+    assert pick_poem(["山水月花，"] * 3) == ["山水月花，"] * 3
+
+# ---- BeautifulSoup(html.parser) を正とした差分テスト（bs4 が無い環境では飛ばす）----
+def bs4_extract(html):
+    """kannon_extract 導入前の実装（bs4 の get_text）"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text().strip() if soup.title else ""
+    h1 = soup.find("h1")
+    header = h1.get_text(strip=True) if h1 else title
+    text = soup.get_text("\n", strip=True)
+    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
+    return header, pick_poem(lines), text[:400]
+
+TAGS = ["p", "div", "h1", "title", "span", "template", "script", "style", "pre", "br", "b", "td", "tr", "table"]
+WORDS = ["山水月花，", "雲雨雪春。", "松竹梅鶴亀", "第012籤", " ", "\n", "  \n ", "abc", "&amp;", "<!-- c -->",
+         "<![CDATA[x]]>", "<br/>", "<p/>", "<template/>", "<!DOCTYPE html>", "<img src=x>"]
+
+def fragment(r, depth=0):
+    out = []
+    for _ in range(r.randint(1, 5)):
+        k = r.random()
+        if k < 0.4 or depth > 4:
+            out.append(r.choice(WORDS))
+        elif k < 0.5:
+            out.append(f"</{r.choice(TAGS)}>")
+        else:
+            t = r.choice(TAGS)
+            out.append(f"<{t}>" + fragment(r, depth + 1) + (f"</{t}>" if r.random() < 0.8 else ""))
+    return "".join(out)
+
+@pytest.mark.parametrize("html", [
+    "<p>a<template>b<h1>H</h1></template>c</p>",
+    "<template><title>T</title></template><p>x</p>",
+    "a<br>b</br>c",
+    "abc</br>&amp;",
+    "<pre>  \n </pre><p> \n </p>",
+])
+def test_matches_bs4_on_edge_cases(html):
+    pytest.importorskip("bs4")
+    assert extract_page(html) == bs4_extract(html)
+
+def test_matches_bs4_on_random_fragments():
+    pytest.importorskip("bs4")
+    r = random.Random(15)
+    for _ in range(2000):
+        html = fragment(r)
+        assert extract_page(html) == bs4_extract(html), html
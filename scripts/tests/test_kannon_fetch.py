@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("requests")
+from kannon_fetch import CdxIndex
+
+BASE = "https://www.chance.org.tw/籤詩集/淺草/"
+
+class Resp:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def raise_for_status(self):
+        if isinstance(self.rows, Exception):
+            raise self.rows
+
+    def json(self):
+        return self.rows
+
+class FakeSession:
+    """CDX prefix 照会の応答を順に返す（params も記録）"""
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append(params)
+        return Resp(self.pages.pop(0))
+
+def test_one_prefix_query_serves_every_url_in_the_directory():
+    s = FakeSession([["timestamp", "original"],
+                     ["20100101000000", "http://chance.org.tw:80/%E7%B1%A4%E8%A9%A9%E9%9B%86/%E6%B7%BA%E8%8D%89/1.htm"],
+                     ["20200101000000", "https://www.chance.org.tw/籤詩集/淺草/1.htm"],
+                     ["20150101000000", "https://www.chance.org.tw/籤詩集/淺草/2.htm"]])
+    idx = CdxIndex(s)
+    assert idx.covers(BASE + "1.htm") and idx.covers(BASE + "2.htm")
+    assert idx.queries == 1 and s.calls[0]["matchType"] == "prefix"
+    # scheme/www/:80/%エンコードの違いを吸収し、最新の timestamp を採る
+    assert idx.lookup(BASE + "1.htm") == "https://web.archive.org/web/20200101000000/https://www.chance.org.tw/籤詩集/淺草/1.htm"
+    assert idx.lookup(BASE + "3.htm") is None   # 読み込み済みディレクトリの None は「なし」で確定
+
+def test_resume_key_pages_are_followed():
+    s = FakeSession([["timestamp", "original"], ["20100101000000", BASE + "1.htm"], [], ["KEY"]],
+                    [["timestamp", "original"], ["20110101000000", BASE + "2.htm"]])
+    idx = CdxIndex(s)
+    assert idx.covers(BASE + "2.htm")
+    assert idx.queries == 2 and s.calls[1]["resumeKey"] == "KEY"
+    assert idx.lookup(BASE + "1.htm") and idx.lookup(BASE + "2.htm")
+
+def test_failed_prefix_query_falls_back_and_is_not_retried():
+    s = FakeSession(RuntimeError("503"))
+    idx = CdxIndex(s)
+    assert not idx.covers(BASE + "1.htm")
+    assert not idx.covers(BASE + "2.htm")
+    assert idx.queries == 1
@@ -0,0 +1,64 @@
+import csv, json
+
+from kannon_records import RecordStore
+
+def rec(n, header=None):
+    return {"number": n, "header": header or f"第{n}籤", "poem_lines": ["山水月花，", "雲雨雪春。"], "source_url": f"u{n}"}
+
+def open_store(tmp_path, resume=True):
+    return RecordStore(tmp_path / "raw.json", tmp_path / "out.csv", resume=resume)
+
+def test_add_is_first_wins_and_ignores_unnumbered(tmp_path):
+    s = open_store(tmp_path)
+    assert s.add(rec(2, "first"))
+    assert not s.add(rec(2, "second"))
+    assert not s.add({"number": None, "header": "", "poem_lines": [], "source_url": ""})
+    assert s.added == 1 and s.records[2]["header"] == "first"
+    s.close()
+
+def test_journal_replays_after_a_crash(tmp_path):
+    s = open_store(tmp_path)
+    s.add(rec(5)); s.add(rec(1))
+    s.close()   # compact せずに終わった
+    s2 = open_store(tmp_path)
+    assert s2.numbers() == {1, 5}
+    assert s2.missing(1, 6) == [2, 3, 4, 6]
+    s2.close()
+
+def test_torn_journal_tail_is_dropped_and_appending_resumes(tmp_path):
+    s = open_store(tmp_path)
+    s.add(rec(1))
+    s.close()
+    with s.log_path.open("a", encoding="utf-8") as f:
+        f.write('{"number": 2, "hea')
+    s2 = open_store(tmp_path)
+    assert s2.numbers() == {1}
+    s2.add(rec(3))
+    s2.close()
+    lines = s2.log_path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(l)["number"] for l in lines] == [1, 3]
+
+def test_compact_writes_sorted_outputs_and_clears_journal(tmp_path):
+    s = open_store(tmp_path)
+    for n in (3, 1, 2):
+        s.add(rec(n))
+    s.compact()
+    assert not s.log_path.exists()
+    raw = json.loads((tmp_path / "raw.json").read_text(encoding="utf-8"))
+    assert [r["number"] for r in raw] == [1, 2, 3]
+    with open(tmp_path / "out.csv", encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["number", "header", "poem", "source_url"]
+    assert rows[1] == ["1", "第1籤", "山水月花， / 雲雨雪春。", "u1"]
+    # compact 後の再開は raw JSON から
+    s2 = open_store(tmp_path)
+    assert s2.numbers() == {1, 2, 3}
+    assert not s2.add(rec(2))
+
+def test_resume_false_starts_fresh(tmp_path):
+    s = open_store(tmp_path)
+    s.add(rec(1))
+    s.close()
+    s2 = open_store(tmp_path, resume=False)
+    assert s2.numbers() == set()
+    assert not s2.log_path.exists()
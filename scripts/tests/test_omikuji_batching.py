@@ -0,0 +1,62 @@
+from omikuji_batching import REQUEST_OVERHEAD_TOKENS, call_split, plan_batches, poem_tokens
+
+def poem(pid, chars="山水月花風"):
+    return {"id": pid, "lines": [{"orig": chars} for _ in range(4)]}
+
+def test_plan_batches_keeps_order_and_respects_limits():
+    items = [poem(i) for i in range(1, 12)]
+    per = poem_tokens(items[0])
+    budget = REQUEST_OVERHEAD_TOKENS + per * 4
+    batches = plan_batches(items, budget, max_items=3)
+    assert [it["id"] for b in batches for it in b] == list(range(1, 12))
+    assert all(len(b) <= 3 for b in batches)
+    assert all(REQUEST_OVERHEAD_TOKENS + sum(poem_tokens(it) for it in b) <= budget for b in batches)
+
+def test_plan_batches_splits_on_token_budget_before_item_cap():
+    items = [poem(i) for i in range(1, 7)]
+    per = poem_tokens(items[0])
+    batches = plan_batches(items, REQUEST_OVERHEAD_TOKENS + per * 2, max_items=10)
+    assert [len(b) for b in batches] == [2, 2, 2]
+
+def test_plan_batches_oversized_poem_gets_its_own_batch():
+    big = poem(2, "山" * 400)
+    batches = plan_batches([poem(1), big, poem(3)], REQUEST_OVERHEAD_TOKENS + poem_tokens(poem(1)) * 2, max_items=10)
+    assert [[it["id"] for it in b] for b in batches] == [[1], [2], [3]]
+
+def test_plan_batches_empty():
+    assert plan_batches([], 1000, 5) == []
+
+def test_call_split_bisects_down_to_the_failing_poem():
+    batch = [poem(i) for i in range(1, 9)]
+
+    def fn(part, depth):
+        if any(it["id"] == 3 for it in part):
+            raise RuntimeError("bad json")
+        return {it["id"]: f"ok{it['id']}" for it in part}
+
+    results, failures, calls = call_split(fn, batch)
+    assert sorted(results) == [1, 2, 4, 5, 6, 7, 8]
+    assert [(it["id"], str(e)) for it, e in failures] == [(3, "bad json")]
+    # 8 → 4 → 2 → 1 の失敗側と、各段の成功側で 1 + 2*3 回
+    assert calls == 7
+
+def test_call_split_resends_only_missing_ids():
+    batch = [poem(i) for i in range(1, 5)]
+    seen = []
+
+    def fn(part, depth):
+        seen.append([it["id"] for it in part])
+        ids = [it["id"] for it in part]
+        return {i: i for i in ids if not (len(seen) == 1 and i == 2)}
+
+    results, failures, calls = call_split(fn, batch)
+    assert sorted(results) == [1, 2, 3, 4] and not failures
+    assert seen == [[1, 2, 3, 4], [2]]
+    assert calls == 2
+
+def test_call_split_empty_response_for_single_poem_is_a_failure():
+    results, failures, calls = call_split(lambda part, depth: {}, [poem(1), poem(2)])
+    assert results == {}
+    assert [it["id"] for it, _ in failures] == [1, 2]
+    assert all("missing in result" in str(e) for _, e in failures)
+    assert calls == 3
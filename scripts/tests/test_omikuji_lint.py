@@ -0,0 +1,41 @@
+from omikuji_lint import (EN_MAX, GATE_KINDS, JA_MAX, lint_dataset, lint_line, lint_poem, normalize_en_line,
+                          sanitize_en, scan_en)
+
+def test_scan_en_reports_each_kind_once_in_order():
+    assert scan_en("You saw Lord Yin, you saw the stupa.") == ["pronoun", "proper", "punct", "gloss:stupa"]
+    assert scan_en("wind over the pagoda") == []
+    assert scan_en("") == []
+
+def test_lint_line_empty_and_lengths():
+    assert lint_line("", "moon") == ["empty"]
+    assert lint_line("月", "x" * (EN_MAX + 1)) == ["en_long"]
+    assert lint_line("月" * (JA_MAX + 1), "moon") == ["ja_long"]
+    assert lint_line("月", "x" * 10, en_max=5) == ["en_long"]
+
+def test_lint_poem_filters_kinds_and_numbers_lines():
+    lines = [{"ja": "月", "en": "moon over the stupa"}, {"ja": "風", "en": "x" * (EN_MAX + 2)}]
+    assert lint_poem(lines) == [
+        "line1: use 'pagoda' instead of 'stupa' (glossary)",
+        f"line2: EN too long ({EN_MAX + 2})",
+    ]
+    assert lint_poem(lines, frozenset({"en_long"})) == [f"line2: EN too long ({EN_MAX + 2})"]
+
+def test_gate_kinds_ignore_non_gate_glossary_terms():
+    lines = [{"ja": "月", "en": "walk the family path"}]
+    assert lint_poem(lines) == ["line1: use 'family fortunes' instead of 'family path' (glossary)"]
+    assert lint_poem(lines, GATE_KINDS) == []
+
+def test_lint_dataset_only_reports_bad_ids():
+    data = [{"id": 1, "lines": [{"ja": "月", "en": "moon"}]}, {"id": 2, "lines": [{"ja": "月", "en": "my moon"}]}]
+    assert lint_dataset(data) == {2: ["line1: banned pronoun in EN"]}
+
+def test_sanitize_en_fixes_punct_pronouns_and_glossary():
+    assert sanitize_en("Your path, to the stupa!") == "path to the pagoda"
+    assert sanitize_en("Lord Yin guides") == "hidden grace guides"
+    out = sanitize_en("the moon and the wind that will then rise so high over the far hills")
+    assert len(out) <= EN_MAX and scan_en(out) == []
+
+def test_normalize_en_line_drops_punct_and_trims():
+    assert normalize_en_line("moon,  wind.") == "moon wind"
+    assert len(normalize_en_line("that " * 20 + "moon rises over the hills and the sea")) <= EN_MAX
+    assert normalize_en_line("") == ""
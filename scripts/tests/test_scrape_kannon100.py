@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("bs4")
+import scrape_kannon100 as sk
+from kannon_records import RecordStore
+
+def test_source_health_prefers_fast_reliable_sources():
+    good, flaky = sk.SourceHealth("good"), sk.SourceHealth("flaky")
+    assert good.score() == flaky.score() == 1.0   # 試す前は同点
+    for _ in range(3):
+        good.record(True, 0.2)
+        flaky.record(False, 0.2)
+    assert good.ok_rate == 1.0 and flaky.ok_rate < sk.AUTO_LOW_OK
+    assert good.score() > flaky.score()
+    slow = sk.SourceHealth("slow")
+    slow.record(True, 2.0)
+    assert slow.latency == 2.0 and good.score() > slow.score()
+
+def test_temples_links_by_number_reads_text_or_href_first_wins():
+    html = ('<a href="/stick/a">第3籤</a><a href="/stick/第5籤">詳細</a>'
+            '<a href="/stick/b">第3籤 別</a><a href="/about">about</a>')
+    links = sk.temples_links_by_number(html, "https://temples.tw/stick")
+    assert links == {3: "https://temples.tw/stick/a", 5: "https://temples.tw/stick/第5籤"}
+
+def page(n):
+    return f"<h1>第{n:03d}籤</h1><p>山水月花，雲雨雪春。</p><p>松竹梅鶴，龜龍門家。</p>"
+
+@pytest.fixture
+def fake_wayback(monkeypatch):
+    """chance は #5/#6 だけ取れない。temples は索引から全番号に行ける"""
+    fetched = []
+    index = "".join(f'<a href="/stick/{n}">第{n}籤</a>' for n in range(1, 101))
+
+    def fetch(session, url, timeout=20):
+        fetched.append(url)
+        if url == sk.SITES["temples"]["index"]:
+            return index
+        if url.startswith("https://temples.tw/stick/"):
+            return page(int(url.rsplit("/", 1)[1]))
+        n = next(n for n in range(1, 101) if sk.chance_url(n) == url)
+        if n in (5, 6):
+            raise RuntimeError("no snapshot")
+        return page(n)
+
+    monkeypatch.setattr(sk, "fetch_with_wayback_only", fetch)
+    monkeypatch.setattr(sk, "SNAP_CACHE", None)
+    return fetched
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_auto_routes_failed_numbers_to_the_other_source(fake_wayback, workers):
+    results = sk.run_auto_wayback(None, delay=0, workers=workers)
+    by_num = {r["number"]: r["source_url"] for r in results}
+    assert sorted(by_num) == list(range(1, 101))
+    assert by_num[5] == "https://temples.tw/stick/5" and by_num[6] == "https://temples.tw/stick/6"
+    if workers == 1:
+        # 失敗が続いた chance は ok_rate が下がり、以降は temples が先に試される（並列時は到着順次第なので見ない）
+        assert by_num[1] == sk.chance_url(1) and by_num[100] == "https://temples.tw/stick/100"
+
+def test_auto_skips_numbers_already_in_the_store(fake_wayback, tmp_path):
+    store = RecordStore(tmp_path / "raw.json", tmp_path / "out.csv")
+    for n in range(1, 99):
+        store.add({"number": n, "header": "", "poem_lines": [], "source_url": "old"})
+    results = sk.run_auto_wayback(None, delay=0, workers=1, store=store)
+    assert sorted(r["number"] for r in results) == [99, 100]
+    assert fake_wayback == [sk.chance_url(99), sk.chance_url(100)]
+    store.close()
@@ -0,0 +1,85 @@
+import json, sys
+
+import pytest
+
+import sync_omikuji
+from sync_omikuji import build_alias_index, iter_blocks, map_by_id, normalize_categories, parse_id, split_entries
+
+CORE = [{"id": i, "rank": "吉", "poem_kanji": ["山水月花風", "雲雨雪春秋", "松竹梅鶴亀", "龍虎門家道"]} for i in (1, 2, 3)]
+JA_BAK = "第一　吉\n山水月花風\n願望：叶う\n\n第二　吉\n病気：治る\n\n第三　吉\n失物：出る\n"
+EN_BAK = "1: Good\nWish: granted\n\n2: Good\nIllness: heals\n\n3: Good\nLost: found\n"
+
+def test_parse_id_forms():
+    assert [parse_id(h) for h in ("第一　吉", "第十二", "第二十", "第百", "第45", "7: Good", "x")] == [1, 12, 20, 100, 45, 7, None]
+
+def test_entries_and_alias_normalization():
+    by_id = map_by_id(split_entries(JA_BAK))
+    assert sorted(by_id) == [1, 2, 3] and by_id[2].startswith("第二")
+    alias = build_alias_index({"願望": ["願い事", "願事"], "待人": ["願事"]})
+    assert alias["願事"] == "願望"   # 重複した別名は先の正式名が勝つ
+    assert normalize_categories("願い事：叶う\n本文", alias) == "願望：叶う\n本文"
+
+def blocks(prev=None, state=None, core=CORE, ja_bak=JA_BAK):
+    report = {"total": 0, "rank_overrides": [], "missing_in_bak": []}
+    by_id = {c["id"]: c for c in core}
+    return list(iter_blocks(by_id, {}, {"吉": "Good Fortune"}, map_by_id(split_entries(ja_bak)),
+                            map_by_id(split_entries(EN_BAK)), {}, {}, report, prev=prev, state=state))
+
+def test_iter_blocks_reuses_prev_blocks_when_inputs_match():
+    state = {}
+    fresh = blocks(state=state)
+    assert fresh[0][0].startswith("第一　吉\n山水月花風") and fresh[0][1].startswith("First: Good Fortune")
+    # 入力ハッシュが同じなら組み立てずに保存済みブロックを返す（中身を差し替えて確かめる）
+    prev = {k: dict(v, ja=f"cached-ja-{k}", en=f"cached-en-{k}") for k, v in state.items()}
+    state2 = {}
+    reused = blocks(prev=prev, state=state2)
+    assert reused == [(f"cached-ja-{i}", f"cached-en-{i}") for i in ("1", "2", "3")]
+    assert {k: v["hash"] for k, v in state2.items()} == {k: v["hash"] for k, v in state.items()}
+
+def test_iter_blocks_rebuilds_only_changed_ids():
+    state = {}
+    blocks(state=state)
+    prev = {k: dict(v, ja="cached", en="cached") for k, v in state.items()}
+    out = blocks(prev=prev, ja_bak=JA_BAK.replace("病気：治る", "病気：長引く"))
+    assert out[0] == ("cached", "cached") and out[2] == ("cached", "cached")
+    assert "病気：長引く" in out[1][0]
+
+@pytest.fixture
+def run_sync(tmp_path, monkeypatch):
+    (tmp_path / "core.json").write_text(json.dumps(CORE, ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "rank_map.json").write_text("{}", encoding="utf-8")
+    (tmp_path / "rank_en.json").write_text(json.dumps({"吉": "Good Fortune"}, ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "en.bak").write_text(EN_BAK, encoding="utf-8")
+    state = tmp_path / "cache" / "state.json"
+
+    def run(ja_bak=JA_BAK, incremental=True):
+        (tmp_path / "ja.bak").write_text(ja_bak, encoding="utf-8")
+        argv = ["sync_omikuji.py", "--core", str(tmp_path / "core.json"), "--rankmap", str(tmp_path / "rank_map.json"),
+                "--ja_bak", str(tmp_path / "ja.bak"), "--en_bak", str(tmp_path / "en.bak"),
+                "--rank_en_map", str(tmp_path / "rank_en.json"), "--out_dir", str(tmp_path / "out"), "--state", str(state)]
+        monkeypatch.setattr(sys, "argv", argv + (["--incremental"] if incremental else []))
+        sync_omikuji.main()
+        changes = tmp_path / "out" / "sync_changes.json"
+        return json.loads(changes.read_text(encoding="utf-8")) if incremental else None
+
+    run.out, run.state = tmp_path / "out", state
+    return run
+
+def test_plain_run_writes_no_state(run_sync):
+    run_sync(incremental=False)
+    assert sorted(p.name for p in run_sync.out.iterdir()) == ["en.txt", "ja.txt", "sync_report.json"]
+    assert not run_sync.state.exists()
+
+def test_incremental_run_reports_changed_ids_and_skips_unchanged_writes(run_sync):
+    first = run_sync()
+    assert first["changed_ids"] == [1, 2, 3] and first["rewritten"] == ["ja.txt", "en.txt", "sync_report.json"]
+    assert run_sync.state.exists() and not (run_sync.out / ".sync_state.json").exists()
+
+    mtime = (run_sync.out / "ja.txt").stat().st_mtime_ns
+    again = run_sync()
+    assert again == {"changed_ids": [], "removed_ids": [], "rewritten": []}
+    assert (run_sync.out / "ja.txt").stat().st_mtime_ns == mtime
+
+    edited = run_sync(JA_BAK.replace("失物：出る", "失物：出ない"))
+    assert edited["changed_ids"] == [3] and edited["rewritten"] == ["ja.txt"]
+    assert "失物：出ない" in (run_sync.out / "ja.txt").read_text(encoding="utf-8")
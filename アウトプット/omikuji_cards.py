@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 # 特別な御籤カード20枚を生成（本物の御籤の漢詩＋和訳＋神秘的アート背景）
-import os, json, random, textwrap
+import os, json, random, textwrap, sys
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 
+# 縮小前提の読み込み（JPEG は DCT 段階で縮小デコード）は scripts/image_loader.py を共用
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from image_loader import open_reduced
+
 OUT = "/sessions/eloquent-lucid-lovelace/mnt/outputs"
 OD = "/tmp/omikuji_cards"; os.makedirs(OD, exist_ok=True)
 omi = json.load(open("/sessions/eloquent-lucid-lovelace/mnt/musiam-front/src/data/omikuji/abi.json", encoding="utf-8"))
@@ -19,7 +23,7 @@ covers = [m["cover"] for m in man]
 def bg(cover):
     base = Image.new("RGB",(W,H),(10,8,18))
     try:
-        im=Image.open(cover).convert("RGB")
+        im,_=open_reduced(cover,cover=(W,H))
         s=max(W/im.width,H/im.height); im=im.resize((int(im.width*s)+1,int(im.height*s)+1),Image.LANCZOS)
         im=im.crop((0,0,W,H)); im=im.filter(ImageFilter.GaussianBlur(22)); im=ImageEnhance.Brightness(im).enhance(0.32)
         base.paste(im,(0,0))
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 # 売店8商品の商品画像（1200x1200）を本物のジャケットアートのコラージュから生成
-import os, json, random
+import os, json, random, sys
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 
+# 縮小前提の読み込み（JPEG は DCT 段階で縮小デコード）は scripts/image_loader.py を共用
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from image_loader import open_reduced
+
 OUT = "/sessions/eloquent-lucid-lovelace/mnt/outputs"
 OD = os.path.join(OUT, "product_images"); os.makedirs(OD, exist_ok=True)
 MAN = json.load(open(f"{OUT}/art_manifest.json", encoding="utf-8"))
@@ -22,7 +26,7 @@ def collage(n=6):
     pics = random.sample(covers, min(n*n, len(covers)))
     for i, p in enumerate(pics):
         try:
-            im = Image.open(p).convert("RGB")
+            im, _ = open_reduced(p, cover=(cell, cell))
         except Exception:
             continue
         s = max(cell/im.width, cell/im.height)
@@ -36,7 +40,7 @@ def collage(n=6):
 def hero(path):
     base = collage(6)
     try:
-        im = Image.open(path).convert("RGB")
+        im, _ = open_reduced(path, fit=(620, 620))
         im.thumbnail((620, 620), Image.LANCZOS)
         x = (SZ-im.width)//2; y = 250
         sh = Image.new("RGB", (im.width+30, im.height+30), (0,0,0))
@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 # 高解像度カバーから壁紙セット（スマホ/PC）を生成。再開可能（既存スキップ）。
-import os, json, re
+import os, json, re, sys
 from PIL import Image, ImageFilter, ImageEnhance
 
+# 縮小前提の読み込み（JPEG は DCT 段階で縮小デコード）は scripts/image_loader.py を共用
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from image_loader import open_reduced
+
 OUT = "/sessions/eloquent-lucid-lovelace/mnt/outputs"
 MAN = sorted(json.load(open(os.path.join(OUT, "art_manifest.json"), encoding="utf-8")),
              key=lambda x: x["title"].lower())
 PHONE = (1080, 1920)
 PC = (1920, 1080)
+FG_RATIO = {PHONE: 0.86, PC: 0.78}
+# カバーは前景（compose の thumbnail）の最大サイズ以上あれば足りる（背景はさらに小さい 480px）
+COVER_BOX = max(int(min(s) * r) for s, r in FG_RATIO.items())
 DPHONE = os.path.join(OUT, "_wallpapers", "phone-1080x1920")
 DPC = os.path.join(OUT, "_wallpapers", "pc-1920x1080")
 for d in (DPHONE, DPC):
@@ -53,14 +60,14 @@ for i, item in enumerate(MAN, 1):
     if os.path.exists(pf) and os.path.exists(pc):
         continue
     try:
-        cover = Image.open(item["cover"]).convert("RGB")
+        cover, _ = open_reduced(item["cover"], fit=(COVER_BOX, COVER_BOX))
     except Exception as e:
         print("SKIP", item["title"], e, flush=True)
         continue
     if not os.path.exists(pf):
-        compose(cover, PHONE, 0.86).save(pf, "JPEG", quality=88)
+        compose(cover, PHONE, FG_RATIO[PHONE]).save(pf, "JPEG", quality=88)
     if not os.path.exists(pc):
-        compose(cover, PC, 0.78).save(pc, "JPEG", quality=88)
+        compose(cover, PC, FG_RATIO[PC]).save(pc, "JPEG", quality=88)
     done += 1
     if done % 30 == 0:
         print(f"...{i}/{len(MAN)}", flush=True)